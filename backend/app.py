@@ -1,183 +1,317 @@
 import cv2
-import mediapipe as mp
 import numpy as np
 import math
-# import pyvirtualcam
+import os
 import numpy.typing as npt
 import threading
-from backend.library import alphaZeroCut
+import time
+from backend.library import alphaZeroCut, transformBounds, resizeLongSide
+from backend.compositing import AlphaCompositor
+from backend.asset_store import AssetPrefetcher, AssetStore
+from backend.catalog import Catalog, DEFAULT_FIT, DEFAULT_PARTS
+from backend.sprite_cache import SpriteCache
+from backend.pose_pool import PoseWorkerPool
+from backend.pipeline import DropOldestQueue, FramePacket, LatencyRecorder
+from backend.frame_exchange import FrameExchange
+from backend.frame_source import CameraSource, openFrameSource
+from backend.landmarks import X, Y, VISIBILITY, PoseLandmark, landmarksToArray, createLandmarkFilter
+from backend.pose_tracking import InferenceScheduler, PersonRoiTracker, createPredictor
+from backend.background import BackgroundReplacer
+from backend.occlusion import OcclusionMasker
+from backend.metrics import Metrics, formatMetrics, timedMethod
+from backend.sinks import OutputSink, createSink
 
 class Config:
     """設定値を管理するクラス"""
     CAMERA_INDEX = 0
-    SHIRT_ASSETS_PATH = 'assets/shirt'
-    SUIT_ASSETS_PATH = 'assets/suit'
+    CAMERA_WARMUP_FRAMES = 3 # カメラを切り替えるときに、差し替える前に読み捨てるフレーム数 (露出などが安定するまで)
+    CAMERA_OPEN_TIMEOUT = 5.0 # カメラを切り替えるときに、最初のフレームを待つ時間の上限 (秒)
+    CAMERA_READ_RETRY_INTERVAL = 0.01 # カメラを切り替えるときに、フレームを読めなかった後で読み直すまでの待ち時間 (秒)
+    CAMERA_MAX_READ_FAILURES = 30 # カメラを切り替えるときに、続けてこの回数だけ読めなければ開けなかったとみなす
+    CATALOG_PATH = 'assets/catalog.json' # 衣装カタログ (パーツ画像・基準点・拡大率は衣装ごとにここで指定する)
+    DEFAULT_CLOTH = 'suit' # 起動時に試着する衣装のid
 
     # 描画パラメータ
-    SUIT_SHOULDER_WIDTH_RATIO = 0.8  # 画像内の肩幅の比率 (1.0に近い値で肩にフィット)
-    SUIT_SHOULDER_LINE_RATIO = 0.1  # 回転中心のY座標の比率 (画像の上辺から何%の位置か)
-    SUIT_UPWARD_SHIFT_RATIO = 0.15 # 画像を上方向にシフトさせるオフセット率 (大きいほど上に移動)
     ROTATION_MARGIN_RATIO = 1.4  # 回転時に画像がはみ出さないように確保する余白の比率
-    UPPER_ARM_SCALE_FACTOR = 1.5  # 上腕画像の拡大率
-    FOREARM_SCALE_FACTOR = 1.2  # 前腕画像の拡大率
-    FULLBODY_SCALE_FACTOR = 0.7 # fullbody画像の拡大率
     MIN_VISIBILITY_THRESHOLD = 0.5 # 関節の信頼度スコアの閾値(どれくらいはっきり検出できるか)
     # 腕の描画に関するパラメータ
     LIMB_DEFAULT_LENGTH_SHOULDER_WIDTH_RATIO = 1.2 # 肩幅に対する腕のデフォルト長の比率
     LIMB_INVISIBLE_OFFSET_X = 50 # 関節が見えない場合に腕を外側に描画するためのオフセット
-    UPPER_ARM_ROTATION_CENTER_Y_RATIO = 0.1 # 上腕の回転中心のY座標比率
     LIMB_FALLBACK_DEFAULT_LENGTH_DENOMINATOR = 5 # 肩が検出できない場合の腕の長さ (身長に対する分母)
+    # アセットの読み込みに関するパラメータ
+    ASSET_CACHE_DIR = '.asset_cache' # デコード済みのパーツ画像 (.npy) を保存するディレクトリ
+    ASSET_MAX_BYTES = 512 * 1024 * 1024 # 読み込んだままにしておく衣装の合計サイズの上限
+    ASSET_USE_MMAP = True # Trueならキャッシュをメモリマップで開く (参照した部分だけがメモリに載る)
+    ASSET_PREFETCH_NEIGHBORS = 1 # 切り替え順で前後それぞれ何着を先読みしておくか
+    # 合成処理に関するパラメータ
+    COMPOSITE_USE_CV2 = False # Trueならアルファ合成にcv2の飽和演算を使う (Falseなら NumPy の固定小数点演算)
+    # 変形済み画像のキャッシュに関するパラメータ
+    SPRITE_CACHE_MAX_BYTES = 256 * 1024 * 1024 # キャッシュするパーツ画像の合計サイズの上限 (プロセス全体で共有)
+    SPRITE_CACHE_MIN_ENTRIES = 64 # 上限の中に少なくともこの数の画像を保持できるよう、大きすぎる画像はキャッシュせずに毎回生成する
+    SPRITE_ANGLE_STEP = 2.0 # キャッシュキーとする回転角の量子化幅 (度、描画される角度の誤差は最大でこの半分)
+    SPRITE_SCALE_STEP = 0.04 # キャッシュキーとする拡大率の量子化幅 (相対値、対数スケール)
+    # パイプライン処理に関するパラメータ
+    PIPELINE_QUEUE_SIZE = 1 # ステージ間キューの長さ (あふれた場合は古いフレームから捨てる)
+    PIPELINE_LATENCY_HISTORY = 120 # 遅延の統計に使う直近のフレーム数
+    # 姿勢推定の間引きに関するパラメータ
+    POSE_INFERENCE_INTERVAL = 1 # 姿勢推定を行うフレーム間隔 (1なら毎フレーム推定する)
+    POSE_MOTION_THRESHOLD = 6.0 # 前回の推定時からの画素値の平均変化量(0〜255)がこれを超えたら間隔に関わらず推定する (Noneで無効)
+    POSE_PREDICTOR = "constant_velocity" # 推定を省略したフレームのランドマークの予測方法 ("hold" / "constant_velocity" / "kalman")
+    POSE_MAX_EXTRAPOLATION = 0.2 # ランドマークを外挿する最大時間 (秒)
+    POSE_KALMAN_PROCESS_NOISE = 1.0 # カルマンフィルタのプロセスノイズ (加速度の分散)
+    POSE_KALMAN_MEASUREMENT_NOISE = 1e-4 # カルマンフィルタの観測ノイズ (正規化座標の分散)
+    POSE_INFERENCE_LONG_SIDE = None # 姿勢推定に使う画像の長辺 [px] (例: 256, 384。Noneならカメラの解像度のまま推定する)
+    # 姿勢推定のワーカープロセスに関するパラメータ
+    POSE_WORKER_PROCESSES = 0 # 1以上ならこの数のワーカープロセスで姿勢推定を行う (0ならこのプロセス内で推定する。2以上ならワーカーは MediaPipe の追跡を行わずに毎フレーム検出する)
+    POSE_WORKER_MAX_IN_FLIGHT = None # ワーカープロセスに同時に依頼するフレーム数の上限 (Noneならワーカープロセス数)
+    # 起動に関するパラメータ
+    STARTUP_PARALLEL = None # Trueならモデルの生成・カメラのオープン・衣装の読み込みを並行して行う (Noneなら CPU が1コアの場合はカメラのオープンだけを並行して行う)
+    POSE_WARMUP = True # Trueなら起動時に黒画像で1回推定し、最初のフレームで推定器の初期化を待たないようにする
+    POSE_WARMUP_SIZE = (640, 360) # 起動時の推定に使う黒画像の大きさ (幅, 高さ)
+    # 人物領域の追跡に関するパラメータ
+    POSE_ROI_TRACKING = False # Trueなら前回の人物領域の周辺だけを切り出して姿勢推定する
+    POSE_ROI_PADDING = 0.3 # 人物領域の周囲に加える余白 (領域の長辺に対する比率)
+    POSE_ROI_MAX_AREA_RATIO = 0.8 # 切り出す領域がフレームのこの割合を超える場合はフレーム全体で推定する
+    # ランドマークの平滑化に関するパラメータ
+    LANDMARK_FILTER = "one_euro" # ランドマークの平滑化方法 (None / "one_euro" / "kalman")
+    ONE_EURO_MIN_CUTOFF = 1.0 # One-Euroフィルタの最小カットオフ周波数 (Hz、小さいほど静止時の揺れを抑える)
+    ONE_EURO_BETA = 10.0 # One-Euroフィルタの速度係数 (大きいほど速い動きへの追従遅れを抑える)
+    ONE_EURO_D_CUTOFF = 1.0 # One-Euroフィルタの速度推定のカットオフ周波数 (Hz)
+    # 背景の置き換えに関するパラメータ
+    BACKGROUND_MODE = None # 背景の置き換え方 (None: 置き換えない / "color": 単色 / "image": 静止画 / "blur": ぼかし)
+    BACKGROUND_COLOR = (0, 255, 0) # 単色の背景色 (B, G, R)
+    BACKGROUND_IMAGE_PATH = None # 静止画の背景のパス
+    BACKGROUND_SEGMENTATION_LONG_SIDE = 256 # 人物のセグメンテーションに使う画像の長辺 [px]
+    BACKGROUND_THRESHOLD = 0.3 # 人物とみなすマスク値 (0〜1) の閾値
+    BACKGROUND_FEATHER = 7 # 人物の境界をぼかすカーネルの大きさ (セグメンテーション解像度での px、奇数)
+    BACKGROUND_BLUR_KSIZE = 21 # 背景をぼかすカーネルの大きさ (セグメンテーション解像度での px、奇数)
+    # 腕による遮蔽に関するパラメータ
+    OCCLUSION_ENABLED = False # Trueなら胴体より手前にある腕の領域には胴体の衣装を描画しない
+    OCCLUSION_LONG_SIDE = 192 # 遮蔽マスクを求める解像度 (長辺 [px])
+    OCCLUSION_ARM_WIDTH_RATIO = 0.35 # 肩幅に対する腕の太さの比率
+    OCCLUSION_DEPTH_MARGIN = 0.1 # 肩より手前にあるとみなす奥行きの差 (MediaPipeの正規化座標)
+    OCCLUSION_SEGMENTATION_INTERVAL = 3 # 遮蔽マスク用のセグメンテーションを行うフレーム間隔 (間のフレームは前回の結果を変形して使う)
+    # 映像の出力先に関するパラメータ
+    OUTPUT_SINKS = () # 描画済みフレームの出力先 ("virtual_camera": 仮想カメラ / "window": OpenCVのウィンドウ / "file": 動画ファイル / "recording": 録画 / "null")
+    VIRTUAL_CAMERA_FPS = 30.0 # 仮想カメラのフレームレート
+    OUTPUT_FILE_PATH = 'output.mp4' # "file" の出力先のパス
+    OUTPUT_FILE_FOURCC = 'mp4v' # "file" のコーデック
+    # 録画 ("recording") に関するパラメータ
+    RECORDING_PATH = 'recordings/tryon_{time}_{index:03d}.mp4' # 録画ファイルのパス ({time}: 開始時刻、{index}: ファイルの通し番号)
+    RECORDING_FOURCC = 'mp4v' # 録画のコーデック ("mp4v", "avc1", "MJPG" など)
+    RECORDING_FPS = 30.0 # 録画のフレームレート
+    RECORDING_SIZE = None # 録画の解像度 (幅, 高さ)。Noneならカメラの解像度のまま
+    RECORDING_POLICY = "drop" # エンコードが追いつかない場合の方針 ("drop": 古いフレームを捨てる / "block": 描画を待たせる)
+    RECORDING_QUEUE_SIZE = 8 # エンコード待ちにしておくフレーム数
+    RECORDING_MAX_BYTES = None # この大きさ [byte] を超えたら次のファイルに切り替える (Noneなら切り替えない)
+    RECORDING_MAX_SECONDS = 600 # この記録時間 [秒] を超えたら次のファイルに切り替える (Noneなら切り替えない)
+    RECORDING_HW_ACCELERATION = True # Trueならハードウェアエンコーダーを使えるか試す
+    # 処理時間の計測に関するパラメータ
+    METRICS_ENABLED = True # Trueなら各処理区間の所要時間と、推定の失敗などの回数を集計する
+    METRICS_HISTORY = 300 # 区間ごとに統計に使う直近の測定数
+    METRICS_HUD = False # Trueなら計測結果を映像の左上に表示する
+    METRICS_LOG_INTERVAL = None # 計測結果をコンソールに出力する間隔 (秒、Noneなら出力しない)
+    METRICS_HUD_SPANS = ("capture", "pose_process", "draw", "publish", "display") # HUD・ログに表示する区間
 
 class BodyPartDrawer:
     """身体パーツの描画を担当するクラス"""
 
-    def __init__(self):
-        """初期化"""
-        self.mp_pose = mp.solutions.pose
+    def __init__(self, metrics=None):
+        """
+        初期化
+        metrics: 描画の所要時間を記録する Metrics (省略時は計測しない)
+        """
+        self.metrics = metrics if metrics is not None else Metrics(enabled=False)
+        self.compositor = AlphaCompositor(use_cv2=Config.COMPOSITE_USE_CV2)
+        # 変形済みパーツ画像のキャッシュ (同一プロセス内の全インスタンスで共有)
+        self.sprite_cache = SpriteCache.shared(Config.SPRITE_CACHE_MAX_BYTES, Config.SPRITE_CACHE_MIN_ENTRIES)
 
-    def _overlay_png(self, background_img, foreground_img, pos):
+    def _overlay_png(self, background_img, foreground_img, pos, mask=None):
         """
         背景画像にアルファチャンネル付きのPNG画像を重ねて表示する。
+        foreground_img はアルファ乗算済み(premultiplied)であること。
         pos: (x, y) - 重ねて表示する左上の座標
+        mask: 背景画像と同じ大きさの (H, W) の uint8 (0の画素には描画しない)
         """
-        x, y = pos
-        bg_h, bg_w, _ = background_img.shape
-        fg_h, fg_w, _ = foreground_img.shape
-
-        # 画面外なら処理しない
-        if x >= bg_w or y >= bg_h or x + fg_w <= 0 or y + fg_h <= 0:
-            return
-
-        # 重ね合わせる領域を計算
-        roi_y1, roi_y2 = max(0, y), min(bg_h, y + fg_h)
-        roi_x1, roi_x2 = max(0, x), min(bg_w, x + fg_w)
-        fg_roi_y1, fg_roi_y2 = max(0, -y), max(0, -y) + (roi_y2 - roi_y1)
-        fg_roi_x1, fg_roi_x2 = max(0, -x), max(0, -x) + (roi_x2 - roi_x1)
-        
-        roi = background_img[roi_y1:roi_y2, roi_x1:roi_x2]
-        fg_roi = foreground_img[fg_roi_y1:fg_roi_y2, fg_roi_x1:fg_roi_x2]
-        
-        if roi.size == 0 or fg_roi.size == 0:
-            return
+        self.compositor.overlay(background_img, foreground_img, pos, mask)
 
-        # アルファブレンディング
-        fg_rgb = fg_roi[:, :, :3]
-        alpha = np.expand_dims(fg_roi[:, :, 3] / 255.0, axis=2)
-        blended_roi = (fg_rgb * alpha) + (roi * (1 - alpha))
-        background_img[roi_y1:roi_y2, roi_x1:roi_x2] = blended_roi.astype(np.uint8)
+    def _rotation_matrix(self, image_size, angle, rotation_center, margin_ratio, use_hypot_for_canvas=False):
+        """回転行列と、画像がはみ出さないように調整したキャンバスの大きさを求める"""
+        w, h = image_size
 
-    def _rotate_image(self, image, angle, rotation_center, margin_ratio, use_hypot_for_canvas=False):
-        """画像を回転させ、はみ出さないようにキャンバスを調整する"""
-        h, w = image.shape[:2]
-        
         if use_hypot_for_canvas:
             canvas_dim = int(math.hypot(w, h) * margin_ratio)
             canvas_width, canvas_height = canvas_dim, canvas_dim
         else:
             canvas_width = int(w * margin_ratio)
             canvas_height = int(h * margin_ratio)
-            
+
         rotation_matrix = cv2.getRotationMatrix2D(rotation_center, angle, 1.0)
         # 回転中心をキャンバスの中心に合わせる補正
         rotation_matrix[0, 2] += (canvas_width / 2) - rotation_center[0]
         rotation_matrix[1, 2] += (canvas_height / 2) - rotation_center[1]
+        return rotation_matrix, (canvas_width, canvas_height)
+
+    def _rotate_image(self, image, angle, rotation_center, margin_ratio, use_hypot_for_canvas=False):
+        """画像を回転させ、はみ出さないようにキャンバスを調整する"""
+        h, w = image.shape[:2]
+        rotation_matrix, canvas_size = self._rotation_matrix((w, h), angle, rotation_center, margin_ratio, use_hypot_for_canvas)
 
-        rotated_image = cv2.warpAffine(image, rotation_matrix, (canvas_width, canvas_height),
+        rotated_image = cv2.warpAffine(image, rotation_matrix, canvas_size,
                                        flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0, 0))
         return rotated_image
 
-    def draw_torso(self, frame, landmarks, body_image, scale_factor=1.0):
-        """検出されたポーズに合わせて、フレームに胴体を描画する"""
-        if not landmarks:
+    def _trim_sprite(self, sprite):
+        """
+        透明な余白を切り取った画像と、元の画像内での位置 (x, y) を返す (すべて透明なら None)
+        回転用のキャンバスは余白が大きいため、キャッシュする画像と合成する範囲を小さくする
+        """
+        x, y, w, h = cv2.boundingRect(np.ascontiguousarray(sprite[:, :, 3]))
+        if w == 0 or h == 0:
+            return None
+        # 切り取った部分だけを保持する (スライスのままだとキャンバス全体が残る)
+        return sprite[y:y + h, x:x + w].copy(), (x, y)
+
+    def _quantize(self, angle, scale):
+        """角度と拡大率をキャッシュキー用の整数に量子化する"""
+        angle_index = int(round(angle / Config.SPRITE_ANGLE_STEP))
+        scale_index = int(round(math.log(scale) / math.log1p(Config.SPRITE_SCALE_STEP)))
+        return angle_index, scale_index
+
+    def _get_sprite(self, sprite_key, angle, scale, mirror, factory):
+        """
+        変形済みのパーツ画像をキャッシュから取得する。なければ factory(angle, scale) で生成する
+        sprite_key: (衣装名, パーツ名) - Noneの場合はキャッシュせず、量子化もしない
+        """
+        if sprite_key is None:
+            return factory(angle, scale)
+        angle_index, scale_index = self._quantize(angle, scale)
+        key = (*sprite_key, angle_index, scale_index, mirror)
+        return self.sprite_cache.get_or_create(
+            key,
+            lambda: factory(angle_index * Config.SPRITE_ANGLE_STEP, math.pow(1.0 + Config.SPRITE_SCALE_STEP, scale_index)))
+
+    @timedMethod("draw_torso")
+    def draw_torso(self, frame, landmarks, body_image, scale_factor=1.0, sprite_key=None, opaque_hull=None, occlusion_mask=None,
+                   anchor=None, upward_shift_ratio=None, shoulder_width_ratio=None):
+        """
+        検出されたポーズに合わせて、フレームに胴体を描画する
+        scale_factor: 肩幅に合わせた大きさに掛ける倍率
+        opaque_hull: 読み込み時に求めた不透明領域の凸包 (指定すると回転後の透明部分の走査を省略する)
+        occlusion_mask: フレームと同じ大きさの (H, W) の uint8 (0の画素は手前の腕が見えるように描画しない)
+        anchor: 回転中心 (画像の幅・高さに対する比率)、upward_shift_ratio: 画像を上方向にずらす量 (画像の高さに対する比率)
+        shoulder_width_ratio: 画像の幅に対する肩幅の比率 (1.0に近い値で肩にフィット)
+                省略時はカタログの既定値
+        """
+        anchor = anchor if anchor is not None else DEFAULT_PARTS["torso"]["anchor"]
+        upward_shift_ratio = upward_shift_ratio if upward_shift_ratio is not None else DEFAULT_FIT["upward_shift_ratio"]
+        shoulder_width_ratio = shoulder_width_ratio if shoulder_width_ratio is not None else DEFAULT_FIT["shoulder_width_ratio"]
+        if landmarks is None:
             return
         
         # 1. 両肩の座標を取得
         frame_height, frame_width, _ = frame.shape
-        left_shoulder_lm = landmarks.landmark[self.mp_pose.PoseLandmark.LEFT_SHOULDER.value]
-        right_shoulder_lm = landmarks.landmark[self.mp_pose.PoseLandmark.RIGHT_SHOULDER.value]
+        left_shoulder_lm = landmarks[PoseLandmark.LEFT_SHOULDER]
+        right_shoulder_lm = landmarks[PoseLandmark.RIGHT_SHOULDER]
 
-        if not (left_shoulder_lm.visibility > Config.MIN_VISIBILITY_THRESHOLD and right_shoulder_lm.visibility > Config.MIN_VISIBILITY_THRESHOLD):
+        if not (left_shoulder_lm[VISIBILITY] > Config.MIN_VISIBILITY_THRESHOLD and right_shoulder_lm[VISIBILITY] > Config.MIN_VISIBILITY_THRESHOLD):
             return
 
         # 2. 肩のピクセル座標と中心、幅、傾きを計算
-        left_shoulder_x, left_shoulder_y = int(left_shoulder_lm.x * frame_width), int(left_shoulder_lm.y * frame_height)
-        right_shoulder_x, right_shoulder_y = int(right_shoulder_lm.x * frame_width), int(right_shoulder_lm.y * frame_height)
+        left_shoulder_x, left_shoulder_y = int(left_shoulder_lm[X] * frame_width), int(left_shoulder_lm[Y] * frame_height)
+        right_shoulder_x, right_shoulder_y = int(right_shoulder_lm[X] * frame_width), int(right_shoulder_lm[Y] * frame_height)
 
         shoulder_center_x = (left_shoulder_x + right_shoulder_x) // 2
         shoulder_center_y = (left_shoulder_y + right_shoulder_y) // 2
         detected_shoulder_width = abs(right_shoulder_x - left_shoulder_x)
         angle = math.degrees(math.atan2(left_shoulder_y - right_shoulder_y, left_shoulder_x - right_shoulder_x))
 
-        # 旧3. ボディ画像のサイズを肩幅に合わせてスケーリング
+        # 3. ボディ画像のサイズを肩幅に合わせてスケーリング
         original_suit_height, original_suit_width, _ = body_image.shape
-        # assumed_suit_shoulder_width = original_suit_width * Config.SUIT_SHOULDER_WIDTH_RATIO
-        # scale = detected_shoulder_width / assumed_suit_shoulder_width if assumed_suit_shoulder_width > 0 else 1.0
-        # scale *= scale_factor
-        
-        # new_suit_width = int(original_suit_width * scale)
-        # new_suit_height = int(original_suit_height * scale)
-        # if new_suit_width <= 0 or new_suit_height <= 0:
-        #     return
-        # scaled_suit = cv2.resize(body_image, (new_suit_width, new_suit_height))
+        assumed_suit_shoulder_width = original_suit_width * shoulder_width_ratio
+        scale = detected_shoulder_width / assumed_suit_shoulder_width if assumed_suit_shoulder_width > 0 else 1.0
+        scale *= scale_factor
+        if int(original_suit_width * scale) <= 0 or int(original_suit_height * scale) <= 0:
+            return
 
-        # 旧4. ボディ画像を肩の傾きに合わせて回転
-        # rotation_center = (new_suit_width // 2, int(new_suit_height * Config.SUIT_SHOULDER_LINE_RATIO))
-        # rotated_suit = self._rotate_image(scaled_suit, angle, rotation_center, Config.ROTATION_MARGIN_RATIO)
+        # 4. ボディ画像を肩の傾きに合わせて回転し、鏡像に合わせて左右反転 (キャッシュ済みなら再利用)
+        def render_torso(angle, scale):
+            new_suit_width, new_suit_height = int(original_suit_width * scale), int(original_suit_height * scale)
+            if new_suit_width <= 0 or new_suit_height <= 0:
+                return None
+            scaled_suit = cv2.resize(body_image, (new_suit_width, new_suit_height), interpolation=cv2.INTER_AREA if scale < 1.0 else cv2.INTER_LINEAR)
+            rotation_center = (int(new_suit_width * anchor[0]), int(new_suit_height * anchor[1]))
+            rotated_suit = self._rotate_image(scaled_suit, angle, rotation_center, Config.ROTATION_MARGIN_RATIO)
 
-        # 3. ボディ画像を肩の傾きに合わせて回転
-        rotation_center = (original_suit_width // 2, int(original_suit_height * Config.SUIT_SHOULDER_LINE_RATIO))
-        rotated_suit = self._rotate_image(body_image, angle, rotation_center, Config.ROTATION_MARGIN_RATIO)
+            # カメラ映像は鏡像なので、それに合わせて画像を左右反転
+            rotated_suit = cv2.flip(rotated_suit, 1)
 
-        # 4. カメラ映像は鏡像なので、それに合わせて画像を左右反転
-        rotated_suit = cv2.flip(rotated_suit, 1)
+            # 透明部分を除いた大きさを求める
+            if opaque_hull is not None:
+                # 不透明領域の凸包を拡大縮小・回転させて解析的に求める (左右反転は大きさに影響しない)
+                rotation_matrix, canvas_size = self._rotation_matrix((new_suit_width, new_suit_height), angle, rotation_center, Config.ROTATION_MARGIN_RATIO)
+                scaled_hull = opaque_hull * np.float32((new_suit_width / original_suit_width, new_suit_height / original_suit_height))
+                trimmed_size = transformBounds(scaled_hull, rotation_matrix, canvas_size)
+            else:
+                trimmed_size = alphaZeroCut(rotated_suit).shape[:2]
+            trimmed = self._trim_sprite(rotated_suit)
+            if trimmed is None:
+                return None
+            return (*trimmed, trimmed_size)
 
-        # 5. 透明部分を削除
-        trimmed_suit = alphaZeroCut(rotated_suit)
+        sprite = self._get_sprite(sprite_key, angle, scale, True, render_torso)
+        if sprite is None:
+            return
+        trimmed_suit, (offset_x, offset_y), (rotated_canvas_height, rotated_canvas_width) = sprite
 
-        # 6. ボディ画像を重ねる最終位置を計算
-        rotated_canvas_height, rotated_canvas_width, _ = trimmed_suit.shape
+        # 5. ボディ画像を重ねる最終位置を計算 (余白を切り取った分だけずらす)
         pos_x = shoulder_center_x - (rotated_canvas_width // 2)
-        upward_shift = int(trimmed_suit.shape[0] * Config.SUIT_UPWARD_SHIFT_RATIO)
+        upward_shift = int(rotated_canvas_height * upward_shift_ratio)
         pos_y = shoulder_center_y - (rotated_canvas_height // 2) - upward_shift
-        self._overlay_png(frame, rotated_suit, (pos_x, pos_y))
+        self._overlay_png(frame, trimmed_suit, (pos_x + offset_x, pos_y + offset_y), occlusion_mask)
 
     def _estimate_invisible_limb_endpoint(self, landmarks, start_joint, start_x, start_y, frame_width, frame_height):
         """検出できない手足の末端座標を推定する"""
         # 肩幅を計算して最低の腕長さを設定
-        left_shoulder = landmarks.landmark[self.mp_pose.PoseLandmark.LEFT_SHOULDER]
-        right_shoulder = landmarks.landmark[self.mp_pose.PoseLandmark.RIGHT_SHOULDER]
-        if left_shoulder.visibility > Config.MIN_VISIBILITY_THRESHOLD and right_shoulder.visibility > Config.MIN_VISIBILITY_THRESHOLD:
-            left_shoulder_x = int(left_shoulder.x * frame_width)
-            right_shoulder_x = int(right_shoulder.x * frame_width)
+        left_shoulder = landmarks[PoseLandmark.LEFT_SHOULDER]
+        right_shoulder = landmarks[PoseLandmark.RIGHT_SHOULDER]
+        if left_shoulder[VISIBILITY] > Config.MIN_VISIBILITY_THRESHOLD and right_shoulder[VISIBILITY] > Config.MIN_VISIBILITY_THRESHOLD:
+            left_shoulder_x = int(left_shoulder[X] * frame_width)
+            right_shoulder_x = int(right_shoulder[X] * frame_width)
             detected_shoulder_width = abs(right_shoulder_x - left_shoulder_x)
             default_length = int(detected_shoulder_width * Config.LIMB_DEFAULT_LENGTH_SHOULDER_WIDTH_RATIO)
         else:
             default_length = frame_height // Config.LIMB_FALLBACK_DEFAULT_LENGTH_DENOMINATOR  # 肩が検出できない場合のフォールバック
 
-        is_left_side = start_joint in [self.mp_pose.PoseLandmark.LEFT_SHOULDER, self.mp_pose.PoseLandmark.LEFT_ELBOW]
+        is_left_side = start_joint in [PoseLandmark.LEFT_SHOULDER, PoseLandmark.LEFT_ELBOW]
         offset_x = Config.LIMB_INVISIBLE_OFFSET_X
         end_x = start_x + offset_x if is_left_side else start_x - offset_x
         end_y = start_y + default_length
         return end_x, end_y
 
-    def draw_limb(self, frame, landmarks, start_joint, end_joint, limb_image, scale_factor=1.0):
-        """検出されたポーズの特定の部位（手足など）に合わせて画像を描画する"""
-        if not landmarks:
+    @timedMethod("draw_limb")
+    def draw_limb(self, frame, landmarks, start_joint, end_joint, limb_image, scale_factor=1.0, sprite_key=None, anchor=None):
+        """
+        検出されたポーズの特定の部位（手足など）に合わせて画像を描画する
+        anchor: 回転中心 (画像の幅・高さに対する比率、省略時はカタログの既定値)
+                上腕は回転中心を肩に、前腕は回転中心を肘と手首の中点に合わせる
+        """
+        if landmarks is None:
             return
         
         # 1. 関節の座標を取得
         frame_height, frame_width, _ = frame.shape
-        start_lm = landmarks.landmark[start_joint]
-        end_lm = landmarks.landmark[end_joint]
+        start_lm = landmarks[start_joint]
+        end_lm = landmarks[end_joint]
         
-        if start_lm.visibility <= Config.MIN_VISIBILITY_THRESHOLD:
+        if start_lm[VISIBILITY] <= Config.MIN_VISIBILITY_THRESHOLD:
             return  # 開始点が検出できない場合はスキップ
 
         # 2. 関節のピクセル座標と中心、長さを計算
-        start_x, start_y = int(start_lm.x * frame_width), int(start_lm.y * frame_height)
+        start_x, start_y = int(start_lm[X] * frame_width), int(start_lm[Y] * frame_height)
         
-        if end_lm.visibility > Config.MIN_VISIBILITY_THRESHOLD:
-            end_x, end_y = int(end_lm.x * frame_width), int(end_lm.y * frame_height)
+        if end_lm[VISIBILITY] > Config.MIN_VISIBILITY_THRESHOLD:
+            end_x, end_y = int(end_lm[X] * frame_width), int(end_lm[Y] * frame_height)
         else:
             end_x, end_y = self._estimate_invisible_limb_endpoint(landmarks, start_joint, start_x, start_y, frame_width, frame_height)
         
@@ -189,30 +323,40 @@ class BodyPartDrawer:
         # 3. 画像のサイズを部位の長さに合わせてスケーリング
         original_limb_height, original_limb_width, _ = limb_image.shape
         scale = (limb_length / original_limb_height if original_limb_height > 0 else 1.0) * scale_factor
-        new_limb_width, new_limb_height = int(original_limb_width * scale), int(original_limb_height * scale)
-
-        if new_limb_width <= 0 or new_limb_height <= 0:
+        if int(original_limb_width * scale) <= 0 or int(original_limb_height * scale) <= 0:
             return
-        scaled_limb = cv2.resize(limb_image, (new_limb_width, new_limb_height))
 
         # 4. 画像を部位の傾きに合わせて回転
         # 縦向きの画像を関節の角度に合わせるため、-90度のオフセットを追加
         angle = math.degrees(math.atan2(end_y - start_y, end_x - start_x)) - 90
-        
-        is_upper_arm = start_joint in [self.mp_pose.PoseLandmark.LEFT_SHOULDER, self.mp_pose.PoseLandmark.RIGHT_SHOULDER]
-        if is_upper_arm:
-            # 上腕の場合、回転センターを上端近くに調整（トリミング考慮）
-            rotation_center = (new_limb_width // 2, int(new_limb_height * Config.UPPER_ARM_ROTATION_CENTER_Y_RATIO))
-        else:
-            rotation_center = (new_limb_width // 2, new_limb_height // 2)
+        is_upper_arm = start_joint in [PoseLandmark.LEFT_SHOULDER, PoseLandmark.RIGHT_SHOULDER]
+        if anchor is None:
+            anchor = DEFAULT_PARTS["upper_arm" if is_upper_arm else "forearm"]["anchor"]
 
-        rotated_limb = self._rotate_image(scaled_limb, angle, rotation_center, Config.ROTATION_MARGIN_RATIO, use_hypot_for_canvas=True)
-        
-        # カメラ映像は鏡像なので、それに合わせて画像を左右反転
-        rotated_limb = cv2.flip(rotated_limb, 1)
-        
-        # 5. 画像を重ねる最終位置を計算
-        rotated_canvas_height, rotated_canvas_width, _ = rotated_limb.shape
+        def render_limb(angle, scale):
+            new_limb_width, new_limb_height = int(original_limb_width * scale), int(original_limb_height * scale)
+            if new_limb_width <= 0 or new_limb_height <= 0:
+                return None
+            scaled_limb = cv2.resize(limb_image, (new_limb_width, new_limb_height))
+
+            # 上腕は回転センターを上端近くに、前腕は画像の中心にする (カタログの anchor で指定)
+            rotation_center = (int(new_limb_width * anchor[0]), int(new_limb_height * anchor[1]))
+
+            rotated_limb = self._rotate_image(scaled_limb, angle, rotation_center, Config.ROTATION_MARGIN_RATIO, use_hypot_for_canvas=True)
+
+            # カメラ映像は鏡像なので、それに合わせて画像を左右反転
+            rotated_limb = cv2.flip(rotated_limb, 1)
+            trimmed = self._trim_sprite(rotated_limb)
+            if trimmed is None:
+                return None
+            return (*trimmed, rotated_limb.shape[:2])
+
+        sprite = self._get_sprite(sprite_key, angle, scale, True, render_limb)
+        if sprite is None:
+            return
+        trimmed_limb, (offset_x, offset_y), (rotated_canvas_height, rotated_canvas_width) = sprite
+
+        # 5. 画像を重ねる最終位置を計算 (余白を切り取った分だけずらす)
         if is_upper_arm:
             # 上腕の場合、回転中心（画像上端付近）を肩の位置に合わせる
             target_x, target_y = start_x, start_y
@@ -222,180 +366,849 @@ class BodyPartDrawer:
 
         pos_x = target_x - (rotated_canvas_width // 2)
         pos_y = target_y - (rotated_canvas_height // 2)
-        self._overlay_png(frame, rotated_limb, (pos_x, pos_y))
+        self._overlay_png(frame, trimmed_limb, (pos_x + offset_x, pos_y + offset_y))
 
 
 class VirtualTryOnApp:
     """バーチャル試着アプリケーション"""
-    def __init__(self,camera_index=0):
-        """アプリケーションの初期化"""
+    def __init__(self,camera_index=0,inference_size=None,source=None,autostart=True,
+                 pose_pool=None,stream_id=None,catalog=None,assets=None):
+        """
+        アプリケーションの初期化
+        inference_size: 姿勢推定に使う画像の長辺 [px] (省略時は Config.POSE_INFERENCE_LONG_SIDE)
+                        描画は常にカメラの解像度で行う
+        source: フレームの取得元 (FrameSource、動画ファイルや画像ディレクトリのパス)
+                省略時は camera_index のカメラから取得する
+        autostart: Falseの場合は映像処理スレッドを開始しない (start() で開始する)
+        pose_pool: 姿勢推定を行う PoseWorkerPool (省略時はこのスレッド内で推定する)
+        stream_id: プール内でこのストリームを識別する値 (省略時は camera_index)
+        catalog, assets: 衣装カタログと AssetStore (複数のストリームで共有する場合に渡す。省略時は生成する)
+        """
+        self._started_at = time.perf_counter()
+        # 起動の各段階の所要時間 (秒)。最初のフレームを描画した時点で first_frame を記録する
+        self.startup = {}
         self.camera_index=camera_index
         self.config = Config()
-        self.drawer = BodyPartDrawer()
-        self.mp_pose = mp.solutions.pose
-        self.pose = self.mp_pose.Pose(min_detection_confidence=0.5, min_tracking_confidence=0.5)
-        self.cap = cv2.VideoCapture(self.camera_index)
-        self.images = self._load_all_assets()
-        self.selected_cloth = 'suit' # デフォルトの衣装
-        self.ret,self.frame=self.cap.read()
+        self.inference_size = inference_size if inference_size is not None else self.config.POSE_INFERENCE_LONG_SIDE
+        # 各処理区間の所要時間の計測
+        self.metrics = Metrics(self.config.METRICS_ENABLED, self.config.METRICS_HISTORY)
+        self.drawer = BodyPartDrawer(self.metrics)
+        # 姿勢推定のプールを使う場合は、このスレッドではモデルを読み込まない
+        # プールを渡さずに Config.POSE_WORKER_PROCESSES を指定した場合は、専用のプールで複数のフレームを並行して推定する
+        self._owns_pose_pool = pose_pool is None and self.config.POSE_WORKER_PROCESSES > 0
+        self.pose_max_in_flight = self.config.POSE_WORKER_MAX_IN_FLIGHT or max(1, self.config.POSE_WORKER_PROCESSES)
+        self.pose_pool = pose_pool
+        self.stream_id = stream_id if stream_id is not None else camera_index
+        self.pose = None
+        # 姿勢推定を間引き、省略したフレームではランドマークを予測する
+        self.inference_scheduler = InferenceScheduler(self.config.POSE_INFERENCE_INTERVAL, self.config.POSE_MOTION_THRESHOLD)
+        self.landmark_predictor = self._create_predictor()
+        # 前回の人物領域の周辺だけを切り出して推定する
+        self.roi_tracker = PersonRoiTracker(self.config.POSE_ROI_PADDING, self.config.POSE_ROI_MAX_AREA_RATIO, self.config.MIN_VISIBILITY_THRESHOLD)
+        # ランドマークの揺れを抑える平滑化フィルタ
+        self.landmark_filter = createLandmarkFilter(self.config.LANDMARK_FILTER, **self._landmark_filter_params())
+        self.background = None
+        self.occlusion = None
+        self.cap = None
+        self.catalog = catalog
+        self.assets = assets
+        # 切り替え先の入力 (開いて準備ができたものを取得ステージが差し替える)
+        self._next_source = None
+        self._source_lock = threading.Lock()
+        self._source_generation = 0
+        self._switch_requests = 0
+        self._detection_generation = 0
+        self._tracking_generation = 0
+        # モデルの生成・カメラのオープン・衣装の読み込みは互いに依存しないため、並行して行う
+        self._run_startup_phases({
+            "camera": lambda: self._open_source(source),
+            "models": self._load_models,
+            "assets": self._load_assets,
+        })
+        self._requested_cloth = self.selected_cloth
+        # 衣装の読み込みを行うワーカースレッド (表示中・切り替え中の衣装は解放しない)
+        self.prefetcher = AssetPrefetcher(self.assets, lambda: (self.selected_cloth, self._requested_cloth))
+        self._prefetch_neighbors(self.selected_cloth)
+        # 描画済みフレームの受け渡し (トリプルバッファ)
+        self.frames = FrameExchange()
+        # 仮想カメラなどの出力先 (出力は出力先ごとのスレッドで行う)
+        self.sinks = ()
+        for name in self.config.OUTPUT_SINKS:
+            self.addSink(name)
         self.stopped=False
         # 定数
         self.cloth_state=False
+        # 取得 → 姿勢推定 → 描画 の各ステージをつなぐキュー
+        self._capture_queue = DropOldestQueue(Config.PIPELINE_QUEUE_SIZE)
+        self._render_queue = DropOldestQueue(Config.PIPELINE_QUEUE_SIZE)
+        # ワーカープロセスに推定を依頼したフレームを、依頼した順 (通し番号の順) に並べておくキュー
+        self._pose_queue = DropOldestQueue(self.pose_max_in_flight)
+        self.latency = LatencyRecorder(Config.PIPELINE_LATENCY_HISTORY)
+        self._last_metrics_log = time.perf_counter()
+        self._capture_thread = None
+        self._inference_thread = None
+        self._collect_thread = None
+        self.startup["init"] = time.perf_counter() - self._started_at
 
         # スレッドの初期化と開始
         self.thread = threading.Thread(target=self.run, args=())
         self.thread.daemon = True # メインスレッドが終了したら、このスレッドも終了する
+        if autostart:
+            self.start()
+
+    def _run_startup_phases(self, phases):
+        """
+        起動の各段階 {名前: 処理} を実行し、所要時間を self.startup に記録する (いずれかが失敗した場合はその例外を送出する)
+        Config.STARTUP_PARALLEL が True なら段階ごとのスレッドで並行して実行し、False なら順に実行する
+        None の場合、CPU が1コアなら最初の段階 (カメラのオープン) だけを並行して行い、残りは順に実行する
+        (モデルの生成と画像のデコードはどちらも CPU を使うため、1コアで並行させるとかえって遅くなる)
+        """
+        errors = []
+
+        def run_phases(group):
+            for name, phase in group:
+                started = time.perf_counter()
+                try:
+                    phase()
+                except Exception as e:
+                    errors.append(e)
+                    return
+                finally:
+                    self.startup[name] = time.perf_counter() - started
+
+        items = list(phases.items())
+        parallel = self.config.STARTUP_PARALLEL
+        if parallel is None:
+            groups = [[item] for item in items] if (os.cpu_count() or 1) > 1 else [items[:1], items[1:]]
+        elif parallel:
+            groups = [[item] for item in items]
+        else:
+            groups = [items]
+        threads = [threading.Thread(target=run_phases, args=(group,), daemon=True) for group in groups[1:]]
+        for thread in threads:
+            thread.start()
+        # 最初のグループはこのスレッドで、残りはグループごとのスレッドで実行する
+        run_phases(groups[0])
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def _load_models(self):
+        """姿勢推定・背景の置き換え・遮蔽のモデルを生成する"""
+        if self._owns_pose_pool:
+            # 依頼中のフレームを捨てないよう、ステージ間で保持される分も含めて待たせられるようにする
+            # 1つのストリームの連続したフレームを複数のワーカーで並行して推定するため、2つ以上なら追跡状態を持たせない
+            # (ワーカーごとに別々に追跡すると、どのワーカーも結局は毎回検出することになる)
+            workers = self.config.POSE_WORKER_PROCESSES
+            self.pose_pool = PoseWorkerPool(workers, max_pending=self.pose_max_in_flight + 2,
+                                            warmup=self.config.POSE_WARMUP, static_image_mode=workers > 1)
+        elif self.pose_pool is None:
+            # MediaPipe は読み込みに時間がかかるため、モデルを生成する時点で読み込む
+            import mediapipe as mp
+            self.pose = mp.solutions.pose.Pose(min_detection_confidence=0.5, min_tracking_confidence=0.5)
+            if self.config.POSE_WARMUP:
+                self._warm_up_pose()
+        # 背景の置き換え (Config.BACKGROUND_MODE が None なら行わない)
+        if self.config.BACKGROUND_MODE is not None:
+            self.setBackground(self.config.BACKGROUND_MODE, self.config.BACKGROUND_COLOR, self.config.BACKGROUND_IMAGE_PATH)
+        # 手前にある腕による胴体の衣装の遮蔽
+        if self.config.OCCLUSION_ENABLED:
+            self.setOcclusion(True)
+
+    def _warm_up_pose(self):
+        """黒画像で1回推定し、推定器の初期化を起動時に済ませる (追跡状態は破棄する)"""
+        width, height = self.config.POSE_WARMUP_SIZE
+        started = time.perf_counter()
+        self.pose.process(np.zeros((height, width, 3), np.uint8))
+        self.pose.reset()
+        self.startup["pose_warmup"] = time.perf_counter() - started
+
+    def _open_source(self, source):
+        """フレームの取得元を開く"""
+        self.cap = openFrameSource(source) if source is not None else CameraSource(self.camera_index)
+
+    def _load_assets(self):
+        """衣装カタログを読み込み、最初に表示する衣装のパーツ画像をデコードする"""
+        # 衣装のパーツ画像は選ばれた時点で読み込み、使われていないものは上限に応じて解放する
+        if self.catalog is None:
+            self.catalog = Catalog.load(self.config.CATALOG_PATH)
+        if self.assets is None:
+            self.assets = self._create_asset_store()
+        self.selected_cloth = self.config.DEFAULT_CLOTH if self.config.DEFAULT_CLOTH in self.catalog else self.catalog.ids()[0]
+        self.garment = self.assets.get(self.selected_cloth)
+
+    def _report_startup(self):
+        """起動から最初のフレームを描画するまでの時間を記録し、各段階の所要時間とあわせて表示する"""
+        self.startup["first_frame"] = time.perf_counter() - self._started_at
+        phases = " / ".join(f"{name} {seconds * 1000.0:.0f}ms" for name, seconds in self.startup.items())
+        print(f"起動時間: {phases}")
+
+    def start(self):
+        """映像処理スレッドを開始する"""
         self.thread.start()
         print(f"VideoStream thread for camera='{self.camera_index}' started.")
     
     def read(self)->npt.NDArray:
-        return self.frame
+        """最新の描画済みフレームを返す (コピーせずに参照を返すため、書き換えないこと)"""
+        _, frame = self.frames.latest()
+        return frame
     
     def stop(self):
         self.stopped=True
-        self.thread.join()
+        # 取得側が先に止まると、後段のキューが順に閉じられてスレッドが終了する
+        if self.thread.ident is not None:
+            self.thread.join()
         self._cleanup()
 
-    def _load_all_assets(self):
-        """すべての衣装アセットを読み込む"""
-        assets = {
-            'suit': self.config.SUIT_ASSETS_PATH,
-            'shirt': self.config.SHIRT_ASSETS_PATH,
-        }
-        
-        all_images = {}
-        for cloth_name, path in assets.items():
-            all_images[cloth_name] = self._load_images_from_path(path)
-            
-        return all_images
-
-    def _load_images_from_path(self, path):
-        """指定されたパスから衣装画像を読み込む"""
-        image_names = {
-            "fullbody": "0.png",
-            "torso": "1.png",
-            "upper_arm": "2.png",
-            "forearm": "3.png",
-        }
-        
-        loaded_images = {}
-        for name, filename in image_names.items():
-            image_path = f"{path}/{filename}"
-            img = self._load_rgba_image(image_path)
-            if img is None:
-                raise IOError(f"画像の読み込みに失敗しました: {image_path}")
-            
-            loaded_images[name] = img
-            # 腕のパーツは左右反転したバージョンも用意する
-            if name in ["upper_arm", "forearm"]:
-                loaded_images[f"flipped_{name}"] = cv2.flip(img, 1)
-
-        return loaded_images
-
-
-    def _load_rgba_image(self, path):
-        """アルファチャンネル付きの画像を読み込む。なければエラーを出力する。"""
-        img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
-        if img is None:
-            print(f"エラー: {path} が見つかりません。")
-            return None
-        if len(img.shape) < 3 or img.shape[2] != 4:
-            print(f"エラー: {path} にはアルファチャンネル（透過情報）がありません。透過PNGで保存してください。")
-            return None
-        return img
+    def _create_asset_store(self):
+        """衣装カタログからアセットのストアを生成する (画像は衣装を選んだ時点で読み込む)"""
+        return AssetStore.from_catalog(self.catalog, self.config.ASSET_CACHE_DIR, self.config.ASSET_MAX_BYTES, self.config.ASSET_USE_MMAP)
 
     def run(self):
-        """アプリケーションのメインループを実行する"""
+        """
+        アプリケーションのメインループを実行する
+        カメラ取得と姿勢推定は別スレッドで行い、このスレッドは描画を担当する
+        """
         if not self.cap.isOpened():
             print("エラー: カメラを開けませんでした。")
             return
 
+        self._capture_thread = threading.Thread(target=self._capture_loop, daemon=True)
+        if self._owns_pose_pool:
+            # 推定の依頼と結果の受け取りを別のスレッドで行い、複数のフレームを並行して推定する
+            self._inference_thread = threading.Thread(target=self._submit_loop, daemon=True)
+            self._collect_thread = threading.Thread(target=self._collect_loop, daemon=True)
+            self._collect_thread.start()
+        else:
+            self._inference_thread = threading.Thread(target=self._inference_loop, daemon=True)
+        self._capture_thread.start()
+        self._inference_thread.start()
+
+        while True:
+            packet = self._render_queue.get()
+            if packet is None:
+                break
+            packet.stamp("render_start")
+            frame = packet.frame
+
+            background = self.background
+            if background is not None and packet.person_mask is not None:
+                with self.metrics.span("background"):
+                    background.apply(frame, packet.person_mask)
+
+            with self.metrics.span("draw"):
+                occlusion_mask = None
+                if packet.occlusion_mask is not None:
+                    # 縮小した解像度で求めたマスクをカメラの解像度に拡大する
+                    occlusion_mask = cv2.resize(packet.occlusion_mask, (frame.shape[1], frame.shape[0]), interpolation=cv2.INTER_LINEAR)
+
+                # スーツの描画（GUIとユーザー間のやり取りで，呼び出したり呼び出さなかったりする）
+                self._draw_all(frame, packet.landmarks, occlusion_mask)
+
+                if self.cloth_state:
+                    self._draw_all(frame, packet.landmarks, occlusion_mask)
+
+            if self.config.METRICS_HUD:
+                self._draw_metrics_hud(frame)
+
+            # 最新フレーム更新 (参照を渡すだけでコピーしない)
+            with self.metrics.span("publish"):
+                self.frames.publish(frame)
+            packet.stamp("render")
+            if "first_frame" not in self.startup:
+                self._report_startup()
+            self.latency.record(packet)
+            self._log_metrics()
+
+            # 仮想カメラ処理 (フレームを渡すだけで、出力は待たない)
+            sinks = self.sinks
+            if sinks:
+                with self.metrics.span("sinks"):
+                    for sink in sinks:
+                        sink.submit(frame)
+
+        self.stopped = True
+        self.frames.close()
+        self._capture_thread.join()
+        self._inference_thread.join()
+        if self._collect_thread is not None:
+            self._collect_thread.join()
+        self.cap.release()
+
+    def _capture_loop(self):
+        """カメラからフレームを取得し、姿勢推定ステージへ渡す"""
+        seq = 0
         while not self.stopped:
-            ret, frame = self.cap.read()
+            self._swap_source()
+            with self.metrics.span("capture"):
+                ret, frame = self.cap.read()
             if not(ret) or frame is None:
-                print("エラー: フレームを読み取れませんでした。")
+                if self.cap.exhausted:
+                    print("入力の最後のフレームまで処理しました。")
+                else:
+                    print("エラー: フレームを読み取れませんでした。")
                 break
+            # 実時間の入力では古いフレームを捨て、録画の再生などでは後段を待ってすべてのフレームを処理する
+            self._capture_queue.put(FramePacket(seq, frame, self._source_generation), block=not self.cap.live)
+            seq += 1
+        self._capture_queue.close()
+
+    def _inference_loop(self):
+        """取得したフレームの姿勢推定を行い、描画ステージへ渡す"""
+        while True:
+            packet = self._capture_queue.get()
+            if packet is None:
+                break
+            packet.stamp("inference_start")
+            self._reset_detection_if_switched(packet)
+            self._reset_tracking_if_switched(packet)
+            background = self.background
+            if background is not None:
+                with self.metrics.span("segmentation"):
+                    packet.person_mask = background.person_mask(packet.frame)
             # 1フレームに対する姿勢推定等
-            results = self._process_frame(frame)
+            packet.landmarks = self._process_frame(packet.frame, packet.timestamps["capture"])
+            occlusion = self.occlusion
+            if occlusion is not None:
+                with self.metrics.span("occlusion"):
+                    packet.occlusion_mask = occlusion.compute(packet.frame, packet.landmarks, packet.person_mask)
+            packet.stamp("inference")
+            self._render_queue.put(packet, block=not self.cap.live)
+        self._render_queue.close()
 
-            # スーツの描画（GUIとユーザー間のやり取りで，呼び出したり呼び出さなかったりする）
-            self._draw_all(frame, results)
+    def _submit_loop(self):
+        """
+        取得したフレームの姿勢推定をワーカープロセスに依頼し、結果を待たずに次のフレームへ進む
+        依頼したフレームは通し番号の順にキューへ積み、結果の受け取りは _collect_loop で行う
+        人物領域の追跡 (POSE_ROI_TRACKING) は前のフレームの結果を待つ必要があるため、この場合は行わない
+        """
+        while True:
+            packet = self._capture_queue.get()
+            if packet is None:
+                break
+            packet.stamp("inference_start")
+            self._reset_detection_if_switched(packet)
+            request = None
+            if self.inference_scheduler.should_infer(packet.frame):
+                request = self._submit_pose(packet.frame, packet.seq)
+            # 人物のセグメンテーションはワーカーの推定と並行して行う
+            background = self.background
+            if background is not None:
+                with self.metrics.span("segmentation"):
+                    packet.person_mask = background.person_mask(packet.frame)
+            # 上限まで依頼したら、先に依頼したフレームの結果が受け取られるまで待つ
+            self._pose_queue.put((packet, request), block=True)
+        self._pose_queue.close()
 
-            if self.cloth_state:
-                self._draw_all(frame, results)
+    def _collect_loop(self):
+        """
+        ワーカープロセスの推定結果を受け取り、描画ステージへ渡す
+        結果は依頼した順に待つため、ワーカーごとに終わる順番が前後しても通し番号の順に並ぶ
+        """
+        while True:
+            item = self._pose_queue.get()
+            if item is None:
+                break
+            packet, request = item
+            self._reset_tracking_if_switched(packet)
+            landmarks = None
+            inferred = False
+            if request is not None:
+                landmarks = request.result()
+                # 新しいフレームに押し出されて推定されなかった依頼は、検出漏れではなく推定を省略したフレームとして扱う
+                # (検出漏れとして扱うと、フィルターや予測の状態が破棄されてしまう)
+                inferred = not request.dropped
+            if inferred:
+                self.metrics.record("pose_process", request.elapsed)
+                self._count_inference(landmarks)
+            packet.landmarks = self._track_landmarks(packet.timestamps["capture"], inferred, landmarks)
+            occlusion = self.occlusion
+            if occlusion is not None:
+                with self.metrics.span("occlusion"):
+                    packet.occlusion_mask = occlusion.compute(packet.frame, packet.landmarks, packet.person_mask)
+            packet.stamp("inference")
+            self._render_queue.put(packet, block=not self.cap.live)
+        self._render_queue.close()
 
-            # 最新フレーム更新
-            self.frame=frame
+    def _reset_detection_if_switched(self, packet):
+        """入力が切り替わったフレームなら、推定の間引き・人物領域・MediaPipe の追跡状態を破棄する"""
+        if packet.generation != self._detection_generation:
+            self._detection_generation = packet.generation
+            self.inference_scheduler.reset()
+            self.roi_tracker.reset()
+            self._reset_pose()
 
-            # 仮想カメラ処理
+    def _reset_tracking_if_switched(self, packet):
+        """入力が切り替わったフレームなら、ランドマークの予測・平滑化・遮蔽マスクの状態を破棄する"""
+        if packet.generation != self._tracking_generation:
+            self._tracking_generation = packet.generation
+            self.landmark_predictor.reset()
+            self.landmark_filter.reset()
+            occlusion = self.occlusion
+            if occlusion is not None:
+                occlusion.reset()
 
-        self.cap.release()
+    def _submit_pose(self, frame, seq=None):
+        """
+        BGR画像を縮小・色変換してワーカープロセスとの共有メモリに直接書き込み、姿勢推定を依頼する (PoseRequest を返す)
+        """
+        with self.metrics.span("resize"):
+            small = resizeLongSide(frame, self.inference_size)
+        shared = self.pose_pool.frame(small.shape)
+        with self.metrics.span("color_convert"):
+            cv2.cvtColor(small, cv2.COLOR_BGR2RGB, dst=shared.array)
+        return self.pose_pool.submit(self.stream_id, shared, seq)
+
+    def getLatencyStats(self):
+        """
+        ステージ間の所要時間の統計値 (ミリ秒) を返す
+        end_to_end はカメラ取得から描画完了までの遅延
+        """
+        stats = self.latency.stats()
+        stats["dropped"] = {
+            "capture": self._capture_queue.dropped,
+            "render": self._render_queue.dropped,
+        }
+        return stats
+
+    def getMetrics(self):
+        """
+        処理区間ごとの所要時間 (ミリ秒) とイベントの回数を返す
+        spans: capture / resize / color_convert / pose_process / draw / draw_torso / draw_limb / publish / sinks / display
+        counters: inference (推定回数) / inference_skipped (推定を省略した回数) / detection_miss (人物を検出できなかった回数)
+                  display_dropped (表示されずに上書きされたフレーム数)
+        dropped: ステージ間キューであふれて捨てたフレーム数
+        sinks: 出力先ごとの出力したフレーム数と、追いつかずに捨てたフレーム数
+        startup: 起動の各段階 (models / camera / assets / init / first_frame など) の所要時間 (秒)
+        """
+        stats = self.metrics.stats()
+        stats["dropped"] = {
+            "capture": self._capture_queue.dropped,
+            "render": self._render_queue.dropped,
+        }
+        stats["sinks"] = [
+            {"sink": type(sink).__name__, "frames": sink.frames, "dropped": sink.dropped}
+            for sink in self.sinks
+        ]
+        stats["startup"] = dict(self.startup)
+        return stats
+
+    def _draw_metrics_hud(self, frame):
+        """計測結果を映像の左上に表示する"""
+        stats = self.metrics.stats()
+        spans = stats["spans"]
+        lines = [
+            f"{name}: {spans[name]['p50_ms']:.1f}ms (p95 {spans[name]['p95_ms']:.1f})"
+            for name in self.config.METRICS_HUD_SPANS
+            if name in spans and spans[name]["count"]
+        ]
+        counters = stats["counters"]
+        lines.append(f"miss: {counters.get('detection_miss', 0)} "
+                     f"dropped: {self._capture_queue.dropped + self._render_queue.dropped + counters.get('display_dropped', 0)}")
+        for i, line in enumerate(lines):
+            cv2.putText(frame, line, (10, 25 + i * 22), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2, cv2.LINE_AA)
 
-    def _process_frame(self, frame):
-        """フレームを処理してポーズを検出する"""
+    def _log_metrics(self):
+        """設定した間隔ごとに計測結果をコンソールに出力する"""
+        interval = self.config.METRICS_LOG_INTERVAL
+        if not interval:
+            return
+        now = time.perf_counter()
+        if now - self._last_metrics_log < interval:
+            return
+        self._last_metrics_log = now
+        stats = self.getMetrics()
+        print(f"[metrics] {formatMetrics(stats, self.config.METRICS_HUD_SPANS)} dropped={stats['dropped']}")
+
+    def _create_predictor(self):
+        """設定に従ってランドマークの予測器を生成する"""
+        params = {}
+        if self.config.POSE_PREDICTOR == "kalman":
+            params = {
+                "process_noise": self.config.POSE_KALMAN_PROCESS_NOISE,
+                "measurement_noise": self.config.POSE_KALMAN_MEASUREMENT_NOISE,
+            }
+        return createPredictor(self.config.POSE_PREDICTOR, self.config.POSE_MAX_EXTRAPOLATION, **params)
+
+    def _landmark_filter_params(self):
+        """設定に従って平滑化フィルタのパラメータを返す"""
+        if self.config.LANDMARK_FILTER == "one_euro":
+            return {
+                "min_cutoff": self.config.ONE_EURO_MIN_CUTOFF,
+                "beta": self.config.ONE_EURO_BETA,
+                "d_cutoff": self.config.ONE_EURO_D_CUTOFF,
+            }
+        if self.config.LANDMARK_FILTER == "kalman":
+            return {
+                "process_noise": self.config.POSE_KALMAN_PROCESS_NOISE,
+                "measurement_noise": self.config.POSE_KALMAN_MEASUREMENT_NOISE,
+            }
+        return {}
+
+    def _run_pose_model(self, image):
+        """
+        BGR画像で姿勢推定を行い、画像に対する正規化座標のランドマークを返す
+        推定用の解像度が指定されていれば縮小してから色変換・推定する
+        正規化座標は解像度に依存しないため、描画時に元の解像度を掛ければそのまま使える
+        """
+        if self.pose_pool is not None:
+            request = self._submit_pose(image)
+            landmarks = request.result()
+            self.metrics.record("pose_process", request.elapsed)
+            return landmarks
+        with self.metrics.span("resize"):
+            small = resizeLongSide(image, self.inference_size)
         # パフォーマンス向上のため、画像を書き込み不可として参照渡しする
-        frame.flags.writeable = False
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        results = self.pose.process(rgb_frame)
-        frame.flags.writeable = True
-        return results
+        small.flags.writeable = False
+        with self.metrics.span("color_convert"):
+            rgb_image = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
+        with self.metrics.span("pose_process"):
+            results = self.pose.process(rgb_image)
+        small.flags.writeable = True
+        return landmarksToArray(results.pose_landmarks)
+
+    def _detect_landmarks(self, frame):
+        """
+        フレームの姿勢推定を行い、フレーム全体に対する正規化座標のランドマークを返す
+        人物領域を追跡している場合は、その周辺を切り出した画像だけを色変換・推定する
+        """
+        roi = self.roi_tracker.roi(frame.shape) if self.config.POSE_ROI_TRACKING else None
+        landmarks = None
+        if roi is not None:
+            x1, y1, x2, y2 = roi
+            landmarks = self._run_pose_model(frame[y1:y2, x1:x2])
+            if landmarks is not None:
+                landmarks = PersonRoiTracker.toFrameCoords(landmarks, roi, frame.shape)
+        if landmarks is None:
+            # 追跡していない、または見失った場合はフレーム全体で推定する
+            landmarks = self._run_pose_model(frame)
+        self._count_inference(landmarks)
+        if self.config.POSE_ROI_TRACKING:
+            self.roi_tracker.update(landmarks)
+            if self.roi_tracker.changed:
+                # 入力画像の範囲が変わると MediaPipe 内部の追跡がずれるため、次のフレームで検出からやり直させる
+                self._reset_pose()
+        return landmarks
+
+    def _count_inference(self, landmarks):
+        """推定の回数と、人物を検出できなかった回数を数える"""
+        self.metrics.count("inference")
+        if landmarks is None:
+            self.metrics.count("detection_miss")
+
+    def _reset_pose(self):
+        """MediaPipe 内部の追跡状態を破棄する"""
+        if self.pose_pool is not None:
+            self.pose_pool.reset(self.stream_id)
+        else:
+            self.pose.reset()
+
+    def _process_frame(self, frame, timestamp=None):
+        """
+        フレームを処理してポーズを検出し、平滑化したランドマークを (33, 4) の配列で返す (検出できなければ None)
+        推定を省略するフレームでは、直前の推定結果から予測したランドマークを返す
+        timestamp: フレームの取得時刻 (time.perf_counter() 基準、省略時は現在時刻)
+        """
+        if timestamp is None:
+            timestamp = time.perf_counter()
+
+        inferred = self.inference_scheduler.should_infer(frame)
+        landmarks = self._detect_landmarks(frame) if inferred else None
+        return self._track_landmarks(timestamp, inferred, landmarks)
+
+    def _track_landmarks(self, timestamp, inferred, landmarks):
+        """
+        推定結果を予測器と平滑化フィルタに通す (フレームの順に呼ぶこと)
+        inferred: Falseなら推定を省略したフレームとして、直前の推定結果から予測する
+        """
+        if inferred:
+            # ワーカープロセスでは依頼が押し出されて推定されないことがあるため、間引かない場合も予測器を更新しておく
+            if self.inference_scheduler.interval > 1 or self.pose_pool is not None:
+                self.landmark_predictor.update(timestamp, landmarks)
+        else:
+            self.metrics.count("inference_skipped")
+            landmarks = self.landmark_predictor.predict(timestamp)
+
+        return self.landmark_filter.apply(timestamp, landmarks)
 
     def _are_arms_visible(self, landmarks):
         """両腕が検出できているかを判定する"""
-        left_elbow = landmarks.landmark[self.mp_pose.PoseLandmark.LEFT_ELBOW]
-        right_elbow = landmarks.landmark[self.mp_pose.PoseLandmark.RIGHT_ELBOW]
-        return left_elbow.visibility > Config.MIN_VISIBILITY_THRESHOLD and right_elbow.visibility > Config.MIN_VISIBILITY_THRESHOLD
+        left_elbow = landmarks[PoseLandmark.LEFT_ELBOW]
+        right_elbow = landmarks[PoseLandmark.RIGHT_ELBOW]
+        return left_elbow[VISIBILITY] > Config.MIN_VISIBILITY_THRESHOLD and right_elbow[VISIBILITY] > Config.MIN_VISIBILITY_THRESHOLD
 
-    def _draw_separate_body_parts(self, frame, landmarks):
+    def _draw_separate_body_parts(self, frame, landmarks, occlusion_mask=None):
         """腕と胴体を個別のパーツとして描画する"""
-        cloth_images = self.images[self.selected_cloth]
-        
+        garment = self.garment
+        spec = self.catalog.get(garment.name)
+        cloth_images = garment.images
+
+        def draw_limb(start_joint, end_joint, part, image_key):
+            # 左右反転したパーツも元のパーツの基準点・拡大率を使う
+            self.drawer.draw_limb(frame, landmarks, start_joint, end_joint, cloth_images[image_key], sprite_key=(garment.name, image_key),
+                                  scale_factor=spec.scale(part), anchor=spec.anchor(part))
+
         # 描画順序: 奥側(末端)から手前(中心)へ描画することで、正しい重なり順にする
         # 1. 前腕
-        self.drawer.draw_limb(frame, landmarks, self.mp_pose.PoseLandmark.LEFT_ELBOW, self.mp_pose.PoseLandmark.LEFT_WRIST, cloth_images["forearm"], scale_factor=self.config.FOREARM_SCALE_FACTOR)
-        self.drawer.draw_limb(frame, landmarks, self.mp_pose.PoseLandmark.RIGHT_ELBOW, self.mp_pose.PoseLandmark.RIGHT_WRIST, cloth_images["flipped_forearm"], scale_factor=self.config.FOREARM_SCALE_FACTOR)
+        draw_limb(PoseLandmark.LEFT_ELBOW, PoseLandmark.LEFT_WRIST, "forearm", "forearm")
+        draw_limb(PoseLandmark.RIGHT_ELBOW, PoseLandmark.RIGHT_WRIST, "forearm", "flipped_forearm")
 
         # 2. 上腕
-        self.drawer.draw_limb(frame, landmarks, self.mp_pose.PoseLandmark.LEFT_SHOULDER, self.mp_pose.PoseLandmark.LEFT_ELBOW, cloth_images["upper_arm"], scale_factor=self.config.UPPER_ARM_SCALE_FACTOR)
-        self.drawer.draw_limb(frame, landmarks, self.mp_pose.PoseLandmark.RIGHT_SHOULDER, self.mp_pose.PoseLandmark.RIGHT_ELBOW, cloth_images["flipped_upper_arm"], scale_factor=self.config.UPPER_ARM_SCALE_FACTOR)
+        draw_limb(PoseLandmark.LEFT_SHOULDER, PoseLandmark.LEFT_ELBOW, "upper_arm", "upper_arm")
+        draw_limb(PoseLandmark.RIGHT_SHOULDER, PoseLandmark.RIGHT_ELBOW, "upper_arm", "flipped_upper_arm")
         
         # 3. 胴体
-        self.drawer.draw_torso(frame, landmarks, cloth_images["torso"])
+        self.drawer.draw_torso(frame, landmarks, cloth_images["torso"], sprite_key=(garment.name, "torso"), opaque_hull=garment.hulls["torso"], occlusion_mask=occlusion_mask,
+                               scale_factor=spec.scale("torso"), anchor=spec.anchor("torso"), upward_shift_ratio=spec.fit["upward_shift_ratio"],
+                               shoulder_width_ratio=spec.fit["shoulder_width_ratio"])
 
-    def _draw_composite_body(self, frame, landmarks):
+    def _draw_composite_body(self, frame, landmarks, occlusion_mask=None):
         """腕を組んだ合成画像を描画する"""
-        cloth_images = self.images[self.selected_cloth]
-        self.drawer.draw_torso(frame, landmarks, cloth_images["fullbody"], scale_factor=self.config.FULLBODY_SCALE_FACTOR)
+        garment = self.garment
+        spec = self.catalog.get(garment.name)
+        cloth_images = garment.images
+        self.drawer.draw_torso(frame, landmarks, cloth_images["fullbody"], sprite_key=(garment.name, "fullbody"), opaque_hull=garment.hulls["fullbody"], occlusion_mask=occlusion_mask,
+                               scale_factor=spec.scale("fullbody"), anchor=spec.anchor("fullbody"), upward_shift_ratio=spec.fit["upward_shift_ratio"],
+                               shoulder_width_ratio=spec.fit["shoulder_width_ratio"])
 
-    def _draw_all(self, frame, results):
-        """すべてのパーツを描画する"""
-        if not results.pose_landmarks:
+    def _draw_all(self, frame, landmarks, occlusion_mask=None):
+        """
+        すべてのパーツを描画する
+        landmarks: (33, 4) の配列 [x, y, z, visibility] (検出できなかった場合は None)
+        occlusion_mask: 胴体の衣装を描画してよい領域のマスク (フレームと同じ大きさ、省略時は遮蔽しない)
+        """
+        if landmarks is None:
             return
         
-        landmarks = results.pose_landmarks
-        
         if self._are_arms_visible(landmarks):
-            self._draw_separate_body_parts(frame, landmarks)
+            self._draw_separate_body_parts(frame, landmarks, occlusion_mask)
         else:
-            self._draw_composite_body(frame, landmarks)
+            self._draw_composite_body(frame, landmarks, occlusion_mask)
 
-    def changeCloth(self, cloth_name):
-        """試着する衣装を切り替える"""
-        if cloth_name in self.images:
-            self.selected_cloth = cloth_name
-            print(f"衣装を {cloth_name} に切り替えました。")
-        else:
-            print(f"エラー: 衣装 '{cloth_name}' が見つかりません。利用可能な衣装: {list(self.images.keys())}")
+    def changeCloth(self, cloth_name, wait=False):
+        """
+        試着する衣装を切り替える
+        読み込みはワーカースレッドで行い、終わった時点で差し替える (それまでは前の衣装のまま描画する)
+        wait: Trueの場合は差し替えが終わるまで待つ
+        """
+        if cloth_name not in self.assets:
+            print(f"エラー: 衣装 '{cloth_name}' が見つかりません。利用可能な衣装: {self.assets.names()}")
+            return
+        self._requested_cloth = cloth_name
+        ready = threading.Event()
+
+        def swap(garment):
+            try:
+                # 読み込み中に別の衣装が選ばれた場合は差し替えない
+                if garment is not None and self._requested_cloth == garment.name:
+                    self.garment = garment
+                    self.selected_cloth = garment.name
+                    print(f"衣装を {garment.name} に切り替えました。")
+                    self._prefetch_neighbors(garment.name)
+            finally:
+                ready.set()
+
+        self.prefetcher.request(cloth_name, swap)
+        if wait:
+            ready.wait()
+
+    def switchCamera(self, camera_index, wait=False):
+        """
+        カメラを切り替える (姿勢推定のモデル・衣装のアセット・表示はそのまま使い続ける)
+        新しいカメラはワーカースレッドで開いて数フレーム読み捨て、準備ができた時点で取得ステージが差し替える
+        それまでは前のカメラの映像を処理し続けるため、映像が途切れるのは差し替えの1〜2フレームだけになる
+        wait: Trueの場合は差し替えが終わるまで (開けなかった場合はそれが分かるまで) 待つ
+        返り値: wait=True の場合は切り替えられたか (wait=False の場合は None)
+        """
+        done = threading.Event()
+        result = {"ok": False}
+        with self._source_lock:
+            self._switch_requests += 1
+            request = self._switch_requests
+
+        def open_camera():
+            source = CameraSource(camera_index)
+            if not source.isOpened() or not self._warm_up(source):
+                print(f"エラー: カメラ {camera_index} を開けませんでした。")
+                source.release()
+                done.set()
+                return
+            with self._source_lock:
+                if request != self._switch_requests:
+                    # 準備している間に別のカメラが選ばれた場合は、こちらは使わない
+                    previous = (source, camera_index, done)
+                else:
+                    result["ok"] = True
+                    previous, self._next_source = self._next_source, (source, camera_index, done)
+            if previous is not None:
+                # 差し替え前に別のカメラが選ばれた場合は、古い方を閉じる
+                previous[0].release()
+                previous[2].set()
+            capture_thread = self._capture_thread
+            if capture_thread is None or not capture_thread.is_alive():
+                # 映像処理を行っていない場合はここで差し替える
+                self._swap_source()
+
+        threading.Thread(target=open_camera, daemon=True).start()
+        if wait:
+            done.wait()
+            return result["ok"]
+        return None
+
+    def _warm_up(self, source):
+        """
+        カメラから最初の数フレームを読み捨てる (読めなかった場合は False)
+        読み込みがすぐに失敗するカメラ (抜かれた場合など) で空回りしないよう、失敗したら少し待ってから読み直し、
+        続けて失敗した場合はタイムアウトを待たずに諦める
+        """
+        deadline = time.perf_counter() + self.config.CAMERA_OPEN_TIMEOUT
+        frames = 0
+        failures = 0
+        while frames < max(1, self.config.CAMERA_WARMUP_FRAMES):
+            if time.perf_counter() > deadline:
+                return False
+            ret, frame = source.read()
+            if ret and frame is not None:
+                frames += 1
+                failures = 0
+                continue
+            failures += 1
+            if failures >= self.config.CAMERA_MAX_READ_FAILURES:
+                return False
+            time.sleep(self.config.CAMERA_READ_RETRY_INTERVAL)
+        return True
+
+    def _swap_source(self):
+        """切り替え先の入力の準備ができていれば差し替える (取得ステージから呼ぶ)"""
+        if self._next_source is None:
+            return
+        with self._source_lock:
+            next_source, self._next_source = self._next_source, None
+        if next_source is None:
+            return
+        source, camera_index, done = next_source
+        previous, self.cap = self.cap, source
+        self.camera_index = camera_index
+        # 以降のフレームでは、推定・平滑化の状態を前のカメラから引き継がない
+        self._source_generation += 1
+        previous.release()
+        print(f"カメラを {camera_index} に切り替えました。")
+        done.set()
+
+    def _prefetch_neighbors(self, cloth_name):
+        """切り替え順で前後の衣装を先読みする"""
+        names = self.assets.names()
+        index = names.index(cloth_name)
+        neighbors = []
+        for offset in range(1, self.config.ASSET_PREFETCH_NEIGHBORS + 1):
+            for name in (names[(index + offset) % len(names)], names[(index - offset) % len(names)]):
+                if name != cloth_name and name not in neighbors:
+                    neighbors.append(name)
+        self.prefetcher.prefetch(neighbors)
     
+    def setBackground(self, mode, color=None, image=None):
+        """
+        背景の置き換え方を切り替える
+        mode: None (置き換えない) / "color" (単色) / "image" (静止画) / "blur" (ぼかし)
+        color: 単色の背景色 (B, G, R)、image: 静止画の背景 (BGR画像またはファイルのパス)
+        """
+        if mode is None:
+            background, self.background = self.background, None
+            if background is not None:
+                background.close()
+            return
+        if self.background is None:
+            self.background = BackgroundReplacer(
+                mode, color if color is not None else self.config.BACKGROUND_COLOR, image,
+                long_side=self.config.BACKGROUND_SEGMENTATION_LONG_SIDE,
+                threshold=self.config.BACKGROUND_THRESHOLD,
+                feather=self.config.BACKGROUND_FEATHER,
+                blur_ksize=self.config.BACKGROUND_BLUR_KSIZE,
+                compositor=self.drawer.compositor)
+        else:
+            self.background.set_mode(mode, color, image)
+
+    def setOcclusion(self, enabled):
+        """手前にある腕による胴体の衣装の遮蔽を有効・無効にする"""
+        if not enabled:
+            occlusion, self.occlusion = self.occlusion, None
+            if occlusion is not None:
+                occlusion.close()
+            return
+        if self.occlusion is None:
+            self.occlusion = OcclusionMasker(
+                long_side=self.config.OCCLUSION_LONG_SIDE,
+                arm_width_ratio=self.config.OCCLUSION_ARM_WIDTH_RATIO,
+                depth_margin=self.config.OCCLUSION_DEPTH_MARGIN,
+                min_visibility=self.config.MIN_VISIBILITY_THRESHOLD,
+                segmentation_interval=self.config.OCCLUSION_SEGMENTATION_INTERVAL)
+
+    def addSink(self, sink, **params):
+        """
+        描画済みフレームの出力先を追加し、追加した出力先を返す
+        sink: OutputSink または名前 ("virtual_camera" / "window" / "file" / "memory" / "null")
+        """
+        if not isinstance(sink, OutputSink):
+            sink = createSink(sink, **{**self._sink_params(sink), **params})
+        # 描画スレッドは参照したタプルを使うため、差し替えるだけでよい
+        self.sinks = (*self.sinks, sink)
+        return sink
+
+    def removeSink(self, sink):
+        """出力先を取り除いて閉じる"""
+        self.sinks = tuple(s for s in self.sinks if s is not sink)
+        sink.close()
+
+    def _sink_params(self, name):
+        """設定に従って出力先のパラメータを返す"""
+        if name == "virtual_camera":
+            return {"fps": self.config.VIRTUAL_CAMERA_FPS}
+        if name == "file":
+            return {"path": self.config.OUTPUT_FILE_PATH, "fourcc": self.config.OUTPUT_FILE_FOURCC}
+        if name == "recording":
+            return {
+                "path": self.config.RECORDING_PATH,
+                "fourcc": self.config.RECORDING_FOURCC,
+                "fps": self.config.RECORDING_FPS,
+                "size": self.config.RECORDING_SIZE,
+                "policy": self.config.RECORDING_POLICY,
+                "queue_size": self.config.RECORDING_QUEUE_SIZE,
+                "max_bytes": self.config.RECORDING_MAX_BYTES,
+                "max_seconds": self.config.RECORDING_MAX_SECONDS,
+                "hw_acceleration": self.config.RECORDING_HW_ACCELERATION,
+            }
+        return {}
+
     def switchDrawingCloth(self):
         '''服装の表示状態を反転させる'''
         self.cloth_state=not(self.cloth_state)
 
     def _cleanup(self):
         """リソースを解放する"""
-        self.pose.close()
+        self.prefetcher.close()
+        if self.pose is not None:
+            self.pose.close()
+        if self._owns_pose_pool:
+            self.pose_pool.close()
+        sinks, self.sinks = self.sinks, ()
+        for sink in sinks:
+            sink.close()
+        if self.background is not None:
+            self.background.close()
+        if self.occlusion is not None:
+            self.occlusion.close()
+        with self._source_lock:
+            next_source, self._next_source = self._next_source, None
+        if next_source is not None:
+            next_source[0].release()
+            next_source[2].set()
         self.cap.release()
-        cv2.destroyAllWindows()
+        try:
+            cv2.destroyAllWindows()
+        except cv2.error:
+            # GUIを持たない環境 (ヘッドレス実行) では何もしない
+            pass
 
 # if __name__ == "__main__":
 #     try:
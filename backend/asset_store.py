@@ -0,0 +1,361 @@
+import hashlib
+import json
+import os
+import queue
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from backend.compositing import premultiplyAlpha
+from backend.library import opaqueHull
+
+# 衣装ディレクトリ内のパーツ画像のファイル名 (既定値)
+PART_FILES = {
+    "fullbody": "0.png",
+    "torso": "1.png",
+    "upper_arm": "2.png",
+    "forearm": "3.png",
+}
+# 左右反転したバージョンも用意するパーツ
+FLIPPED_PARTS = ("upper_arm", "forearm")
+# キャッシュの形式を変更したら上げる (古いキャッシュは作り直される)
+CACHE_VERSION = 2
+
+
+class Garment:
+    """1着分のパーツ画像 (アルファ乗算済みのBGRA) と、不透明領域の凸包"""
+
+    __slots__ = ("name", "images", "hulls", "nbytes")
+
+    def __init__(self, name, images, hulls):
+        self.name = name
+        self.images = images
+        self.hulls = hulls
+        self.nbytes = sum(image.nbytes for image in images.values())
+
+
+class AssetStore:
+    """
+    衣装のパーツ画像を必要になった時点で読み込むストア
+    PNGのデコード・アルファ乗算・左右反転・凸包の計算は初回に1回だけ行い、結果を .npy としてディスクにキャッシュする
+    2回目以降は .npy をメモリマップで開くため、デコードを行わず、実際に参照した部分だけがメモリに載る
+    読み込んだ衣装は合計サイズの上限を超えると、最も長く使われていないものから解放する
+    """
+
+    def __init__(self, sources, cache_dir=".asset_cache", max_bytes=512 * 1024 * 1024, use_mmap=True,
+                 part_files=None, geometry=None):
+        """
+        sources: {衣装名: パーツ画像のディレクトリ}
+        cache_dir: デコード済み画像のキャッシュを置くディレクトリ
+        max_bytes: 読み込んだままにしておく衣装の合計サイズの上限
+        use_mmap: Falseの場合はキャッシュをメモリに読み込む
+        part_files: {衣装名: {パーツ名: ファイル名}} (省略した衣装は PART_FILES)
+        geometry: {衣装名: {パーツ名: {"size", "sha1", "opaque_hull"}}} - 計算済みの不透明領域の凸包 (カタログのキャッシュなど)
+            凸包は計算に使った画像と大きさ・SHA-1 が一致する場合だけ使い、一致しなければ元画像から計算した凸包を使う
+        """
+        self.sources = dict(sources)
+        self.part_files = dict(part_files) if part_files else {}
+        self.geometry = dict(geometry) if geometry else {}
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.use_mmap = use_mmap
+        self._garments = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # 同じ衣装のキャッシュを複数のスレッドが同時に作らないようにする
+        self._build_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_catalog(cls, catalog, cache_dir=".asset_cache", max_bytes=512 * 1024 * 1024, use_mmap=True):
+        """衣装カタログ (backend.catalog.Catalog) からストアを生成する"""
+        specs = [catalog.get(garment_id) for garment_id in catalog.ids()]
+        return cls(
+            {spec.id: spec.path for spec in specs}, cache_dir, max_bytes, use_mmap,
+            part_files={spec.id: spec.part_files() for spec in specs},
+            # カタログにキャッシュされた凸包を使い、読み込み時の計算を省く
+            geometry={spec.id: spec.geometry for spec in specs})
+
+    def names(self):
+        """利用可能な衣装名のリストを返す"""
+        return list(self.sources)
+
+    def __contains__(self, name):
+        return name in self.sources
+
+    def get(self, name, pinned=()):
+        """
+        衣装を返す (読み込んでいなければキャッシュから読み込む)
+        pinned: 上限を超えても解放しない衣装名 (表示中の衣装など)
+        """
+        if name not in self.sources:
+            raise KeyError(name)
+        with self._lock:
+            garment = self._garments.get(name)
+            if garment is not None:
+                self._garments.move_to_end(name)
+                self.hits += 1
+                return garment
+            self.misses += 1
+
+        garment = self._load(name)
+        with self._lock:
+            if name not in self._garments:
+                self._garments[name] = garment
+                self._bytes += garment.nbytes
+            garment = self._garments[name]
+            self._garments.move_to_end(name)
+            self._evict({name, *pinned})
+        return garment
+
+    def loaded(self, name):
+        """衣装が読み込み済みかを返す"""
+        with self._lock:
+            return name in self._garments
+
+    def _evict(self, keep):
+        """合計サイズが上限以下になるまで古い衣装を解放する (keep に含まれる衣装は残す)"""
+        for name in list(self._garments):
+            if self._bytes <= self.max_bytes:
+                break
+            if name in keep:
+                continue
+            self._bytes -= self._garments.pop(name).nbytes
+            self.evictions += 1
+
+    def evict(self, name):
+        """衣装を解放する"""
+        with self._lock:
+            garment = self._garments.pop(name, None)
+            if garment is not None:
+                self._bytes -= garment.nbytes
+
+    def stats(self):
+        """読み込み済みの衣装数・合計サイズ・ヒット率などを返す"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "garments": len(self._garments),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def _garment_cache_dir(self, name):
+        return os.path.join(self.cache_dir, name)
+
+    def _part_files(self, name):
+        return self.part_files.get(name, PART_FILES)
+
+    def _source_signature(self, source_dir, part_files):
+        """元画像の更新日時と大きさ (キャッシュが古くなっていないかの判定に使う)"""
+        signature = {"version": CACHE_VERSION}
+        for part, filename in part_files.items():
+            stat = os.stat(os.path.join(source_dir, filename))
+            signature[part] = [filename, stat.st_mtime_ns, stat.st_size]
+        return signature
+
+    def _load(self, name):
+        """キャッシュから衣装を読み込む (キャッシュがない・古い場合は作り直す)"""
+        source_dir = self.sources[name]
+        part_files = self._part_files(name)
+        cache_dir = self._garment_cache_dir(name)
+        signature = self._source_signature(source_dir, part_files)
+        with self._build_lock:
+            meta = self._read_meta(cache_dir)
+            if not self._is_cache_valid(cache_dir, meta, signature, part_files):
+                meta = self._build_cache(source_dir, cache_dir, signature, part_files)
+
+        mmap_mode = "r" if self.use_mmap else None
+        images, hulls = {}, {}
+        for part in self._cached_parts(part_files):
+            images[part] = np.load(os.path.join(cache_dir, f"{part}.npy"), mmap_mode=mmap_mode)
+        known_geometry = self.geometry.get(name, {})
+        for part in part_files:
+            hull = self._known_hull(known_geometry.get(part), images[part], meta["sha1"].get(part))
+            if hull is not None:
+                hulls[part] = hull
+                continue
+            hull_path = os.path.join(cache_dir, f"{part}.hull.npy")
+            hulls[part] = np.load(hull_path) if os.path.exists(hull_path) else None
+        return Garment(name, images, hulls)
+
+    @staticmethod
+    def _cached_parts(part_files):
+        return [*part_files, *(f"flipped_{part}" for part in FLIPPED_PARTS if part in part_files)]
+
+    @staticmethod
+    def _known_hull(geometry, image, digest):
+        """
+        計算済みの凸包が、読み込んだ画像から計算したものであれば返す (そうでなければ None)
+        マニフェストを更新せずに画像を編集した場合に、古い凸包で胴体の大きさを決めてしまわないようにする
+        """
+        if geometry is None or geometry.get("opaque_hull") is None:
+            return None
+        height, width = image.shape[:2]
+        if tuple(geometry.get("size", ())) != (width, height):
+            return None
+        if geometry.get("sha1") is not None and geometry["sha1"] != digest:
+            return None
+        return geometry["opaque_hull"]
+
+    @staticmethod
+    def _read_meta(cache_dir):
+        try:
+            with open(os.path.join(cache_dir, "meta.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _is_cache_valid(self, cache_dir, meta, signature, part_files):
+        if meta is None or "sha1" not in meta:
+            return False
+        if {key: value for key, value in meta.items() if key != "sha1"} != signature:
+            return False
+        return all(os.path.exists(os.path.join(cache_dir, f"{part}.npy")) for part in self._cached_parts(part_files))
+
+    def _build_cache(self, source_dir, cache_dir, signature, part_files):
+        """
+        元画像をデコードし、アルファ乗算・左右反転した画像と凸包を .npy で保存する
+        元画像の SHA-1 もメタデータに記録し、返す (カタログの凸包が同じ画像から計算されたものかの判定に使う)
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        digests = {}
+        for part, filename in part_files.items():
+            path = os.path.join(source_dir, filename)
+            with open(path, "rb") as f:
+                data = f.read()
+            digests[part] = hashlib.sha1(data).hexdigest()
+            image = loadRgbaImage(path, data)
+            hull = opaqueHull(image)
+            # 合成時の乗算を省くため、アルファ乗算済みの形で保持する
+            image = premultiplyAlpha(image)
+            self._save(cache_dir, part, image)
+            hull_path = os.path.join(cache_dir, f"{part}.hull.npy")
+            if hull is not None:
+                np.save(hull_path, hull)
+            elif os.path.exists(hull_path):
+                os.remove(hull_path)
+            # 腕のパーツは左右反転したバージョンも用意する
+            if part in FLIPPED_PARTS:
+                self._save(cache_dir, f"flipped_{part}", cv2.flip(image, 1))
+        # メタデータは最後に書き込む (途中で中断した場合はキャッシュが無効のまま残る)
+        meta = {**signature, "sha1": digests}
+        with open(os.path.join(cache_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        return meta
+
+    @staticmethod
+    def _save(cache_dir, part, image):
+        # 書き込み途中のファイルを読み込まないよう、一時ファイルに書いてから置き換える
+        path = os.path.join(cache_dir, f"{part}.npy")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.ascontiguousarray(image))
+        os.replace(tmp_path, path)
+
+
+def loadRgbaImage(path, data=None):
+    '''
+    アルファチャンネル付きの画像を読み込む。読み込めない場合は IOError を送出する
+    data: 読み込み済みのファイルの内容 (指定した場合はファイルを読まずにデコードする)
+    '''
+    if data is None:
+        img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    else:
+        img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+    if img is None:
+        raise IOError(f"画像の読み込みに失敗しました: {path}")
+    if len(img.shape) < 3 or img.shape[2] != 4:
+        raise IOError(f"{path} にはアルファチャンネル（透過情報）がありません。透過PNGで保存してください。")
+    return img
+
+
+class AssetPrefetcher:
+    """
+    衣装の読み込みをワーカースレッドで行う
+    読み込んだ衣装はページをメモリに載せてから (メモリマップの場合) 完了を通知するため、
+    差し替えた直後のフレームの描画で読み込み待ちが発生しない
+    """
+
+    def __init__(self, store, pinned=None):
+        """
+        store: AssetStore
+        pinned: 解放しない衣装名のリストを返す関数 (表示中・切り替え中の衣装など)
+        """
+        self.store = store
+        self._pinned = pinned if pinned is not None else (lambda: ())
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._worker, daemon=True)
+        self._thread.start()
+
+    def request(self, name, on_ready=None):
+        """
+        衣装の読み込みを依頼する。読み込み後に on_ready(garment) をワーカースレッドで呼び出す
+        (読み込みに失敗した場合は garment に None を渡す)
+        """
+        self._queue.put((name, on_ready))
+
+    def prefetch(self, names):
+        """衣装を先読みしておく (読み込み済みのものは何もしない)"""
+        for name in names:
+            if not self.store.loaded(name):
+                self._queue.put((name, None))
+
+    def close(self):
+        """
+        ワーカースレッドを終了する (まだ始まっていない読み込みは破棄する)
+        破棄した依頼の on_ready には None を渡し、完了を待っている呼び出し側を待たせたままにしない
+        """
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None and item[1] is not None:
+                item[1](None)
+        self._queue.put(None)
+        self._thread.join()
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            name, on_ready = item
+            garment = None
+            try:
+                garment = self.store.get(name, pinned=self._pinned())
+                touchPages(garment)
+            except Exception as e:
+                # 壊れたキャッシュ (ValueError) や cv2.error などでもスレッドを終わらせず、次の依頼を受け付ける
+                print(f"エラー: 衣装 '{name}' の読み込みに失敗しました: {e}")
+                garment = None
+            finally:
+                # 失敗しても必ず通知し、完了を待っている呼び出し側 (changeCloth(wait=True) など) を待たせたままにしない
+                if on_ready is not None:
+                    self._notify(on_ready, name, garment)
+
+    @staticmethod
+    def _notify(on_ready, name, garment):
+        try:
+            on_ready(garment)
+        except Exception as e:
+            print(f"エラー: 衣装 '{name}' の読み込み完了の処理に失敗しました: {e}")
+
+
+def touchPages(garment, page_size=4096):
+    '''
+    メモリマップした衣装画像の各ページを1バイトずつ読み、メモリに載せておく
+    '''
+    for image in garment.images.values():
+        if isinstance(image, np.memmap):
+            flat = image.reshape(-1)
+            int(flat[::page_size].sum())
@@ -0,0 +1,111 @@
+import cv2
+import numpy as np
+import numpy.typing as npt
+
+from backend.compositing import AlphaCompositor
+from backend.library import HumanSegmenter, resizeLongSide
+
+
+class BackgroundReplacer:
+    """
+    人物以外の背景を単色・静止画・ぼかした映像に置き換える
+    セグメンテーションは縮小した画像で行い、マスクのぼかし (境界のフェザー) も縮小したまま行ってから
+    カメラの解像度に拡大する。合成は AlphaCompositor.mix による uint8 の1回の混合で行う
+    """
+
+    MODES = ("color", "image", "blur")
+
+    def __init__(self, mode="color", color=(0, 255, 0), image=None, long_side=256,
+                 threshold=0.3, feather=7, blur_ksize=21, segmenter=None, compositor=None):
+        """
+        mode: "color" (単色) / "image" (静止画) / "blur" (ぼかした映像)
+        color: 単色の背景色 (B, G, R)
+        image: 静止画の背景 (BGR画像またはファイルのパス)
+        long_side: セグメンテーションに使う画像の長辺 [px]
+        threshold: 人物とみなすマスク値 (0〜1) の閾値
+        feather: 境界をぼかすカーネルの大きさ (縮小した画像上の px、奇数。0ならぼかさない)
+        blur_ksize: 背景をぼかすカーネルの大きさ (縮小した画像上の px、奇数)
+        segmenter: 使用する HumanSegmenter (省略時はプロセスで共有するインスタンスを使い、遮蔽の処理などとモデルを共有する)
+        compositor: 合成に使う AlphaCompositor (省略時は生成する)
+        """
+        self.long_side = long_side
+        self.feather = feather
+        self.blur_ksize = blur_ksize
+        self.threshold = threshold
+        self.segmenter = segmenter if segmenter is not None else HumanSegmenter.shared()
+        self.compositor = compositor if compositor is not None else AlphaCompositor()
+        self._image = None
+        self._background = None  # カメラの解像度に合わせた単色・静止画の背景
+        self._background_mask = None
+        self.set_mode(mode, color, image)
+
+    def set_mode(self, mode, color=None, image=None):
+        """背景の種類を切り替える (color, image は省略時には変更しない)"""
+        if mode not in self.MODES:
+            raise ValueError(f"未対応の背景です: {mode} (利用可能: {self.MODES})")
+        if mode == "image" and image is None and self._image is None:
+            raise ValueError("静止画の背景には image を指定してください。")
+        self.mode = mode
+        if color is not None:
+            self.color = tuple(color)
+        if image is not None:
+            if isinstance(image, str):
+                path = image
+                image = cv2.imread(path, cv2.IMREAD_COLOR)
+                if image is None:
+                    raise IOError(f"背景画像の読み込みに失敗しました: {path}")
+            self._image = image
+        # 次のフレームで作り直す
+        self._background = None
+
+    def person_mask(self, frame:npt.NDArray[np.uint8])->npt.NDArray[np.uint8]:
+        """
+        人物らしさ (0〜255、人物が255) のマスクを縮小した解像度で求める
+        境界のぼかしも縮小したまま行う (カメラの解像度への拡大は apply で行う)
+        """
+        small = resizeLongSide(frame, self.long_side)
+        mask = self.segmenter.binary_mask(small, threshold=self.threshold, copy=True)
+        if self.feather and self.feather > 1:
+            cv2.GaussianBlur(mask, (self.feather, self.feather), 0, dst=mask)
+        return mask
+
+    def _static_background(self, shape):
+        """単色・静止画の背景をカメラの解像度で返す (大きさが変わったときだけ作り直す)"""
+        background = self._background
+        if background is None or background.shape != shape:
+            if self.mode == "image":
+                background = cv2.resize(self._image, (shape[1], shape[0]), interpolation=cv2.INTER_AREA)
+            else:
+                background = np.full(shape, self.color, np.uint8)
+            self._background = background
+        return background
+
+    def _blurred_background(self, frame):
+        """縮小した画像をぼかしてから拡大する (フル解像度でぼかすより大幅に軽い)"""
+        small = resizeLongSide(frame, self.long_side)
+        small = cv2.GaussianBlur(small, (self.blur_ksize, self.blur_ksize), 0)
+        return cv2.resize(small, (frame.shape[1], frame.shape[0]), interpolation=cv2.INTER_LINEAR)
+
+    def apply(self, frame:npt.NDArray[np.uint8], person_mask:npt.NDArray[np.uint8]|None=None):
+        """
+        フレームの背景をその場で置き換える
+        person_mask: person_mask() で求めたマスク (省略時はここで求める)
+        """
+        if person_mask is None:
+            person_mask = self.person_mask(frame)
+        h, w = frame.shape[:2]
+        # 背景側の重みを縮小したまま求めてから、カメラの解像度に拡大する
+        if self._background_mask is None or self._background_mask.shape != (h, w):
+            self._background_mask = np.empty((h, w), np.uint8)
+        cv2.resize(cv2.bitwise_not(person_mask), (w, h), dst=self._background_mask, interpolation=cv2.INTER_LINEAR)
+
+        if self.mode == "blur":
+            background = self._blurred_background(frame)
+        else:
+            background = self._static_background(frame.shape)
+        self.compositor.mix(frame, background, self._background_mask)
+
+    def close(self):
+        """処理を終える (セグメンテーションモデルは他の処理と共有するため、生成した側が解放する)"""
+        self._background = None
+        self._background_mask = None
@@ -0,0 +1,111 @@
+'''
+姿勢推定に使う画像の解像度と、推定時間・ランドマーク精度の関係を測定する
+
+使い方 (リポジトリのルートで実行):
+    python -m backend.bench_inference_resolution
+    python -m backend.bench_inference_resolution --sizes 512 384 256 --repeat 10 --json result.json
+
+各解像度で backend/test_images の画像を推定し、元の解像度で推定した結果との誤差を
+元画像のピクセル単位 (信頼度が閾値を超える関節の平均) で求める
+'''
+import argparse
+import json
+import os
+import time
+
+import cv2
+import mediapipe as mp
+import numpy as np
+
+from backend.library import fetchPathNames, resizeLongSide
+from backend.landmarks import X, Y, VISIBILITY, landmarksToArray
+
+TEST_IMAGES_PATH = os.path.join(os.path.dirname(__file__), "test_images")
+MIN_VISIBILITY_THRESHOLD = 0.5
+
+
+def estimate(pose, image, long_side):
+    '''
+    アプリと同じ手順 (縮小 → 色変換 → 推定) でランドマークを求め、(ランドマーク, 所要時間[秒]) を返す
+    '''
+    start = time.perf_counter()
+    small = resizeLongSide(image, long_side)
+    results = pose.process(cv2.cvtColor(small, cv2.COLOR_BGR2RGB))
+    elapsed = time.perf_counter() - start
+    return landmarksToArray(results.pose_landmarks), elapsed
+
+
+def landmarkError(landmarks, reference, image_shape):
+    '''
+    基準のランドマークとの誤差を元画像のピクセル単位で返す (信頼度が閾値を超える関節の平均)
+    '''
+    if landmarks is None:
+        return None
+    H, W = image_shape[:2]
+    visible = reference[:, VISIBILITY] > MIN_VISIBILITY_THRESHOLD
+    if not visible.any():
+        return None
+    diff = (landmarks[visible][:, [X, Y]] - reference[visible][:, [X, Y]]) * (W, H)
+    return float(np.hypot(diff[:, 0], diff[:, 1]).mean())
+
+
+def run(sizes, repeat):
+    '''
+    解像度ごとの推定時間と誤差を測定する
+    '''
+    paths = sorted(fetchPathNames(TEST_IMAGES_PATH))
+    images = [cv2.imread(path, cv2.IMREAD_COLOR) for path in paths]
+
+    # 静止画なので、フレーム間の追跡を行わないモードで1枚ずつ独立に推定する
+    with mp.solutions.pose.Pose(static_image_mode=True) as pose:
+        references = [estimate(pose, image, None)[0] for image in images]
+
+        report = []
+        for size in sizes:
+            times, errors, misses = [], [], 0
+            for image, reference in zip(images, references):
+                if reference is None:
+                    continue
+                for _ in range(repeat):
+                    landmarks, elapsed = estimate(pose, image, size)
+                    times.append(elapsed * 1000.0)
+                error = landmarkError(landmarks, reference, image.shape)
+                if error is None:
+                    misses += 1
+                else:
+                    errors.append(error)
+            report.append({
+                "long_side": size,
+                "latency_ms_p50": float(np.percentile(times, 50)) if times else None,
+                "latency_ms_p95": float(np.percentile(times, 95)) if times else None,
+                "error_px_mean": float(np.mean(errors)) if errors else None,
+                "error_px_max": float(np.max(errors)) if errors else None,
+                "misses": misses,
+            })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="姿勢推定の解像度と推定時間・精度の関係を測定する")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[0, 640, 512, 384, 256, 192],
+                        help="推定に使う画像の長辺 [px] (0は元の解像度)")
+    parser.add_argument("--repeat", type=int, default=5, help="1枚あたりの推定回数")
+    parser.add_argument("--json", help="結果をJSONで保存するパス")
+    args = parser.parse_args()
+
+    report = run([size or None for size in args.sizes], args.repeat)
+
+    print(f"{'長辺[px]':>10} {'p50[ms]':>9} {'p95[ms]':>9} {'誤差平均[px]':>12} {'誤差最大[px]':>12} {'未検出':>6}")
+    for row in report:
+        def fmt(value):
+            return f"{value:.1f}" if value is not None else "-"
+        print(f"{row['long_side'] or '元画像':>10} {fmt(row['latency_ms_p50']):>9} {fmt(row['latency_ms_p95']):>9} "
+              f"{fmt(row['error_px_mean']):>12} {fmt(row['error_px_max']):>12} {row['misses']:>6}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
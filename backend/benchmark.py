@@ -0,0 +1,254 @@
+'''
+試着処理のベンチマーク (カメラ・GUIなしで実行できる)
+
+使い方 (リポジトリのルートで実行):
+    python -m backend.benchmark                                   # 結果をJSONで表示する
+    python -m backend.benchmark --save-baseline base.json         # 結果を基準値として保存する
+    python -m backend.benchmark --baseline base.json              # 基準値と比較し、遅くなっていれば終了コード1で終了する
+
+backend/test_images の画像と、ランドマークを動かして作った合成の姿勢列を
+VirtualTryOnApp._process_frame / BodyPartDrawer.draw_torso, draw_limb / _overlay_png に通し、
+処理ごとの p50/p95/p99 [ms]、FPS、最大メモリ使用量 (RSS) を測定する
+'''
+import argparse
+import functools
+import json
+import math
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from backend.app import VirtualTryOnApp
+from backend.frame_source import SyntheticSource
+from backend.library import fetchPathNames
+
+try:
+    import resource
+except ImportError:
+    # Windows には resource モジュールがない
+    resource = None
+
+TEST_IMAGES_PATH = os.path.join(os.path.dirname(__file__), "test_images")
+# 基準値との比較に使う指標
+COMPARED_PERCENTILES = ("p50_ms", "p95_ms")
+
+
+def peakRssBytes():
+    '''
+    プロセスの最大メモリ使用量 (RSS) をバイト単位で返す (取得できない環境では None)
+    '''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB、macOS はバイト単位
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def summarize(durations):
+    '''
+    所要時間 [秒] のリストから p50/p95/p99 [ms] などの統計値を求める
+    '''
+    if not durations:
+        return None
+    values = np.asarray(durations) * 1000.0
+    return {
+        "count": int(values.size),
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+    }
+
+
+class StageTimer:
+    """処理ごとの所要時間を集める"""
+
+    def __init__(self):
+        self.durations = {}
+
+    def record(self, stage, elapsed):
+        self.durations.setdefault(stage, []).append(elapsed)
+
+    def wrap(self, obj, method_name, stage):
+        '''
+        インスタンスのメソッドを、所要時間を記録するものに置き換える
+        '''
+        method = getattr(obj, method_name)
+
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+
+        setattr(obj, method_name, timed)
+
+    def summary(self):
+        return {stage: summarize(values) for stage, values in self.durations.items()}
+
+
+def syntheticPoses(base, count, sway_degrees=12.0):
+    '''
+    基準のランドマーク (33, 4) を、肩の中心を軸に回転・拡大縮小・平行移動させた姿勢列を作る
+    ゆっくり体を揺らす動きを想定し、衣装の回転角・拡大率が少しずつ変わるようにする
+    sway_degrees: 体を揺らす角度の振れ幅 (±度)
+    '''
+    left_shoulder, right_shoulder = 11, 12
+    center = (base[left_shoulder, :2] + base[right_shoulder, :2]) / 2
+    poses = []
+    for i in range(count):
+        phase = 2.0 * math.pi * i / 60.0
+        angle = math.radians(sway_degrees * math.sin(phase))
+        scale = 1.0 + 0.1 * math.sin(phase / 2.0)
+        shift = np.array([0.05 * math.sin(phase / 3.0), 0.02 * math.cos(phase)], np.float32)
+        rotation = np.array([[math.cos(angle), -math.sin(angle)], [math.sin(angle), math.cos(angle)]], np.float32)
+        pose = base.copy()
+        pose[:, :2] = ((base[:, :2] - center) @ rotation.T) * scale + center + shift
+        poses.append(pose)
+    return poses
+
+
+def run(args):
+    '''
+    ベンチマークを実行し、結果を辞書で返す
+    '''
+    images = [cv2.imread(path, cv2.IMREAD_COLOR) for path in sorted(fetchPathNames(TEST_IMAGES_PATH))]
+    if args.width:
+        images = [cv2.resize(image, (args.width, round(image.shape[0] * args.width / image.shape[1]))) for image in images]
+
+    # カメラを開かず、映像処理スレッドも開始しない
+    app = VirtualTryOnApp(source=SyntheticSource(count=0), inference_size=args.inference_size, autostart=False)
+    app.cloth_state = True
+    app.changeCloth(args.cloth, wait=True)
+    timer = StageTimer()
+    timer.wrap(app.drawer, "draw_torso", "draw_torso")
+    timer.wrap(app.drawer, "draw_limb", "draw_limb")
+    timer.wrap(app.drawer, "_overlay_png", "overlay_png")
+
+    try:
+        # 1. 実画像: 姿勢推定から描画まで
+        base_landmarks = None
+        for _ in range(args.repeat):
+            for image in images:
+                frame = image.copy()
+                start = time.perf_counter()
+                landmarks = app._process_frame(frame)
+                timer.record("process_frame", time.perf_counter() - start)
+                app._draw_all(frame, landmarks)
+                timer.record("frame", time.perf_counter() - start)
+                if base_landmarks is None and landmarks is not None:
+                    base_landmarks = landmarks
+
+        # 2. 合成の姿勢列: 描画のみ (ゆっくり動く利用者を想定)
+        sway_cache = None
+        if base_landmarks is not None:
+            background = images[0]
+            before = app.drawer.sprite_cache.stats()
+            for landmarks in syntheticPoses(base_landmarks, args.synthetic_frames, args.sway_degrees):
+                frame = background.copy()
+                start = time.perf_counter()
+                app._draw_all(frame, landmarks)
+                timer.record("synthetic_render", time.perf_counter() - start)
+            sway_cache = spriteCacheDelta(before, app.drawer.sprite_cache.stats())
+    finally:
+        app.stop()
+
+    stages = timer.summary()
+    frame_stats = stages.get("frame")
+    return {
+        "stages": stages,
+        "fps": 1000.0 / frame_stats["mean_ms"] if frame_stats else None,
+        "peak_rss_bytes": peakRssBytes(),
+        "sprite_cache": app.drawer.sprite_cache.stats(),
+        # 合成の姿勢列 (体の揺れ) を描画した間のキャッシュのヒット率
+        "sprite_cache_sway": sway_cache,
+        "params": {
+            "images": len(images),
+            "repeat": args.repeat,
+            "synthetic_frames": args.synthetic_frames,
+            "sway_degrees": args.sway_degrees,
+            "width": args.width,
+            "inference_size": args.inference_size,
+            "cloth": args.cloth,
+        },
+    }
+
+
+def spriteCacheDelta(before, after):
+    '''
+    2つの時点のキャッシュの統計値から、その間のヒット数・ミス数・ヒット率などを求める
+    '''
+    delta = {key: after[key] - before[key] for key in ("hits", "misses", "evictions", "bypassed")}
+    lookups = delta["hits"] + delta["misses"]
+    delta["hit_rate"] = delta["hits"] / lookups if lookups > 0 else 0.0
+    delta["entries"] = after["entries"]
+    delta["bytes"] = after["bytes"]
+    return delta
+
+
+def compareWithBaseline(result, baseline, tolerance):
+    '''
+    基準値と比較し、許容範囲を超えて遅くなった指標のリストを返す
+    '''
+    regressions = []
+    for stage, stats in baseline.get("stages", {}).items():
+        current = result["stages"].get(stage)
+        if not stats or not current:
+            continue
+        for key in COMPARED_PERCENTILES:
+            if current[key] > stats[key] * (1.0 + tolerance):
+                regressions.append({
+                    "stage": stage,
+                    "metric": key,
+                    "baseline": stats[key],
+                    "current": current[key],
+                    "ratio": current[key] / stats[key] if stats[key] > 0 else None,
+                })
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="試着処理のベンチマーク")
+    parser.add_argument("--repeat", type=int, default=5, help="実画像を処理する周回数")
+    parser.add_argument("--synthetic-frames", type=int, default=300, help="合成の姿勢列のフレーム数")
+    parser.add_argument("--sway-degrees", type=float, default=12.0, help="合成の姿勢列で体を揺らす角度の振れ幅 (±度)")
+    parser.add_argument("--width", type=int, default=1280, help="入力画像の幅 [px] (0なら元の大きさ)")
+    parser.add_argument("--inference-size", type=int, default=None, help="姿勢推定に使う画像の長辺 [px]")
+    parser.add_argument("--cloth", default="suit", help="描画する衣装")
+    parser.add_argument("--output", help="結果をJSONで保存するパス")
+    parser.add_argument("--baseline", help="比較する基準値のJSON")
+    parser.add_argument("--save-baseline", help="結果を基準値として保存するパス")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="基準値に対して許容する遅れの割合")
+    args = parser.parse_args()
+
+    result = run(args)
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        result["regressions"] = compareWithBaseline(result, baseline, args.tolerance)
+        if result["regressions"]:
+            exit_code = 1
+
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    print(text)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+
+    if exit_code:
+        for regression in result["regressions"]:
+            print(f"性能低下: {regression['stage']} {regression['metric']} "
+                  f"{regression['baseline']:.2f}ms -> {regression['current']:.2f}ms", file=sys.stderr)
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+'''
+衣装カタログ (マニフェスト) の読み込み
+
+マニフェストは JSON で、衣装ごとにパーツ画像・基準点・拡大率・不透明領域を記述する:
+    {
+      "version": 1,
+      "garments": [
+        {
+          "id": "suit", "name": "スーツ", "category": "jacket", "path": "suit",
+          "parts": {
+            "torso": {"file": "1.png", "anchor": [0.5, 0.1]},
+            "upper_arm": {"file": "2.png", "anchor": [0.5, 0.1], "scale": 1.5},
+            ...
+          },
+          "fit": {"upward_shift_ratio": 0.15},
+          "geometry": {"torso": {"size": [1024, 1536], "sha1": "...", "opaque_bounds": [x1, y1, x2, y2], "opaque_hull": [[x, y], ...]}}
+        }
+      ]
+    }
+path はマニフェストからの相対パス、anchor は回転中心 (画像の幅・高さに対する比率)
+geometry は読み込み時の計算を省くためのキャッシュで (sha1 は計算に使った画像ファイルのハッシュ)、以下のコマンドで更新する (リポジトリのルートで実行):
+    python -m backend.catalog assets/catalog.json
+'''
+import argparse
+import hashlib
+import json
+import os
+import re
+
+import cv2
+import numpy as np
+
+from backend.library import opaqueHull
+
+# マニフェストで省略されたパーツの既定値
+DEFAULT_PARTS = {
+    "fullbody": {"file": "0.png", "anchor": [0.5, 0.1], "scale": 1.0},
+    "torso": {"file": "1.png", "anchor": [0.5, 0.1], "scale": 1.0},
+    "upper_arm": {"file": "2.png", "anchor": [0.5, 0.1], "scale": 1.0},
+    "forearm": {"file": "3.png", "anchor": [0.5, 0.5], "scale": 1.0},
+}
+# マニフェストで省略された着せ方のパラメータの既定値
+DEFAULT_FIT = {
+    "shoulder_width_ratio": 0.8,
+    "upward_shift_ratio": 0.15,
+}
+MANIFEST_VERSION = 1
+
+
+class GarmentSpec:
+    """マニフェストに記述された1着分の情報"""
+
+    __slots__ = ("id", "name", "category", "path", "parts", "fit", "geometry")
+
+    def __init__(self, id, name, category, path, parts, fit, geometry):
+        self.id = id
+        self.name = name
+        self.category = category
+        self.path = path  # パーツ画像のディレクトリ
+        self.parts = parts  # {パーツ名: {"file", "anchor", "scale"}}
+        self.fit = fit
+        self.geometry = geometry  # {パーツ名: {"size": (幅, 高さ), "sha1", "opaque_bounds", "opaque_hull"}}
+
+    def part_files(self):
+        """{パーツ名: ファイル名} を返す"""
+        return {part: spec["file"] for part, spec in self.parts.items()}
+
+    def anchor(self, part):
+        """パーツの回転中心 (幅・高さに対する比率)"""
+        return self.parts[part]["anchor"]
+
+    def scale(self, part):
+        """パーツの拡大率"""
+        return self.parts[part]["scale"]
+
+
+class Catalog:
+    """衣装の一覧 (idとカテゴリで引ける)"""
+
+    def __init__(self, garments, path=None):
+        self.path = path
+        self._garments = {garment.id: garment for garment in garments}
+        self._categories = {}
+        for garment in garments:
+            self._categories.setdefault(garment.category, []).append(garment.id)
+
+    @classmethod
+    def load(cls, path, default_parts=None, default_fit=None):
+        '''
+        マニフェストを読み込む
+        default_parts, default_fit: マニフェストで省略された値の既定値 (省略時は DEFAULT_PARTS, DEFAULT_FIT)
+        '''
+        with open(path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != MANIFEST_VERSION:
+            raise ValueError(f"未対応のマニフェストのバージョンです: {manifest.get('version')} ({path})")
+
+        default_parts = default_parts if default_parts is not None else DEFAULT_PARTS
+        default_fit = default_fit if default_fit is not None else DEFAULT_FIT
+        root = os.path.dirname(path)
+        garments = []
+        for entry in manifest["garments"]:
+            parts = {}
+            for part, default in default_parts.items():
+                parts[part] = {**default, **entry.get("parts", {}).get(part, {})}
+            geometry = {}
+            for part, cached in entry.get("geometry", {}).items():
+                geometry[part] = {
+                    "size": tuple(cached["size"]),
+                    "sha1": cached.get("sha1"),
+                    "opaque_bounds": tuple(cached["opaque_bounds"]) if cached.get("opaque_bounds") else None,
+                    "opaque_hull": np.array(cached["opaque_hull"], np.float32) if cached.get("opaque_hull") else None,
+                }
+            garments.append(GarmentSpec(
+                entry["id"],
+                entry.get("name", entry["id"]),
+                entry.get("category", ""),
+                os.path.join(root, entry.get("path", entry["id"])),
+                parts,
+                {**default_fit, **entry.get("fit", {})},
+                geometry,
+            ))
+        return cls(garments, path)
+
+    def __contains__(self, garment_id):
+        return garment_id in self._garments
+
+    def __len__(self):
+        return len(self._garments)
+
+    def get(self, garment_id):
+        """idから衣装を返す (なければ KeyError)"""
+        return self._garments[garment_id]
+
+    def ids(self):
+        """すべての衣装のidをマニフェストの順に返す"""
+        return list(self._garments)
+
+    def categories(self):
+        """カテゴリの一覧を返す"""
+        return list(self._categories)
+
+    def by_category(self, category):
+        """カテゴリに属する衣装を返す"""
+        return [self._garments[garment_id] for garment_id in self._categories.get(category, [])]
+
+
+def updateGeometry(path):
+    '''
+    マニフェストの各パーツ画像の大きさ・不透明領域を計算し、geometry としてマニフェストに書き込む
+    計算済みで画像ファイルの内容 (SHA-1) が変わっていないパーツは計算し直さない
+    (大きさを変えずに絵柄だけを編集した場合も計算し直す。更新日時はチェックアウトで変わるため使わない)
+    '''
+    with open(path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    catalog = Catalog.load(path)
+    updated = 0
+    for entry in manifest["garments"]:
+        spec = catalog.get(entry["id"])
+        geometry = entry.setdefault("geometry", {})
+        for part, part_spec in spec.parts.items():
+            image_path = os.path.join(spec.path, part_spec["file"])
+            with open(image_path, "rb") as f:
+                data = f.read()
+            digest = hashlib.sha1(data).hexdigest()
+            if geometry.get(part, {}).get("sha1") == digest:
+                continue
+            image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+            if image is None:
+                raise IOError(f"画像の読み込みに失敗しました: {image_path}")
+            size = [image.shape[1], image.shape[0]]
+            hull = opaqueHull(image)
+            if hull is None:
+                geometry[part] = {"size": size, "sha1": digest, "opaque_bounds": None, "opaque_hull": None}
+            else:
+                min_x, min_y = hull.min(axis=0)
+                max_x, max_y = hull.max(axis=0)
+                geometry[part] = {
+                    "size": size,
+                    "sha1": digest,
+                    "opaque_bounds": [int(min_x), int(min_y), int(max_x), int(max_y)],
+                    "opaque_hull": hull.astype(int).tolist(),
+                }
+            updated += 1
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(dumpManifest(manifest))
+    return updated
+
+
+def dumpManifest(manifest):
+    '''
+    マニフェストをJSONの文字列にする (数値の配列は1行にまとめる)
+    '''
+    text = json.dumps(manifest, ensure_ascii=False, indent=2)
+    text = re.sub(r"\[\s+([-\d.,\s]+?)\s+\]",
+                  lambda match: "[" + ", ".join(value.strip() for value in match.group(1).split(",")) + "]", text)
+    return text + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="衣装カタログのパーツ画像の大きさ・不透明領域を計算してマニフェストに書き込む")
+    parser.add_argument("manifest", nargs="?", default="assets/catalog.json", help="マニフェストのパス")
+    args = parser.parse_args()
+    updated = updateGeometry(args.manifest)
+    print(f"{updated} 個のパーツの geometry を更新しました: {args.manifest}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import cv2
+import numpy as np
+import numpy.typing as npt
+
+
+def premultiplyAlpha(src:npt.NDArray[np.uint8])->npt.NDArray[np.uint8]:
+    '''
+    BGRA画像の色成分にアルファ値を乗算した(premultiplied alpha)画像を返す
+    アセット読み込み時に1回だけ呼び出し、毎フレームの乗算を省く
+    '''
+    if src.ndim != 3 or src.shape[2] != 4:
+        return src
+
+    dst = src.copy()
+    # c * a / 255 を整数演算で丸める ((t + 128 + ((t + 128) >> 8)) >> 8 == round(t / 255))
+    tmp = src[:, :, :3].astype(np.uint16)
+    tmp *= src[:, :, 3:4]
+    tmp += 128
+    tmp += tmp >> 8
+    tmp >>= 8
+    dst[:, :, :3] = tmp
+    return dst
+
+
+class AlphaCompositor:
+    """
+    premultiplied alphaのBGRA画像を背景に固定小数点演算で合成するクラス
+    作業用バッファを使い回すため、フレーム毎の一時配列の確保が発生しない
+    """
+
+    def __init__(self, use_cv2=False):
+        """
+        use_cv2: Trueの場合、NumPyの代わりにcv2の飽和演算で合成する
+        """
+        self.use_cv2 = use_cv2
+        self._acc = np.empty(0, np.uint16)  # 積和用 (uint16)
+        self._tmp = np.empty(0, np.uint16)  # 丸め用 (uint16)
+        self._inv = np.empty(0, np.uint8)   # 255 - alpha (cv2経路用、3チャンネル)
+        self._fg = np.empty(0, np.uint8)    # 前景の色成分 (cv2経路用、3チャンネル)
+        self._mask = np.empty(0, np.uint8)  # 遮蔽マスク (4チャンネル)
+        self._masked = np.empty(0, np.uint8)  # 遮蔽マスクを掛けた前景 (4チャンネル)
+
+    @staticmethod
+    def _reserve(buf, size):
+        """作業用バッファが足りなければ拡張する"""
+        if buf.size < size:
+            buf = np.empty(size, buf.dtype)
+        return buf
+
+    def overlay(self, background_img, foreground_img, pos, mask=None):
+        """
+        背景画像にpremultiplied alphaのBGRA画像をその場で重ねる
+        pos: (x, y) - 重ねて表示する左上の座標
+        mask: 背景画像と同じ大きさの (H, W) の uint8 (0の画素には前景を描画しない。前景より手前にある物体の領域)
+        """
+        x, y = pos
+        bg_h, bg_w = background_img.shape[:2]
+        fg_h, fg_w = foreground_img.shape[:2]
+
+        # 画面外なら処理しない
+        if x >= bg_w or y >= bg_h or x + fg_w <= 0 or y + fg_h <= 0:
+            return
+
+        # 重ね合わせる領域を計算
+        roi_y1, roi_y2 = max(0, y), min(bg_h, y + fg_h)
+        roi_x1, roi_x2 = max(0, x), min(bg_w, x + fg_w)
+        fg_roi_y1, fg_roi_y2 = max(0, -y), max(0, -y) + (roi_y2 - roi_y1)
+        fg_roi_x1, fg_roi_x2 = max(0, -x), max(0, -x) + (roi_x2 - roi_x1)
+
+        roi = background_img[roi_y1:roi_y2, roi_x1:roi_x2]
+        fg_roi = foreground_img[fg_roi_y1:fg_roi_y2, fg_roi_x1:fg_roi_x2]
+
+        if roi.size == 0 or fg_roi.size == 0:
+            return
+
+        if mask is not None:
+            mask_roi = mask[roi_y1:roi_y2, roi_x1:roi_x2]
+            # 遮る物体がない範囲ではマスクを掛けない
+            if mask_roi.min() < 255:
+                fg_roi = self._apply_mask(fg_roi, mask_roi)
+
+        self.blend(roi, fg_roi)
+
+    def _apply_mask(self, fg_roi, mask_roi):
+        """premultipliedの前景の全チャンネルにマスク (0〜255) を掛けた画像を返す (作業用バッファを使う)"""
+        h, w = fg_roi.shape[:2]
+        size = h * w * 4
+        self._mask = self._reserve(self._mask, size)
+        self._masked = self._reserve(self._masked, size)
+        mask4 = self._mask[:size].reshape(h, w, 4)
+        masked = self._masked[:size].reshape(h, w, 4)
+        cv2.merge((mask_roi, mask_roi, mask_roi, mask_roi), dst=mask4)
+        cv2.multiply(fg_roi, mask4, dst=masked, scale=1.0 / 255.0)
+        return masked
+
+    def blend(self, roi, fg_roi):
+        """同じサイズのroi(BGR)にfg_roi(premultiplied BGRA)を合成し、roiを書き換える"""
+        if self.use_cv2:
+            self._blend_cv2(roi, fg_roi)
+        else:
+            self._blend_numpy(roi, fg_roi)
+
+    def _blend_numpy(self, roi, fg_roi):
+        """dst = fg + round(dst * (255 - a) / 255) をuint16の固定小数点で計算する"""
+        h, w = roi.shape[:2]
+        size = h * w * 3
+        self._acc = self._reserve(self._acc, size)
+        self._tmp = self._reserve(self._tmp, size)
+        acc = self._acc[:size].reshape(h, w, 3)
+        tmp = self._tmp[:size].reshape(h, w, 3)
+
+        np.subtract(255, fg_roi[:, :, 3:4], out=tmp)
+        np.multiply(roi, tmp, out=acc)
+        # 255での除算を丸め付きのシフト演算で近似 (0〜65025の範囲で厳密)
+        acc += 128
+        np.right_shift(acc, 8, out=tmp)
+        acc += tmp
+        acc >>= 8
+        # premultipliedなので fg <= a が成り立ち、和は255を超えない
+        acc += fg_roi[:, :, :3]
+        np.copyto(roi, acc, casting='unsafe')
+
+    def _blend_cv2(self, roi, fg_roi):
+        """cv2の飽和演算で dst = fg + dst * (255 - a) / 255 を計算する"""
+        h, w = roi.shape[:2]
+        size = h * w * 3
+        self._inv = self._reserve(self._inv, size)
+        self._fg = self._reserve(self._fg, size)
+        inv = self._inv[:size].reshape(h, w, 3)
+        fg = self._fg[:size].reshape(h, w, 3)
+
+        np.subtract(255, fg_roi[:, :, 3:4], out=inv)
+        cv2.cvtColor(fg_roi, cv2.COLOR_BGRA2BGR, dst=fg)
+        cv2.multiply(roi, inv, dst=roi, scale=1.0 / 255.0)
+        cv2.add(roi, fg, dst=roi)
+
+    def mix(self, dst, src, mask):
+        """
+        マスクの値に応じて dst(BGR) と src(BGR) を混合し、dst を書き換える
+        dst = (src * mask + dst * (255 - mask)) / 255
+        mask: (H, W) の uint8 (255ならsrc、0ならdstのまま)
+        全画面を対象とするため、use_cv2 の設定に関わらず演算回数の少ないcv2の飽和演算で計算する
+        """
+        h, w = dst.shape[:2]
+        size = h * w * 3
+        self._inv = self._reserve(self._inv, size)
+        self._fg = self._reserve(self._fg, size)
+        weight = self._inv[:size].reshape(h, w, 3)
+        weighted_src = self._fg[:size].reshape(h, w, 3)
+
+        cv2.cvtColor(mask, cv2.COLOR_GRAY2BGR, dst=weight)
+        cv2.multiply(src, weight, dst=weighted_src, scale=1.0 / 255.0)
+        cv2.bitwise_not(weight, dst=weight)
+        cv2.multiply(dst, weight, dst=dst, scale=1.0 / 255.0)
+        cv2.add(dst, weighted_src, dst=dst)
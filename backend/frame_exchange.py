@@ -0,0 +1,68 @@
+import threading
+
+
+class FrameExchange:
+    """
+    描画スレッド(生成側)と表示側(消費側)の間でフレームを受け渡すトリプルバッファ
+    3つのスロット (生成側 / 受け渡し待ち / 消費側) の役割を入れ替えるだけなので、フレームのコピーは発生しない
+    ロックで保護するのはスロット番号の入れ替えのみで、生成側と消費側が同じ配列に同時に触れることはない
+    """
+
+    def __init__(self):
+        self._slots = [None, None, None]
+        self._back, self._ready, self._front = 0, 1, 2
+        self._seq = 0        # 最後に publish されたフレームの通し番号
+        self._front_seq = 0  # 消費側が保持しているフレームの通し番号
+        self._fresh = False  # 受け渡し待ちのスロットに未取得のフレームがあるか
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def publish(self, frame):
+        """
+        フレームを公開し、その通し番号を返す
+        公開した配列は消費側が参照するため、以降は書き換えないこと
+        """
+        self._slots[self._back] = frame
+        with self._cond:
+            self._back, self._ready = self._ready, self._back
+            self._seq += 1
+            self._fresh = True
+            self._cond.notify_all()
+            return self._seq
+
+    def _acquire(self):
+        """受け渡し待ちのフレームを消費側のスロットへ移す (ロック取得済みで呼ぶこと)"""
+        if self._fresh:
+            self._front, self._ready = self._ready, self._front
+            self._front_seq = self._seq
+            self._fresh = False
+
+    def wait_for_next(self, last_seq=0, timeout=None):
+        """
+        通し番号が last_seq より新しいフレームが公開されるまで待ち、(通し番号, フレーム) を返す
+        タイムアウトした場合や閉じられた場合は (last_seq, None) を返す
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq > last_seq or self._closed, timeout):
+                return last_seq, None
+            self._acquire()
+            if self._front_seq <= last_seq:
+                return last_seq, None
+            return self._front_seq, self._slots[self._front]
+
+    def latest(self):
+        """待たずに最新の (通し番号, フレーム) を返す (まだ公開されていなければ (0, None))"""
+        with self._cond:
+            self._acquire()
+            return self._front_seq, self._slots[self._front]
+
+    @property
+    def seq(self):
+        """最後に公開されたフレームの通し番号"""
+        return self._seq
+
+    def close(self):
+        """待機中の消費側を起こし、以降の待機を即座に終了させる"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
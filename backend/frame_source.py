@@ -0,0 +1,188 @@
+import os
+import time
+from abc import ABC, abstractmethod
+
+import cv2
+import numpy as np
+
+from backend.library import fetchPathNames
+
+
+class FrameSource(ABC):
+    """
+    フレームの取得元の基底クラス (派生クラスは _next_frame を実装する)
+    cv2.VideoCapture と同じ read / isOpened / release を持ち、VirtualTryOnApp の入力として差し替えられる
+    paced=True なら fps に合わせて実時間で、False なら取得できる限り速くフレームを返す
+    """
+
+    def __init__(self, paced=True, fps=30.0):
+        self.paced = paced
+        self.fps = fps
+        # 実時間で届く入力か (False の場合、後段はフレームを捨てずに待たせてすべて処理する)
+        self.live = paced
+        self.exhausted = False  # 有限の入力の終端に達したか
+        self._opened = True
+        self._next_time = None
+
+    def isOpened(self):
+        return self._opened
+
+    def read(self):
+        """(取得できたか, フレーム) を返す"""
+        if not self._opened or self.exhausted:
+            return False, None
+        frame = self._next_frame()
+        if frame is None:
+            self.exhausted = True
+            return False, None
+        if self.paced:
+            self._pace()
+        return True, frame
+
+    def release(self):
+        self._opened = False
+
+    @abstractmethod
+    def _next_frame(self):
+        """次のフレームを返す (終端なら None)"""
+
+    def _pace(self):
+        """fps に合わせて待機する (処理が遅れて1フレーム以上ずれた場合は基準時刻を合わせ直す)"""
+        interval = 1.0 / self.fps if self.fps and self.fps > 0 else 0.0
+        now = time.perf_counter()
+        if self._next_time is None or now - self._next_time > interval:
+            self._next_time = now
+        delay = self._next_time - now
+        if delay > 0:
+            time.sleep(delay)
+        self._next_time += interval
+
+
+class CameraSource(FrameSource):
+    """カメラからフレームを取得する (カメラ自体が実時間で動くため、待機は行わない)"""
+
+    def __init__(self, camera_index=0):
+        super().__init__(paced=False)
+        self.live = True
+        self.camera_index = camera_index
+        self.cap = cv2.VideoCapture(camera_index)
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def read(self):
+        # 読み取りに失敗しても終端とはみなさない
+        return self.cap.read()
+
+    def _next_frame(self):
+        ret, frame = self.cap.read()
+        return frame if ret else None
+
+    def release(self):
+        self.cap.release()
+
+
+class VideoFileSource(FrameSource):
+    """動画ファイルからフレームを取得する (録画した映像の再生用)"""
+
+    def __init__(self, path, paced=True, loop=False):
+        self.cap = cv2.VideoCapture(path)
+        fps = self.cap.get(cv2.CAP_PROP_FPS)
+        super().__init__(paced, fps if fps and fps > 0 else 30.0)
+        self.path = path
+        self.loop = loop
+
+    def isOpened(self):
+        return self._opened and self.cap.isOpened()
+
+    def _next_frame(self):
+        ret, frame = self.cap.read()
+        if not ret and self.loop:
+            # 先頭に戻って読み直す
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.cap.read()
+        return frame if ret else None
+
+    def release(self):
+        super().release()
+        self.cap.release()
+
+
+class ImageDirectorySource(FrameSource):
+    """ディレクトリ内の画像を名前順にフレームとして返す"""
+
+    def __init__(self, root, paced=True, fps=30.0, loop=True, preload=True):
+        """
+        loop: 最後の画像の次は先頭に戻る
+        preload: 最初にすべての画像をデコードしておく (毎フレームのデコードを省く)
+        """
+        super().__init__(paced, fps)
+        self.paths = sorted(fetchPathNames(root))
+        if not self.paths:
+            raise IOError(f"画像が見つかりません: {root}")
+        self.loop = loop
+        self._images = [self._load(path) for path in self.paths] if preload else None
+        self._index = 0
+
+    def _load(self, path):
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
+        if image is None:
+            raise IOError(f"画像の読み込みに失敗しました: {path}")
+        return image
+
+    def _next_frame(self):
+        if self._index >= len(self.paths):
+            if not self.loop:
+                return None
+            self._index = 0
+        index = self._index
+        self._index += 1
+        # 受け取った側がフレームに描画するため、保持している画像はコピーして渡す
+        if self._images is not None:
+            return self._images[index].copy()
+        return self._load(self.paths[index])
+
+
+class SyntheticSource(FrameSource):
+    """
+    メモリ上でフレームを生成する
+    frames を渡した場合はそれを順に繰り返し、省略した場合は横に流れるグラデーション画像を生成する
+    """
+
+    def __init__(self, frames=None, size=(1280, 720), count=None, paced=False, fps=30.0):
+        """
+        size: 生成するフレームの大きさ (幅, 高さ)
+        count: 生成するフレーム数 (None なら無限)
+        """
+        super().__init__(paced, fps)
+        self.frames = frames
+        self.count = count
+        width, height = size
+        self._gradient = np.tile(np.linspace(0, 255, width, dtype=np.float32), (height, 1))
+        self._index = 0
+
+    def _next_frame(self):
+        if self.count is not None and self._index >= self.count:
+            return None
+        index = self._index
+        self._index += 1
+        if self.frames:
+            return self.frames[index % len(self.frames)].copy()
+        shifted = np.roll(self._gradient, index * 8, axis=1).astype(np.uint8)
+        return cv2.merge((shifted, np.flipud(shifted), np.full_like(shifted, index % 256)))
+
+
+def openFrameSource(source, paced=True):
+    '''
+    入力の指定からフレームの取得元を生成する
+    source: カメラ番号(int) / 動画ファイルのパス / 画像ディレクトリのパス / FrameSource
+    '''
+    if isinstance(source, FrameSource):
+        return source
+    if isinstance(source, int):
+        return CameraSource(source)
+    if os.path.isdir(source):
+        return ImageDirectorySource(source, paced=paced)
+    if os.path.isfile(source):
+        return VideoFileSource(source, paced=paced)
+    raise IOError(f"入力が見つかりません: {source}")
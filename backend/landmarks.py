@@ -0,0 +1,157 @@
+import math
+from enum import IntEnum
+
+import numpy as np
+import numpy.typing as npt
+
+from backend.pose_tracking import KalmanPredictor
+
+# MediaPipe Pose のランドマーク数
+LANDMARK_COUNT = 33
+# ランドマーク配列の列 [x, y, z, visibility]
+X, Y, Z, VISIBILITY = 0, 1, 2, 3
+
+
+class PoseLandmark(IntEnum):
+    """
+    ランドマークの番号 (mp.solutions.pose.PoseLandmark と同じ値)
+    描画などで番号だけを使う場合に、MediaPipe を読み込まずに済むようにする
+    """
+    NOSE = 0
+    LEFT_EYE_INNER = 1
+    LEFT_EYE = 2
+    LEFT_EYE_OUTER = 3
+    RIGHT_EYE_INNER = 4
+    RIGHT_EYE = 5
+    RIGHT_EYE_OUTER = 6
+    LEFT_EAR = 7
+    RIGHT_EAR = 8
+    MOUTH_LEFT = 9
+    MOUTH_RIGHT = 10
+    LEFT_SHOULDER = 11
+    RIGHT_SHOULDER = 12
+    LEFT_ELBOW = 13
+    RIGHT_ELBOW = 14
+    LEFT_WRIST = 15
+    RIGHT_WRIST = 16
+    LEFT_PINKY = 17
+    RIGHT_PINKY = 18
+    LEFT_INDEX = 19
+    RIGHT_INDEX = 20
+    LEFT_THUMB = 21
+    RIGHT_THUMB = 22
+    LEFT_HIP = 23
+    RIGHT_HIP = 24
+    LEFT_KNEE = 25
+    RIGHT_KNEE = 26
+    LEFT_ANKLE = 27
+    RIGHT_ANKLE = 28
+    LEFT_HEEL = 29
+    RIGHT_HEEL = 30
+    LEFT_FOOT_INDEX = 31
+    RIGHT_FOOT_INDEX = 32
+
+
+def landmarksToArray(pose_landmarks)->npt.NDArray[np.float32]|None:
+    '''
+    MediaPipeのランドマーク(NormalizedLandmarkList)を (33, 4) の配列 [x, y, z, visibility] に変換する
+    '''
+    if not pose_landmarks:
+        return None
+    return np.array(
+        [(lm.x, lm.y, lm.z, lm.visibility) for lm in pose_landmarks.landmark],
+        dtype=np.float32)
+
+
+class LandmarkFilter:
+    """ランドマークの平滑化フィルタ (何もしない)"""
+
+    def reset(self):
+        """フィルタの状態を破棄する"""
+
+    def apply(self, timestamp, landmarks):
+        """
+        ランドマーク (33, 4) を平滑化して返す (landmarks が None ならフィルタの状態を破棄して None を返す)
+        timestamp: フレームの取得時刻 (秒)
+        """
+        return landmarks
+
+
+class OneEuroFilter(LandmarkFilter):
+    """
+    One-Euroフィルタで各関節の x, y, z を平滑化する (全関節分をまとめて配列演算で処理する)
+    静止時は強く平滑化して揺れを抑え、速く動いているときはカットオフ周波数を上げて遅れを抑える
+    """
+
+    def __init__(self, min_cutoff=1.0, beta=10.0, d_cutoff=1.0):
+        """
+        min_cutoff: 最小カットオフ周波数 (Hz)
+        beta: 速度に応じてカットオフ周波数を上げる係数
+        d_cutoff: 速度推定のカットオフ周波数 (Hz)
+        """
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.reset()
+
+    def reset(self):
+        self._value = None
+        self._velocity = None
+        self._last_time = None
+
+    @staticmethod
+    def _alpha(cutoff, dt):
+        """カットオフ周波数 (スカラーまたは配列) と時間間隔から指数平滑化の係数を求める"""
+        tau = 1.0 / (2.0 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+    def apply(self, timestamp, landmarks):
+        if landmarks is None:
+            self.reset()
+            return None
+
+        x = landmarks[:, :3]
+        if self._value is None:
+            self._value = x.astype(np.float32)
+            self._velocity = np.zeros_like(self._value)
+            self._last_time = timestamp
+            return landmarks
+
+        dt = timestamp - self._last_time
+        if dt > 0:
+            velocity = (x - self._value) / dt
+            self._velocity += self._alpha(self.d_cutoff, dt) * (velocity - self._velocity)
+            cutoff = self.min_cutoff + self.beta * np.abs(self._velocity)
+            self._value += self._alpha(cutoff, dt) * (x - self._value)
+            self._last_time = timestamp
+
+        filtered = landmarks.copy()
+        filtered[:, :3] = self._value
+        return filtered
+
+
+class KalmanFilter(LandmarkFilter):
+    """等速モデルのカルマンフィルタで各関節の x, y, z を平滑化する"""
+
+    def __init__(self, process_noise=1.0, measurement_noise=1e-4):
+        self._kalman = KalmanPredictor(0.0, process_noise, measurement_noise)
+
+    def reset(self):
+        self._kalman.reset()
+
+    def apply(self, timestamp, landmarks):
+        self._kalman.update(timestamp, landmarks)
+        return self._kalman.predict(timestamp)
+
+
+def createLandmarkFilter(name, **params):
+    '''
+    名前からランドマークの平滑化フィルタを生成する (None / "one_euro" / "kalman")
+    '''
+    if name == "one_euro":
+        return OneEuroFilter(**params)
+    if name == "kalman":
+        return KalmanFilter(**params)
+    if name is None:
+        return LandmarkFilter()
+    raise ValueError(f"未対応の平滑化方法です: {name}")
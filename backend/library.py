@@ -4,8 +4,8 @@ import numpy.typing as npt
 import copy
 import cv2
 import math
+import threading
 from collections import deque
-import mediapipe as mp
 # 必要に応じて
 # import sys
 # sys.setrecursionlimit(1000)
@@ -52,78 +52,221 @@ def fetchPathNames(root:str,EXTENTIONS:tuple[str]=("png","jpg"))->list[npt.NDArr
                     paths.append(os.path.join(root,name))
     return paths
 
+def resizeLongSide(src:npt.NDArray,long_side:int|None)->npt.NDArray:
+    '''
+    縦横比を保ったまま、長辺が long_side [px] になるように縮小する
+    long_side が None の場合や、元画像の方が小さい場合はそのまま返す
+    '''
+    H,W=src.shape[0:2]
+    if long_side is None or max(H,W)<=long_side:
+        return src
+    scale=long_side/max(H,W)
+    return cv2.resize(src,(max(1,round(W*scale)),max(1,round(H*scale))),interpolation=cv2.INTER_AREA)
+
+class HumanSegmenter:
+    """
+    人物セグメンテーション (MediaPipe SelfieSegmentation) を行うクラス
+    モデルは生成時に1回だけ読み込んで使い回し、色変換・マスク・出力・背景のバッファも
+    フレームの大きさごとに1回だけ確保する
+    返り値のバッファは次の呼び出しで上書きされるため、保持する場合はコピーすること
+    (shared() のインスタンスを複数のスレッドから使う場合は copy=True を指定する)
+    """
+    _shared=None
+    _shared_lock=threading.Lock()
+
+    def __init__(self,model_selection:int=0,threshold:float=0.1):
+        """
+        model_selection: 0なら汎用モデル、1なら横長画像向けの軽量モデル
+        threshold: 人物とみなすマスク値 (0〜1) の閾値
+        """
+        self.threshold=threshold
+        # MediaPipe は読み込みに時間がかかるため、モデルを生成する時点で読み込む
+        import mediapipe as mp
+        self._segmentation=mp.solutions.selfie_segmentation.SelfieSegmentation(model_selection=model_selection)
+        # MediaPipe のグラフとバッファは同時に使えないため排他する
+        self._lock=threading.RLock()
+        self._buffers={}
+        self._background_color=None
+
+    @classmethod
+    def shared(cls):
+        """プロセス全体で共有するインスタンスを返す"""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared=cls()
+            return cls._shared
+
+    def _buffer(self,name:str,shape:tuple,dtype=np.uint8)->npt.NDArray:
+        """名前ごとのバッファを返す (大きさが変わったときだけ確保し直す)"""
+        buffer=self._buffers.get(name)
+        if buffer is None or buffer.shape!=shape or buffer.dtype!=dtype:
+            buffer=np.empty(shape,dtype)
+            self._buffers[name]=buffer
+            if name=="background":
+                self._background_color=None
+        return buffer
+
+    def _segment(self,rgb:npt.NDArray)->npt.NDArray[np.float32]:
+        with self._lock:
+            return self._segmentation.process(rgb).segmentation_mask
+
+    def mask(self,src:npt.NDArray[np.uint8],is_rgb:bool=False)->npt.NDArray[np.float32]:
+        """
+        人物らしさのマスク (0〜1、人物が1に近い) を返す
+        src: (H, W, 3) の画像、または (N, H, W, 3) のバッチ (is_rgb=False なら BGR)
+        バッチの場合は (N, H, W) の配列を返す
+        """
+        with self._lock:
+            if src.ndim==4:
+                masks=self._buffer("masks",src.shape[:3],np.float32)
+                for i,frame in enumerate(src):
+                    masks[i]=self.mask(frame,is_rgb)
+                return masks
+            if is_rgb:
+                return self._segment(src)
+            rgb=cv2.cvtColor(src,cv2.COLOR_BGR2RGB,dst=self._buffer("rgb",src.shape))
+            return self._segment(rgb)
+
+    def binary_mask(self,src:npt.NDArray[np.uint8],is_rgb:bool=False,threshold:float|None=None,copy:bool=False)->npt.NDArray[np.uint8]:
+        """
+        人物を255、背景を0とした (H, W) のマスクを返す
+        threshold: 人物とみなすマスク値の閾値 (省略時は生成時の値)
+        copy: Trueならバッファではなく新しい配列を返す (他のスレッドの呼び出しで上書きされない)
+        """
+        threshold=threshold if threshold is not None else self.threshold
+        with self._lock:
+            mask=self.mask(src,is_rgb)
+            if copy:
+                return cv2.compare(mask,threshold,cv2.CMP_GT)
+            return cv2.compare(mask,threshold,cv2.CMP_GT,dst=self._buffer("binary_mask",mask.shape))
+
+    def fill_background(self,src:npt.NDArray[np.uint8],color:tuple[np.uint8],flip:bool=False)->npt.NDArray[np.uint8]:
+        """
+        BGR画像の背景を指定した色で塗りつぶす
+        src: (H, W, 3) の画像、または (N, H, W, 3) のバッチ
+        flip: Trueなら左右反転した画像を処理する (鏡像として表示する場合)
+        """
+        with self._lock:
+            if src.ndim==4:
+                dst=self._buffer("dst_batch",src.shape)
+                for i,frame in enumerate(src):
+                    dst[i]=self.fill_background(frame,color,flip)
+                return dst
+
+            if flip:
+                src=cv2.flip(src,1,dst=self._buffer("flipped",src.shape))
+            background=self._buffer("background",src.shape)
+            if self._background_color!=tuple(color):
+                background[:]=color
+                self._background_color=tuple(color)
+            mask=self.binary_mask(src)
+            # 背景で初期化してから、人物の画素だけを上書きする
+            dst=self._buffer("dst",src.shape)
+            np.copyto(dst,background)
+            cv2.copyTo(src,mask,dst)
+            return dst
+
+    def close(self):
+        """モデルを解放する"""
+        with self._lock:
+            self._segmentation.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc_info):
+        self.close()
+
 def fillInBackground(src:npt.NDArray,color:tuple[np.uint8])->npt.NDArray:
     '''
-    指定した色で背景を塗りつぶす
+    指定した色で背景を塗りつぶす (画像は左右反転して返す)
+    共有の HumanSegmenter を使うため、呼び出しごとにモデルを読み込まない
+    '''
+    return HumanSegmenter.shared().fill_background(src,color,flip=True).copy()
+
+def getHumanSeg(src:npt.NDArray[np.uint8])->npt.NDArray[np.uint8]:
     '''
-    # MediaPipeの描画ユーティリティとセグメンテーションモデルを初期化
-    mp_drawing=mp.solutions.drawing_utils
-    mp_selfie_segmentation=mp.solutions.selfie_segmentation
-
-    # SelfieSegmentationモデルを読み込み
-    with mp_selfie_segmentation.SelfieSegmentation(
-        model_selection=0) as selfie_segmentation:
-        # 画像を左右反転し、色をBGRからRGBに変換
-        src=cv2.cvtColor(cv2.flip(src, 1), cv2.COLOR_BGR2RGB)
-        # MediaPipeで人物セグメンテーションを実行
-        results=selfie_segmentation.process(src)
-        # 色をRGBからBGRに戻す
-        src=cv2.cvtColor(src, cv2.COLOR_RGB2BGR)
-        # セグメンテーションマスクを生成 (人物が1, 背景が0に近い値を持つ)
-        condition=np.stack((results.segmentation_mask,) * 3, axis=-1) > 0.1
-        # 背景画像を作成
-        #bg_image=cv2.GaussianBlur(src, (55, 55), 0) # 元画像をぼかしたものを使用するなら
-        bg_image=np.full(src.shape,color,np.uint8)
-        # conditionがTrueのピクセルは元の画像を、Falseのピクセルは背景画像を使用
-        dst=np.where(condition, src, bg_image)
-
-    return dst
-
-def alphaZeroCut(src:npt.NDArray[np.uint8])->npt.NDArray:
+    人が存在する箇所を表す2値画像 (人物が255、背景が0) を返す
+    src: BGR画像 (従来どおり、左右反転した画像をセグメンテーションし、マスクを元の向きに戻す。閾値は0.1)
+    共有の HumanSegmenter を使うため、呼び出しごとにモデルを読み込まない
+    '''
+    mask=HumanSegmenter.shared().mask(cv2.flip(src,1))
+    condition=(mask>0.1).astype(np.uint8)*255
+    return cv2.flip(condition,1)
+
+def alphaZeroBounds(src:npt.NDArray[np.uint8])->npt.NDArray:
+    """
+    アルファ値が255となる領域のバウンディングボックス (min_y, min_x, max_y, max_x) を返す
+    src が (N, H, W, 4) のバッチの場合は (N, 4) の配列を返す (不透明なピクセルがない画像の行は -1)
+    """
+    batch = src if src.ndim == 4 else src[np.newaxis]
+    opaque = batch[..., 3] > 254
+    # 行・列ごとに不透明なピクセルがあるかを調べ、最初と最後の位置を求める
+    rows = opaque.any(axis=2)
+    cols = opaque.any(axis=1)
+    H, W = opaque.shape[1:3]
+    bounds = np.stack((
+        rows.argmax(axis=1),
+        cols.argmax(axis=1),
+        H - 1 - rows[:, ::-1].argmax(axis=1),
+        W - 1 - cols[:, ::-1].argmax(axis=1),
+    ), axis=1)
+    bounds[~rows.any(axis=1)] = -1
+    return bounds if src.ndim == 4 else bounds[0]
+
+def alphaZeroCut(src:npt.NDArray[np.uint8])->npt.NDArray|list[npt.NDArray]:
     """
     アルファ値が255でない部分を削除する
     アルファ値∈[0,256) であることに注意
+    src が (N, H, W, 4) のバッチの場合は、切り出した画像のリストを返す
     """
     # アルファチャンネルが存在するか確認
-    if src.shape[2] != 4:
+    if src.shape[-1] != 4 or src.ndim not in (3, 4):
         return src
-    
-    # アルファ値が255となるピクセルの座標を取得
-    # (y座標の配列, x座標の配列) という形で返る
-    y_coords, x_coords = np.where(src[:, :, 3] > 254)
-    
+
+    bounds = alphaZeroBounds(src)
+    if src.ndim == 4:
+        return [
+            # 不透明なピクセルが一つもなければ、空の画像を返す
+            np.empty((0, 0, 4), dtype=np.uint8) if min_y < 0 else img[min_y : max_y + 1, min_x : max_x + 1]
+            for img, (min_y, min_x, max_y, max_x) in zip(src, bounds)
+        ]
+
     # 不透明なピクセルが一つもなければ、空の画像を返す
-    if len(y_coords) == 0:
+    min_y, min_x, max_y, max_x = bounds
+    if min_y < 0:
         return np.empty((0, 0, 4), dtype=np.uint8)
-    
-    # 座標の最小値と最大値を見つけてバウンディングボックスを決定
-    min_y = y_coords.min()
-    max_y = y_coords.max()
-    min_x = x_coords.min()
-    max_x = x_coords.max()
-    
+
     # スライスして結果を返す
     return src[min_y : max_y + 1, min_x : max_x + 1]
 
-def getHumanSeg(src:npt.NDArray)->npt.NDArray:
-    '''
-    人が存在する箇所を表す2値画像を返す
-    '''
-    # MediaPipeの描画ユーティリティとセグメンテーションモデルを初期化
-    mp_drawing=mp.solutions.drawing_utils
-    mp_selfie_segmentation=mp.solutions.selfie_segmentation
-    condition=None
-
-    # SelfieSegmentationモデルを読み込み
-    with mp_selfie_segmentation.SelfieSegmentation(
-        model_selection=0) as selfie_segmentation:
-        # 画像を左右反転し、色をBGRからRGBに変換
-        src=cv2.cvtColor(cv2.flip(src, 1), cv2.COLOR_BGR2RGB)
-        # MediaPipeで人物セグメンテーションを実行
-        results=selfie_segmentation.process(src)
-        # 色をRGBからBGRに戻す
-        src=cv2.cvtColor(src, cv2.COLOR_RGB2BGR)
-        # セグメンテーションマスクを生成 (人物が255, 背景が0 となる2値画像)
-        condition = (results.segmentation_mask > 0.1).astype(np.uint8) * 255
-
-    return cv2.flip(condition,1)
\ No newline at end of file
+def opaqueHull(src:npt.NDArray[np.uint8])->npt.NDArray|None:
+    """
+    アルファ値が255となる領域の凸包の頂点 (x, y) を返す (不透明なピクセルがなければNone)
+    アセット読み込み時に1回だけ計算し、回転後の大きさは transformBounds で解析的に求める
+    """
+    if src.ndim != 3 or src.shape[2] != 4:
+        return None
+    points = cv2.findNonZero((src[:, :, 3] > 254).astype(np.uint8))
+    if points is None:
+        return None
+    return cv2.convexHull(points).reshape(-1, 2).astype(np.float32)
+
+def transformBounds(hull:npt.NDArray,matrix:npt.NDArray,canvas_size:tuple[int,int]|None=None)->tuple[int,int]:
+    """
+    凸包の頂点をアフィン変換したときのバウンディングボックスの大きさ (高さ, 幅) を返す
+    凸集合の外接矩形は頂点だけで決まるため、画像全体を走査する必要がない
+    canvas_size: (幅, 高さ) - 指定した場合は変換先のキャンバスからはみ出した部分を除く
+    """
+    transformed = hull @ matrix[:, :2].T.astype(np.float32) + matrix[:, 2].astype(np.float32)
+    if canvas_size is not None:
+        canvas_w, canvas_h = canvas_size
+        canvas = np.array([[0, 0], [canvas_w - 1, 0], [canvas_w - 1, canvas_h - 1], [0, canvas_h - 1]], np.float32)
+        _, transformed = cv2.intersectConvexConvex(transformed, canvas)
+        if transformed is None:
+            return 0, 0
+        transformed = transformed.reshape(-1, 2)
+    min_x, min_y = transformed.min(axis=0)
+    max_x, max_y = transformed.max(axis=0)
+    # 左右反転は大きさに影響しない
+    return int(round(max_y - min_y)) + 1, int(round(max_x - min_x)) + 1
@@ -0,0 +1,164 @@
+import functools
+import threading
+import time
+
+import numpy as np
+
+
+class RingHistogram:
+    """
+    直近の測定値 (秒) をリングバッファに保持し、分位点などの統計値を求める
+    メモリ使用量は capacity で固定され、記録のたびに確保は行わない
+    """
+
+    def __init__(self, capacity=300):
+        self._values = np.zeros(capacity, dtype=np.float64)
+        self._index = 0
+        self._lock = threading.Lock()
+        self.total = 0  # これまでに記録した回数
+
+    def add(self, value):
+        with self._lock:
+            self._values[self._index] = value
+            self._index = (self._index + 1) % len(self._values)
+            self.total += 1
+
+    def stats(self):
+        """直近の測定値の件数・平均・p50/p95/p99・最大 (ミリ秒) を返す"""
+        with self._lock:
+            count = min(self.total, len(self._values))
+            values = self._values[:count] * 1000.0
+            total = self.total
+        if count == 0:
+            return {"count": 0, "total": total}
+        p50, p95, p99 = np.percentile(values, (50, 95, 99))
+        return {
+            "count": count,
+            "total": total,
+            "mean_ms": float(values.mean()),
+            "p50_ms": float(p50),
+            "p95_ms": float(p95),
+            "p99_ms": float(p99),
+            "max_ms": float(values.max()),
+        }
+
+
+class _Span:
+    """with 文の範囲の所要時間を記録する"""
+
+    __slots__ = ("_histogram", "_start")
+
+    def __init__(self, histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._histogram.add(time.perf_counter() - self._start)
+        return False
+
+
+class _NullSpan:
+    """計測が無効なときの何もしない範囲 (共有のインスタンスを使い回す)"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Metrics:
+    """
+    処理区間ごとの所要時間とイベントの回数を集計する
+    enabled=False の場合、span() は共有の空の範囲を返し、count() は何もしない
+    """
+
+    def __init__(self, enabled=True, history=300):
+        """
+        history: 区間ごとに保持する直近の測定値の数
+        """
+        self.enabled = enabled
+        self.history = history
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def _histogram(self, name):
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(name, RingHistogram(self.history))
+        return histogram
+
+    def span(self, name):
+        """
+        with 文で囲んだ区間の所要時間を name の区間として記録する
+        例: with metrics.span("pose_process"): ...
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self._histogram(name))
+
+    def record(self, name, seconds):
+        """測定済みの所要時間 (秒) を記録する"""
+        if self.enabled:
+            self._histogram(name).add(seconds)
+
+    def count(self, name, n=1):
+        """イベントの回数を加算する"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def reset(self):
+        """集計結果を破棄する"""
+        with self._lock:
+            self._histograms = {}
+            self._counters = {}
+
+    def stats(self):
+        """{"spans": {区間名: 統計値}, "counters": {イベント名: 回数}} を返す"""
+        with self._lock:
+            histograms = dict(self._histograms)
+            counters = dict(self._counters)
+        return {
+            "spans": {name: histogram.stats() for name, histogram in histograms.items()},
+            "counters": counters,
+        }
+
+
+def formatMetrics(stats, names=None):
+    '''
+    Metrics.stats() の結果を1行の文字列にする (HUDやログの表示用)
+    names: 表示する区間名 (省略時はすべて)
+    '''
+    parts = []
+    spans = stats.get("spans", {})
+    for name in names if names is not None else spans:
+        span = spans.get(name)
+        if span and span["count"]:
+            parts.append(f"{name} {span['p50_ms']:.1f}/{span['p95_ms']:.1f}ms")
+    parts.extend(f"{name}={value}" for name, value in stats.get("counters", {}).items())
+    return " ".join(parts)
+
+
+def timedMethod(name):
+    '''
+    メソッドの所要時間を、インスタンスの metrics 属性 (Metrics) に name の区間として記録するデコレータ
+    '''
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.span(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
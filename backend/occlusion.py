@@ -0,0 +1,142 @@
+import cv2
+import numpy as np
+import numpy.typing as npt
+
+from backend.library import HumanSegmenter, resizeLongSide
+from backend.landmarks import X, Y, Z, VISIBILITY, PoseLandmark
+
+# 胴体より手前に出る可能性のある腕・手の区間
+ARM_SEGMENTS = (
+    (PoseLandmark.LEFT_SHOULDER, PoseLandmark.LEFT_ELBOW),
+    (PoseLandmark.LEFT_ELBOW, PoseLandmark.LEFT_WRIST),
+    (PoseLandmark.LEFT_WRIST, PoseLandmark.LEFT_INDEX),
+    (PoseLandmark.LEFT_WRIST, PoseLandmark.LEFT_PINKY),
+    (PoseLandmark.RIGHT_SHOULDER, PoseLandmark.RIGHT_ELBOW),
+    (PoseLandmark.RIGHT_ELBOW, PoseLandmark.RIGHT_WRIST),
+    (PoseLandmark.RIGHT_WRIST, PoseLandmark.RIGHT_INDEX),
+    (PoseLandmark.RIGHT_WRIST, PoseLandmark.RIGHT_PINKY),
+)
+# セグメンテーション結果を現在のフレームに合わせて変形するときの基準点
+WARP_JOINTS = sorted({joint for segment in ARM_SEGMENTS for joint in segment})
+
+
+class OcclusionMasker:
+    """
+    胴体の衣装を描画してよい領域のマスクを求める (腕が胴体より手前にある領域を0とする)
+    ランドマークの奥行き (z) から手前にある腕の区間を選び、その周辺を人物のセグメンテーション結果で切り抜く
+    マスクは縮小した解像度で求め、セグメンテーションは数フレームおきに行って
+    間のフレームでは関節の移動に合わせて前回の結果を変形して使い回す
+    """
+
+    def __init__(self, long_side=192, arm_width_ratio=0.35, depth_margin=0.1, min_visibility=0.5,
+                 segmentation_interval=3, threshold=0.3, feather=3, segmenter=None):
+        """
+        long_side: マスクを求める解像度 (長辺 [px])
+        arm_width_ratio: 肩幅に対する腕の太さの比率
+        depth_margin: 肩より手前にあるとみなす奥行きの差 (MediaPipeの正規化座標、小さいほど手前)
+        min_visibility: 関節の信頼度スコアの閾値
+        segmentation_interval: セグメンテーションを行うフレーム間隔 (1なら毎フレーム)
+        threshold: 人物とみなすマスク値 (0〜1) の閾値
+        feather: マスクの境界をぼかすカーネルの大きさ (縮小した画像上の px、奇数。0ならぼかさない)
+        segmenter: 使用する HumanSegmenter (省略時はプロセスで共有するインスタンスを使い、背景の置き換えなどとモデルを共有する)
+        """
+        self.long_side = long_side
+        self.arm_width_ratio = arm_width_ratio
+        self.depth_margin = depth_margin
+        self.min_visibility = min_visibility
+        self.segmentation_interval = max(1, segmentation_interval)
+        self.feather = feather
+        self.threshold = threshold
+        self.segmenter = segmenter if segmenter is not None else HumanSegmenter.shared()
+        self.reset()
+
+    def reset(self):
+        """使い回しているセグメンテーション結果を破棄する"""
+        self._person = None
+        self._person_points = None
+        self._frames_since_segmentation = 0
+
+    def _to_pixels(self, landmarks, size):
+        w, h = size
+        return landmarks[:, [X, Y]] * (w, h)
+
+    def _front_segments(self, landmarks):
+        """胴体 (両肩) より手前にある腕の区間を返す"""
+        left, right = landmarks[PoseLandmark.LEFT_SHOULDER], landmarks[PoseLandmark.RIGHT_SHOULDER]
+        if min(left[VISIBILITY], right[VISIBILITY]) <= self.min_visibility:
+            return []
+        torso_z = (left[Z] + right[Z]) / 2
+        return [
+            (start, end) for start, end in ARM_SEGMENTS
+            if min(landmarks[start][VISIBILITY], landmarks[end][VISIBILITY]) > self.min_visibility
+            and min(landmarks[start][Z], landmarks[end][Z]) < torso_z - self.depth_margin
+        ]
+
+    def _mask_size(self, frame_shape):
+        """マスクを求める解像度 (幅, 高さ) を返す (resizeLongSide と同じ大きさ)"""
+        H, W = frame_shape[:2]
+        if self.long_side is None or max(H, W) <= self.long_side:
+            return W, H
+        scale = self.long_side / max(H, W)
+        return max(1, round(W * scale)), max(1, round(H * scale))
+
+    def _person_mask(self, frame, size, points):
+        """
+        人物のマスク (0/255) を縮小した解像度で返す
+        セグメンテーションを省略するフレームでは、前回の結果を関節の移動に合わせて相似変換する
+        """
+        w, h = size
+        if (self._person is None or self._person.shape != (h, w)
+                or self._frames_since_segmentation >= self.segmentation_interval):
+            self._person = self.segmenter.binary_mask(resizeLongSide(frame, self.long_side), threshold=self.threshold, copy=True)
+            self._person_points = points
+            self._frames_since_segmentation = 1
+            return self._person
+
+        self._frames_since_segmentation += 1
+        matrix, _ = cv2.estimateAffinePartial2D(self._person_points, points)
+        if matrix is None:
+            return self._person
+        return cv2.warpAffine(self._person, matrix, (w, h), flags=cv2.INTER_NEAREST)
+
+    def compute(self, frame:npt.NDArray[np.uint8], landmarks:npt.NDArray[np.float32]|None,
+                person_mask:npt.NDArray[np.uint8]|None=None)->npt.NDArray[np.uint8]|None:
+        """
+        胴体の衣装を描画してよい領域のマスク (縮小した解像度、0〜255) を返す
+        手前にある腕がなければ None を返す (セグメンテーションも行わない)
+        person_mask: 背景の置き換えなどで求め済みの人物のマスク (0〜255、解像度は問わない)
+        """
+        if landmarks is None:
+            self.reset()
+            return None
+
+        w, h = self._mask_size(frame.shape)
+        segments = self._front_segments(landmarks)
+        if not segments:
+            self._frames_since_segmentation = self.segmentation_interval
+            return None
+
+        # 1. 手前にある腕の区間を太い線分として描く
+        pixels = self._to_pixels(landmarks, (w, h))
+        shoulder_width = np.hypot(*(pixels[PoseLandmark.LEFT_SHOULDER] - pixels[PoseLandmark.RIGHT_SHOULDER]))
+        thickness = max(1, int(round(shoulder_width * self.arm_width_ratio)))
+        occluder = np.zeros((h, w), np.uint8)
+        for start, end in segments:
+            cv2.line(occluder, tuple(np.round(pixels[start]).astype(int)), tuple(np.round(pixels[end]).astype(int)),
+                     255, thickness, cv2.LINE_8)
+
+        # 2. 人物の領域で切り抜き、腕の輪郭に合わせる
+        if person_mask is not None:
+            person = cv2.resize(person_mask, (w, h), interpolation=cv2.INTER_LINEAR)
+            person = cv2.threshold(person, 127, 255, cv2.THRESH_BINARY)[1]
+        else:
+            person = self._person_mask(frame, (w, h), pixels[WARP_JOINTS].astype(np.float32))
+        cv2.bitwise_and(occluder, person, dst=occluder)
+
+        if self.feather and self.feather > 1:
+            occluder = cv2.GaussianBlur(occluder, (self.feather, self.feather), 0)
+        return cv2.bitwise_not(occluder)
+
+    def close(self):
+        """処理を終える (セグメンテーションモデルは他の処理と共有するため、生成した側が解放する)"""
+        self.reset()
@@ -0,0 +1,118 @@
+import threading
+import time
+from collections import deque
+
+
+class DropOldestQueue:
+    """
+    上限を超えて追加されたら最も古い要素を捨てる有界キュー
+    後段の処理が追いつかない場合でも、常に新しいフレームから処理されるようにする
+    """
+
+    def __init__(self, maxsize=1):
+        self._items = deque()
+        self._maxsize = maxsize
+        self._cond = threading.Condition()
+        self._closed = False
+        self.dropped = 0
+
+    def put(self, item, block=False):
+        """
+        要素を追加する。あふれて捨てた要素があればそれを返す
+        block=True の場合は捨てずに、空きができるまで待つ (閉じられた場合は追加せずに item を返す)
+        """
+        with self._cond:
+            if block:
+                self._cond.wait_for(lambda: len(self._items) < self._maxsize or self._closed)
+                if self._closed:
+                    return item
+            dropped_item = None
+            if len(self._items) >= self._maxsize:
+                dropped_item = self._items.popleft()
+                self.dropped += 1
+            self._items.append(item)
+            self._cond.notify_all()
+            return dropped_item
+
+    def get(self, timeout=None):
+        """要素を取り出す。閉じられた(かつ空の)場合やタイムアウトした場合はNoneを返す"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._items or self._closed, timeout):
+                return None
+            if not self._items:
+                return None
+            item = self._items.popleft()
+            # 空きを待っている追加側を起こす
+            self._cond.notify_all()
+            return item
+
+    def close(self):
+        """キューを閉じ、待機中の取り出し側を起こす"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._items)
+
+
+class FramePacket:
+    """パイプラインを流れる1フレーム分のデータと、各ステージを通過した時刻"""
+
+    __slots__ = ("seq", "frame", "generation", "landmarks", "person_mask", "occlusion_mask", "timestamps")
+
+    # ステージの順序 (この順に時刻が記録される)
+    STAGES = ("capture", "inference_start", "inference", "render_start", "render")
+
+    def __init__(self, seq, frame, generation=0):
+        self.seq = seq
+        self.frame = frame
+        self.generation = generation  # 入力 (カメラ) を切り替えるたびに増える番号
+        self.landmarks = None
+        self.person_mask = None  # 背景の置き換えに使う人物のマスク (縮小した解像度)
+        self.occlusion_mask = None  # 胴体の衣装を描画してよい領域のマスク (縮小した解像度)
+        self.timestamps = {"capture": time.perf_counter()}
+
+    def stamp(self, stage):
+        """ステージの通過時刻を記録する"""
+        self.timestamps[stage] = time.perf_counter()
+
+    def durations(self):
+        """隣り合うステージ間の所要時間と、取得から描画完了までの遅延 (秒) を返す"""
+        durations = {}
+        stages = [stage for stage in self.STAGES if stage in self.timestamps]
+        for begin, end in zip(stages, stages[1:]):
+            durations[f"{begin}->{end}"] = self.timestamps[end] - self.timestamps[begin]
+        durations["end_to_end"] = self.timestamps[stages[-1]] - self.timestamps[stages[0]]
+        return durations
+
+
+class LatencyRecorder:
+    """直近のフレームのステージ間所要時間を保持し、統計値を求める"""
+
+    def __init__(self, history=120):
+        self._history = deque(maxlen=history)
+        self._lock = threading.Lock()
+        self.frames = 0
+
+    def record(self, packet):
+        """描画まで完了したフレームを記録する"""
+        with self._lock:
+            self._history.append((packet.timestamps["capture"], packet.durations()))
+            self.frames += 1
+
+    def stats(self):
+        """各区間の平均・最大 (ミリ秒) と、直近のフレームレートを返す"""
+        with self._lock:
+            history = list(self._history)
+        if not history:
+            return {}
+
+        stats = {}
+        for key in history[-1][1]:
+            values = [durations[key] * 1000.0 for _, durations in history if key in durations]
+            stats[key] = {"mean_ms": sum(values) / len(values), "max_ms": max(values)}
+        elapsed = history[-1][0] - history[0][0]
+        stats["fps"] = (len(history) - 1) / elapsed if elapsed > 0 else 0.0
+        return stats
@@ -0,0 +1,374 @@
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict, deque
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class SharedFrame:
+    """
+    ワーカープロセスと共有するメモリ上の画像 (uint8)
+    array に書き込んでから PoseWorkerPool.submit に渡すと、ワーカーはコピーせずにそのまま推定に使う
+    """
+
+    __slots__ = ("index", "shm", "array")
+
+    def __init__(self, index, nbytes):
+        self.index = index
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, nbytes))
+        self.array = None
+
+    @property
+    def capacity(self):
+        return self.shm.size
+
+    def view(self, shape):
+        """共有メモリの先頭を shape の配列として参照する"""
+        self.array = np.ndarray(shape, np.uint8, buffer=self.shm.buf)
+        return self.array
+
+    def close(self):
+        """共有メモリを解放する"""
+        self.array = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # 配列を保持している参照が残っている場合は、プロセスの終了時に解放される
+            pass
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class PoseRequest:
+    """プールに依頼した1フレーム分の姿勢推定"""
+
+    __slots__ = ("stream_id", "seq", "frame", "reset", "landmarks", "dropped", "submitted", "elapsed", "_done")
+
+    def __init__(self, stream_id, frame, seq=None):
+        self.stream_id = stream_id
+        self.seq = seq  # 依頼元のフレームの通し番号 (結果を順番に並べ直すのに使う)
+        self.frame = frame  # 推定する画像の SharedFrame
+        self.reset = False  # Trueなら推定の前にストリームの追跡状態を破棄する
+        self.landmarks = None
+        self.dropped = False  # 新しいフレームに押し出されて推定されなかったか
+        self.submitted = time.perf_counter()
+        self.elapsed = 0.0  # 依頼してから結果を受け取るまでの時間 (秒)
+        self._done = threading.Event()
+
+    def done(self):
+        """推定が終わったか (捨てられた場合も含む) を返す"""
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """推定結果のランドマーク (33, 4) を返す (検出できなかった・捨てられた場合は None)"""
+        self._done.wait(timeout)
+        return self.landmarks
+
+    def _finish(self, landmarks, dropped=False):
+        self.frame = None
+        self.elapsed = time.perf_counter() - self.submitted
+        self.landmarks = landmarks
+        self.dropped = dropped
+        self._done.set()
+
+
+class PoseWorkerPool:
+    """
+    姿勢推定 (MediaPipe Pose) を行うワーカープロセスのプール (複数のストリームで共有する)
+    各ストリームの待ちフレームは max_pending 枚までとし、あふれた場合は古いフレームを捨てる
+    各ストリームは最初に届いた時点で担当のワーカーを1つ決め (担当ストリームの少ないワーカー)、以降のフレームはそのワーカーだけが推定する
+    ワーカーはストリームごとに Pose を持つため、ストリーム内の追跡状態が保たれる
+    ワーカーは担当するストリームのうちフレームを待たせているものを順番に (ラウンドロビンで) 推定するため、
+    フレームレートの高いストリームが他のストリームの推定を妨げることはない
+    static_image_mode=True の場合はワーカーが追跡状態を持たない (毎フレーム検出する) ため、担当を決めずに空いたワーカーが推定する
+    (1つのストリームの複数のフレームを並行して推定できる)
+    画像は共有メモリ (SharedFrame) で渡し、ワーカーからはランドマークの配列 (33, 4) だけを受け取る
+    """
+
+    def __init__(self, workers=2, max_pending=1, model_complexity=1,
+                 min_detection_confidence=0.5, min_tracking_confidence=0.5, warmup=True, static_image_mode=False):
+        """
+        workers: ワーカープロセス数
+        max_pending: ストリームごとに推定を待たせておくフレーム数の上限
+        model_complexity, min_detection_confidence, min_tracking_confidence, static_image_mode: mp.solutions.pose.Pose の引数
+        warmup: Trueならワーカーの起動時に Pose を1つ生成して黒画像で推定しておき、最初に届いたストリームに使う
+        """
+        self.max_pending = max_pending
+        self.static_image_mode = static_image_mode
+        params = {
+            "static_image_mode": static_image_mode,
+            "model_complexity": model_complexity,
+            "min_detection_confidence": min_detection_confidence,
+            "min_tracking_confidence": min_tracking_confidence,
+        }
+        # MediaPipe のグラフはフォークしたプロセスでは動かないため、spawn で起動する
+        context = multiprocessing.get_context("spawn")
+        self._pending = OrderedDict()  # {ストリーム: 推定待ちの PoseRequest} (先頭ほど次に割り当てる)
+        self._resets = [set() for _ in range(workers)]  # ワーカーごとの、追跡状態を破棄すべきストリーム
+        self._owners = {}  # {ストリーム: 担当のワーカー番号}
+        self._failed = set()  # 停止したワーカー番号
+        self._frames = []  # 生成した SharedFrame
+        self._free_frames = []  # 使われていない SharedFrame
+        self._cond = threading.Condition()
+        self._closed = False
+        self._alive = workers
+        self.served = {}
+        self.dropped = {}
+
+        self._processes = []
+        self._threads = []
+        for index in range(workers):
+            conn, child_conn = context.Pipe()
+            process = context.Process(target=_poseWorker, args=(child_conn, params, warmup), daemon=True)
+            process.start()
+            child_conn.close()
+            # ワーカーごとに、依頼の送信と結果の受信を行うスレッドを置く
+            thread = threading.Thread(target=self._dispatch, args=(index, conn), daemon=True)
+            thread.start()
+            self._processes.append(process)
+            self._threads.append(thread)
+
+    @property
+    def workers(self):
+        return len(self._processes)
+
+    def frame(self, shape):
+        """
+        推定する画像を書き込む共有メモリ (SharedFrame) を確保する
+        frame.array (shape の配列) に書き込み (cv2 の dst 引数など)、submit に渡す
+        """
+        nbytes = int(np.prod(shape))
+        with self._cond:
+            frame = None
+            for candidate in self._free_frames:
+                if candidate.capacity >= nbytes:
+                    frame = candidate
+                    break
+            if frame is not None:
+                self._free_frames.remove(frame)
+            elif self._free_frames:
+                # 小さすぎる共有メモリは作り直す (ワーカー側は名前が変わったら開き直す)
+                old = self._free_frames.pop()
+                old.close()
+                frame = self._frames[old.index] = SharedFrame(old.index, nbytes)
+            else:
+                frame = SharedFrame(len(self._frames), nbytes)
+                self._frames.append(frame)
+        frame.view(shape)
+        return frame
+
+    def _release_frame(self, frame):
+        with self._cond:
+            if self._closed:
+                frame.close()
+            else:
+                self._free_frames.append(frame)
+
+    def submit(self, stream_id, image, seq=None):
+        """
+        RGB画像の姿勢推定を依頼し、PoseRequest を返す (結果は request.result() で受け取る)
+        image: frame() で確保して書き込んだ SharedFrame (配列を渡した場合は共有メモリにコピーする)
+        seq: フレームの通し番号 (request.seq として返す)
+        """
+        if not isinstance(image, SharedFrame):
+            frame = self.frame(image.shape)
+            np.copyto(frame.array, image)
+            image = frame
+        request = PoseRequest(stream_id, image, seq)
+        dropped = None
+        with self._cond:
+            if self._closed:
+                dropped = request
+            else:
+                if not self.static_image_mode and stream_id not in self._owners:
+                    self._owners[stream_id] = self._least_loaded_worker()
+                pending = self._pending.setdefault(stream_id, deque())
+                if len(pending) >= self.max_pending:
+                    dropped = pending.popleft()
+                    self.dropped[stream_id] = self.dropped.get(stream_id, 0) + 1
+                pending.append(request)
+                # 担当のワーカーを確実に起こす
+                self._cond.notify_all()
+        if dropped is not None:
+            self._drop(dropped)
+        return request
+
+    def process(self, stream_id, image):
+        """RGB画像の姿勢推定を行い、ランドマーク (33, 4) を返す (検出できなければ None)"""
+        return self.submit(stream_id, image).result()
+
+    def _drop(self, request):
+        frame = request.frame
+        request._finish(None, dropped=True)
+        if frame is not None:
+            self._release_frame(frame)
+
+    def reset(self, stream_id):
+        """ストリームの追跡状態を破棄する (次のフレームは検出からやり直す)"""
+        with self._cond:
+            for resets in self._resets:
+                resets.add(stream_id)
+
+    def stats(self):
+        """ストリームごとの推定数・捨てたフレーム数・待ちフレーム数を返す"""
+        with self._cond:
+            return {
+                "workers": self._alive,
+                "served": dict(self.served),
+                "dropped": dict(self.dropped),
+                "pending": {stream_id: len(pending) for stream_id, pending in self._pending.items()},
+                "owners": dict(self._owners),
+            }
+
+    def close(self):
+        """ワーカープロセスを終了する (推定待ちのフレームは捨てる)"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+        for process in self._processes:
+            process.join(timeout=3.0)
+            if process.is_alive():
+                process.terminate()
+        self._drop_pending()
+        with self._cond:
+            frames, self._frames, self._free_frames = self._frames, [], []
+        for frame in frames:
+            frame.close()
+
+    def _least_loaded_worker(self):
+        """担当するストリームが最も少ない (停止していない) ワーカーの番号を返す (ロック取得済みで呼ぶこと)"""
+        loads = {index: 0 for index in range(self.workers) if index not in self._failed}
+        for owner in self._owners.values():
+            if owner in loads:
+                loads[owner] += 1
+        return min(loads, key=lambda index: (loads[index], index))
+
+    def _next_request(self, index):
+        """ワーカー index が次に推定するフレームをストリームの順番に従って取り出す (なければ None)"""
+        for stream_id, pending in self._pending.items():
+            if pending and (self.static_image_mode or self._owners.get(stream_id) == index):
+                # 割り当てたストリームは順番の最後に回す
+                self._pending.move_to_end(stream_id)
+                return pending.popleft()
+        return None
+
+    def _drop_pending(self):
+        with self._cond:
+            requests = [request for pending in self._pending.values() for request in pending]
+            for pending in self._pending.values():
+                pending.clear()
+        for request in requests:
+            self._drop(request)
+
+    def _dispatch(self, index, conn):
+        """ワーカーに推定を依頼し、結果を受け取る"""
+        while True:
+            with self._cond:
+                request = None
+                while not self._closed:
+                    request = self._next_request(index)
+                    if request is not None:
+                        break
+                    self._cond.wait()
+                if request is None:
+                    break
+                if request.stream_id in self._resets[index]:
+                    self._resets[index].discard(request.stream_id)
+                    request.reset = True
+            frame = request.frame
+            try:
+                # 画像は共有メモリの名前と形だけを送る
+                conn.send((request.stream_id, frame.index, frame.shm.name, frame.array.shape, request.reset))
+                landmarks = conn.recv()
+            except (EOFError, OSError) as e:
+                print(f"エラー: 姿勢推定のワーカープロセスが停止しました: {e}")
+                self._drop(request)
+                self._worker_failed(index)
+                return
+            with self._cond:
+                self.served[request.stream_id] = self.served.get(request.stream_id, 0) + 1
+            request._finish(landmarks)
+            self._release_frame(frame)
+        try:
+            conn.send(None)
+        except OSError:
+            pass
+        conn.close()
+
+    def _worker_failed(self, index):
+        """
+        ワーカーが停止した場合の処理
+        担当していたストリームは他のワーカーに移し (追跡は検出からやり直す)、すべて停止したら推定待ちのフレームを捨てる
+        """
+        with self._cond:
+            self._alive -= 1
+            self._failed.add(index)
+            if self._alive > 0:
+                for stream_id, owner in list(self._owners.items()):
+                    if owner == index:
+                        self._owners[stream_id] = self._least_loaded_worker()
+                self._cond.notify_all()
+                return
+            self._closed = True
+        self._drop_pending()
+
+
+def _poseWorker(conn, params, warmup=True):
+    '''
+    ワーカープロセスの処理。(ストリーム, 共有メモリの番号・名前, 画像の形, 追跡状態を破棄するか) を受け取り、
+    共有メモリ上のRGB画像を推定してランドマーク (33, 4) を返す
+    '''
+    import mediapipe as mp
+    from backend.landmarks import landmarksToArray
+
+    poses = {}
+    frames = {}  # {共有メモリの番号: 開いている SharedMemory}
+    spare = None  # 初期化を済ませた、まだストリームに割り当てていない Pose
+    if warmup:
+        spare = mp.solutions.pose.Pose(**params)
+        spare.process(np.zeros((360, 640, 3), np.uint8))
+        spare.reset()
+    try:
+        while True:
+            message = conn.recv()
+            if message is None:
+                break
+            stream_id, index, name, shape, reset = message
+            shm = frames.get(index)
+            if shm is None or shm.name != name:
+                if shm is not None:
+                    shm.close()
+                # 解放は作成した親プロセスが行う (spawn したプロセスは親と同じ resource_tracker を使うため、登録はそのままでよい)
+                shm = frames[index] = shared_memory.SharedMemory(name=name)
+            pose = poses.get(stream_id)
+            if pose is None and spare is not None:
+                pose, spare = spare, None
+                poses[stream_id] = pose
+            elif pose is None:
+                pose = poses[stream_id] = mp.solutions.pose.Pose(**params)
+            elif reset:
+                pose.reset()
+            image = np.ndarray(shape, np.uint8, buffer=shm.buf)
+            results = pose.process(image)
+            # 共有メモリを閉じられるよう、参照を残さない
+            del image
+            conn.send(landmarksToArray(results.pose_landmarks))
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        for pose in poses.values():
+            pose.close()
+        if spare is not None:
+            spare.close()
+        for shm in frames.values():
+            shm.close()
+        conn.close()
+
@@ -0,0 +1,273 @@
+import math
+
+import cv2
+import numpy as np
+
+
+class LandmarkPredictor:
+    """
+    姿勢推定を省略したフレームのランドマークを、直前の推定結果から予測するクラス (直前の値を保持するだけ)
+    ランドマークは (33, 4) の配列 [x, y, z, visibility] で扱う
+    """
+
+    def __init__(self, max_extrapolation=0.2):
+        """
+        max_extrapolation: 最後の推定からこの時間 (秒) を超えて外挿しない
+        """
+        self.max_extrapolation = max_extrapolation
+        self.reset()
+
+    def reset(self):
+        """追跡中の状態を破棄する"""
+        self._last = None
+        self._last_time = None
+
+    def update(self, timestamp, landmarks):
+        """推定結果を反映する (landmarks が None なら追跡を打ち切る)"""
+        if landmarks is None:
+            self.reset()
+            return
+        self._last = landmarks
+        self._last_time = timestamp
+
+    def _elapsed(self, timestamp):
+        """最後の推定からの経過時間 (外挿の上限で打ち切る)"""
+        return min(max(timestamp - self._last_time, 0.0), self.max_extrapolation)
+
+    def predict(self, timestamp):
+        """指定時刻のランドマークを予測する (追跡中でなければ None)"""
+        return self._last
+
+
+class ConstantVelocityPredictor(LandmarkPredictor):
+    """直近2回の推定結果から求めた速度で、ランドマークを等速直線運動として外挿する"""
+
+    def reset(self):
+        super().reset()
+        self._velocity = None
+
+    def update(self, timestamp, landmarks):
+        if landmarks is not None and self._last is not None:
+            dt = timestamp - self._last_time
+            if dt > 0:
+                self._velocity = (landmarks[:, :3] - self._last[:, :3]) / dt
+        super().update(timestamp, landmarks)
+
+    def predict(self, timestamp):
+        if self._last is None or self._velocity is None:
+            return self._last
+        predicted = self._last.copy()
+        predicted[:, :3] += self._velocity * self._elapsed(timestamp)
+        return predicted
+
+
+class KalmanPredictor(LandmarkPredictor):
+    """
+    各座標 (33関節 × x, y, z) を位置・速度を状態とするカルマンフィルタで追跡する
+    全関節分をまとめて配列演算で更新する
+    """
+
+    def __init__(self, max_extrapolation=0.2, process_noise=1.0, measurement_noise=1e-4):
+        """
+        process_noise: 加速度の分散 (正規化座標/秒^2)
+        measurement_noise: 観測値の分散 (正規化座標)
+        """
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        super().__init__(max_extrapolation)
+
+    def reset(self):
+        super().reset()
+        self._position = None
+        self._velocity = None
+        # 共分散行列 [[p00, p01], [p01, p11]] の各要素を座標ごとに保持する
+        self._p00 = self._p01 = self._p11 = None
+
+    def update(self, timestamp, landmarks):
+        if landmarks is None:
+            self.reset()
+            return
+
+        z = landmarks[:, :3].astype(np.float32)
+        if self._position is None:
+            self._position = z.copy()
+            self._velocity = np.zeros_like(z)
+            self._p00 = np.full_like(z, self.measurement_noise)
+            self._p01 = np.zeros_like(z)
+            self._p11 = np.ones_like(z)
+        else:
+            # 時間更新 (等速モデル)
+            dt = max(timestamp - self._last_time, 0.0)
+            q = self.process_noise
+            self._position += self._velocity * dt
+            self._p00 += dt * (2.0 * self._p01 + dt * self._p11) + q * dt ** 3 / 3.0
+            self._p01 += dt * self._p11 + q * dt ** 2 / 2.0
+            self._p11 += q * dt
+
+            # 観測更新
+            s = self._p00 + self.measurement_noise
+            k0 = self._p00 / s
+            k1 = self._p01 / s
+            residual = z - self._position
+            self._position += k0 * residual
+            self._velocity += k1 * residual
+            self._p11 -= k1 * self._p01
+            self._p00 *= 1.0 - k0
+            self._p01 *= 1.0 - k0
+
+        self._last = landmarks.copy()
+        self._last[:, :3] = self._position
+        self._last_time = timestamp
+
+    def predict(self, timestamp):
+        if self._last is None:
+            return None
+        predicted = self._last.copy()
+        predicted[:, :3] += self._velocity * self._elapsed(timestamp)
+        return predicted
+
+
+def createPredictor(name, max_extrapolation=0.2, **params):
+    '''
+    名前からランドマークの予測器を生成する ("hold" / "constant_velocity" / "kalman")
+    '''
+    if name == "kalman":
+        return KalmanPredictor(max_extrapolation, **params)
+    if name == "constant_velocity":
+        return ConstantVelocityPredictor(max_extrapolation)
+    if name == "hold" or name is None:
+        return LandmarkPredictor(max_extrapolation)
+    raise ValueError(f"未対応の予測方法です: {name}")
+
+
+class InferenceScheduler:
+    """
+    姿勢推定を行うフレームを決めるクラス
+    interval フレームごと、または前回推定時からの画面の変化量が閾値を超えたときに推定する
+    """
+
+    def __init__(self, interval=1, motion_threshold=None, thumbnail_size=(64, 36)):
+        """
+        interval: 推定を行うフレーム間隔 (1なら毎フレーム推定する)
+        motion_threshold: 縮小グレー画像の画素値の平均変化量 (0〜255) の閾値 (Noneで無効)
+        thumbnail_size: 変化量の計算に使う縮小画像の大きさ (幅, 高さ)
+        """
+        self.interval = max(1, int(interval))
+        self.motion_threshold = motion_threshold
+        self.thumbnail_size = thumbnail_size
+        self.last_motion = 0.0
+        self.reset()
+
+    def _thumbnail(self, frame):
+        """変化量の計算用に縮小したグレー画像を作る (縮小してから変換する)"""
+        small = cv2.resize(frame, self.thumbnail_size, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    def should_infer(self, frame):
+        """このフレームで姿勢推定を行うべきかを返す"""
+        if self.interval <= 1:
+            return True
+
+        self._frames_since += 1
+        due = self._frames_since >= self.interval
+        if self.motion_threshold is not None:
+            thumbnail = self._thumbnail(frame)
+            if not due and self._reference is not None:
+                self.last_motion = cv2.mean(cv2.absdiff(thumbnail, self._reference))[0]
+                due = self.last_motion > self.motion_threshold
+            if due or self._reference is None:
+                # 推定したフレームを、以降の変化量の基準にする
+                self._reference = thumbnail
+                due = True
+        if due:
+            self._frames_since = 0
+        return due
+
+    def reset(self):
+        """次のフレームで必ず推定するようにする"""
+        self._reference = None
+        self._frames_since = self.interval
+
+
+class PersonRoiTracker:
+    """
+    前回のランドマークから人物を囲む領域を求め、次のフレームではその周辺だけを姿勢推定の対象にする
+    MediaPipe はフレーム間で人物を追跡するため、人物が領域の内側にいる間は切り出す領域を変えない
+    ランドマークは (33, 4) の配列 [x, y, z, visibility] (フレーム全体に対する正規化座標) で扱う
+    """
+
+    def __init__(self, padding=0.3, max_area_ratio=0.8, min_visibility=0.5):
+        """
+        padding: 人物領域の周囲に加える余白 (領域の長辺に対する比率)
+        max_area_ratio: 切り出す領域がフレームのこの割合を超える場合は全体で推定する
+        min_visibility: 領域の計算に使う関節の信頼度の下限
+        """
+        self.padding = padding
+        self.max_area_ratio = max_area_ratio
+        self.min_visibility = min_visibility
+        self.reset()
+
+    def reset(self):
+        """追跡を打ち切り、次のフレームは全体で推定する"""
+        self._crop = None
+        self.changed = True
+
+    def roi(self, frame_shape):
+        """
+        切り出す領域 (x1, y1, x2, y2) をピクセル座標で返す
+        追跡していない場合や、切り出しても小さくならない場合は None (フレーム全体) を返す
+        """
+        if self._crop is None:
+            return None
+        frame_height, frame_width = frame_shape[:2]
+        min_x, min_y, max_x, max_y = self._crop
+        x1, y1 = max(0, int(min_x * frame_width)), max(0, int(min_y * frame_height))
+        x2 = min(frame_width, int(math.ceil(max_x * frame_width)))
+        y2 = min(frame_height, int(math.ceil(max_y * frame_height)))
+        if x2 <= x1 or y2 <= y1:
+            return None
+        if (x2 - x1) * (y2 - y1) > frame_width * frame_height * self.max_area_ratio:
+            return None
+        return x1, y1, x2, y2
+
+    def update(self, landmarks):
+        """
+        フレーム全体の座標に直したランドマークで、切り出す領域を更新する (None なら追跡を打ち切る)
+        領域を変えた場合は changed が True になる
+        """
+        self.changed = False
+        visible = None if landmarks is None else landmarks[landmarks[:, 3] > self.min_visibility]
+        if visible is None or len(visible) == 0:
+            self.changed = self._crop is not None
+            self._crop = None
+            return
+
+        min_x, min_y = float(visible[:, 0].min()), float(visible[:, 1].min())
+        max_x, max_y = float(visible[:, 0].max()), float(visible[:, 1].max())
+        pad = max(max_x - min_x, max_y - min_y) * self.padding
+        if self._crop is not None:
+            # 人物が現在の領域の内側 (余白の半分より内側) にいて、領域が大きすぎなければそのまま使う
+            crop_min_x, crop_min_y, crop_max_x, crop_max_y = self._crop
+            margin = pad / 2
+            inside = (min_x - margin >= crop_min_x and min_y - margin >= crop_min_y
+                      and max_x + margin <= crop_max_x and max_y + margin <= crop_max_y)
+            desired_area = (max_x - min_x + 2 * pad) * (max_y - min_y + 2 * pad)
+            current_area = (crop_max_x - crop_min_x) * (crop_max_y - crop_min_y)
+            if inside and desired_area >= current_area * 0.5:
+                return
+
+        # 正規化座標で保持し、解像度が変わっても使えるようにする
+        self._crop = (min_x - pad, min_y - pad, max_x + pad, max_y + pad)
+        self.changed = True
+
+    @staticmethod
+    def toFrameCoords(landmarks, roi, frame_shape):
+        """切り出し画像に対する正規化座標のランドマークを、フレーム全体に対する正規化座標に直す"""
+        frame_height, frame_width = frame_shape[:2]
+        x1, y1, x2, y2 = roi
+        converted = landmarks.copy()
+        converted[:, 0] = (landmarks[:, 0] * (x2 - x1) + x1) / frame_width
+        converted[:, 1] = (landmarks[:, 1] * (y2 - y1) + y1) / frame_height
+        # z は x と同じ尺度なので、幅の比率で直す
+        converted[:, 2] = landmarks[:, 2] * (x2 - x1) / frame_width
+        return converted
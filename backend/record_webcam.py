@@ -1,11 +1,13 @@
+# 実行方法 (リポジトリのルートで): python -m backend.record_webcam
 import cv2
 import sys
-from library import fillInBackground
+from backend.library import HumanSegmenter
+from backend.sinks import RecordingSink
 
 # 定数定義
 IMG_HEIGHT=int(256)
 IMG_WIDTH=int(512)
-FOURCC=cv2.VideoWriter_fourcc(*"MP4V")
+FOURCC="mp4v"
 FPS=float(30.0)
 VIDEO_NAME="./test.mp4"
 WINDOW_NAME="Camera"
@@ -18,7 +20,10 @@ if not cap.isOpened():
     print("キャプチャできませんでした。")    
     sys.exit()
 
-dst=cv2.VideoWriter(VIDEO_NAME,FOURCC,FPS,(IMG_WIDTH,IMG_HEIGHT),isColor=True)
+## リサイズ・エンコードは録画用のスレッドで行う (fill_background の返り値は次の呼び出しで上書きされるため、コピーして渡す)
+dst=RecordingSink(VIDEO_NAME,FOURCC,FPS,(IMG_WIDTH,IMG_HEIGHT),policy="drop",copy=True)
+## セグメンテーションモデルは最初に1回だけ読み込む
+segmenter=HumanSegmenter()
 
 save_fig=None
 
@@ -30,14 +35,14 @@ while cap.isOpened():
     save_fig=src
 
     # srcに対してスーツを着せるなどの加工処理（試しに背景を緑色にしてみる）
-    src=fillInBackground(src,(0,255,0))
+    src=segmenter.fill_background(src,(0,255,0),flip=True)
 
     # 表示
     cv2.imshow(WINDOW_NAME,src)
     cv2.moveWindow(WINDOW_NAME,0,0)
 
     # 書き込み
-    dst.write(cv2.resize(src,(IMG_WIDTH,IMG_HEIGHT)))
+    dst.submit(src)
 
     # q キーが押されたら停止する
     if cv2.waitKey(1) & 0xFF == ord('q'):
@@ -47,5 +52,7 @@ cv2.imwrite("my_image.jpg",save_fig)
 
 # 後処理
 cap.release()
-dst.release()
+dst.close()
+print(f"録画したフレーム数: {dst.frames} (間に合わずに捨てたフレーム数: {dst.dropped})")
+segmenter.close()
 cv2.destroyAllWindows()
\ No newline at end of file
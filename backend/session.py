@@ -0,0 +1,149 @@
+'''
+複数のカメラの試着映像を同時に処理するセッション
+
+    python -m backend.session 0 1 [--workers 2]
+
+数字キーで表示するストリームを切り替え、Tabキーで次のストリームへ、q で終了する
+'''
+import argparse
+import os
+import threading
+
+import cv2
+
+from backend.app import Config, VirtualTryOnApp
+from backend.asset_store import AssetStore
+from backend.catalog import Catalog
+from backend.pose_pool import PoseWorkerPool
+
+
+class TryOnSession:
+    """
+    複数のカメラの試着映像を同時に処理し、表示するストリームを切り替える
+    姿勢推定は全ストリームで共有するワーカープロセスのプールで行い、空いたワーカーにストリームを順番に割り当てる
+    衣装カタログとアセットのストアも全ストリームで共有する (読み込んだパーツ画像は読み取り専用で参照する)
+    表示の切り替えは参照するストリームを変えるだけで、各ストリームの取得・処理は止めない
+    """
+
+    def __init__(self, sources, pose_workers=None, autostart=True):
+        """
+        sources: 各ストリームの入力 (カメラ番号 / 動画ファイルのパス / 画像ディレクトリのパス / FrameSource) のリスト
+        pose_workers: 姿勢推定のワーカープロセス数 (省略時はストリーム数と CPUコア数-1 の小さい方、最低1)
+        autostart: Falseの場合は映像処理スレッドを開始しない (start() で開始する)
+        """
+        if not sources:
+            raise ValueError("ストリームの入力を1つ以上指定してください。")
+        config = Config()
+        if pose_workers is None:
+            pose_workers = max(1, min(len(sources), (os.cpu_count() or 1) - 1))
+        self.pose_pool = PoseWorkerPool(pose_workers)
+        self.catalog = Catalog.load(config.CATALOG_PATH)
+        self.assets = AssetStore.from_catalog(self.catalog, config.ASSET_CACHE_DIR, config.ASSET_MAX_BYTES, config.ASSET_USE_MMAP)
+        self.streams = []
+        for index, source in enumerate(sources):
+            self.streams.append(VirtualTryOnApp(
+                camera_index=source if isinstance(source, int) else index,
+                source=source,
+                autostart=False,
+                pose_pool=self.pose_pool,
+                stream_id=index,
+                catalog=self.catalog,
+                assets=self.assets))
+        self.active = 0
+        self._lock = threading.Lock()
+        if autostart:
+            self.start()
+
+    def start(self):
+        """すべてのストリームの映像処理を開始する"""
+        for stream in self.streams:
+            stream.start()
+
+    def __len__(self):
+        return len(self.streams)
+
+    def select(self, index):
+        """表示するストリームを切り替える (取得・処理は止めない)"""
+        if not 0 <= index < len(self.streams):
+            raise IndexError(f"ストリーム {index} はありません (0〜{len(self.streams) - 1})")
+        with self._lock:
+            self.active = index
+
+    def selectNext(self):
+        """次のストリームを表示する"""
+        with self._lock:
+            self.active = (self.active + 1) % len(self.streams)
+            return self.active
+
+    @property
+    def stream(self):
+        """表示中のストリーム (VirtualTryOnApp)"""
+        return self.streams[self.active]
+
+    @property
+    def frames(self):
+        """表示中のストリームの描画済みフレームの受け渡し (FrameExchange)"""
+        return self.stream.frames
+
+    def latest(self):
+        """表示中のストリームの番号・フレームの通し番号・最新の描画済みフレームを返す"""
+        index = self.active
+        seq, frame = self.streams[index].frames.latest()
+        return index, seq, frame
+
+    def changeCloth(self, cloth_name, index=None):
+        """ストリーム (省略時は表示中のストリーム) の衣装を切り替える"""
+        self.streams[self.active if index is None else index].changeCloth(cloth_name)
+
+    def switchDrawingCloth(self, index=None):
+        """ストリーム (省略時は表示中のストリーム) の衣装の表示状態を反転させる"""
+        self.streams[self.active if index is None else index].switchDrawingCloth()
+
+    def getMetrics(self):
+        """ストリームごとの計測結果と、姿勢推定のプールの統計を返す"""
+        return {
+            "streams": [stream.getMetrics() for stream in self.streams],
+            "pose_pool": self.pose_pool.stats(),
+            "assets": self.assets.stats(),
+        }
+
+    def stop(self):
+        """すべてのストリームを停止し、ワーカープロセスを終了する"""
+        for stream in self.streams:
+            stream.stopped = True
+        for stream in self.streams:
+            stream.stop()
+        self.pose_pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="複数のカメラの試着映像を同時に処理し、表示するストリームを切り替える")
+    parser.add_argument("sources", nargs="+", help="カメラ番号・動画ファイル・画像ディレクトリ")
+    parser.add_argument("--workers", type=int, default=None, help="姿勢推定のワーカープロセス数")
+    args = parser.parse_args()
+    sources = [int(source) if source.isdigit() else source for source in args.sources]
+
+    WINDOW_NAME = "Virtual Try-On"
+    session = TryOnSession(sources, args.workers)
+    shown = (None, 0)
+    try:
+        cv2.namedWindow(WINDOW_NAME, cv2.WINDOW_NORMAL)
+        while True:
+            index, seq, frame = session.latest()
+            if frame is not None and (index, seq) != shown:
+                cv2.imshow(WINDOW_NAME, frame)
+                shown = (index, seq)
+            key = cv2.waitKey(10) & 0xFF
+            if key == ord("q"):
+                break
+            if key == ord("\t"):
+                session.selectNext()
+            elif ord("1") <= key <= ord("9") and key - ord("1") < len(session):
+                session.select(key - ord("1"))
+    finally:
+        session.stop()
+        print(session.getMetrics()["pose_pool"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+
+import cv2
+import numpy as np
+
+from backend.pipeline import DropOldestQueue
+
+
+class FrameBufferPool:
+    """
+    事前に確保したフレームのバッファを使い回すプール
+    空きがない場合は確保せずに None を返す (出力が追いつかないフレームは捨てる)
+    """
+
+    def __init__(self, count=3):
+        self.count = count
+        self._shape = None
+        self._free = []
+        self._cond = threading.Condition()
+
+    def acquire(self, shape, timeout=0):
+        """
+        shape のバッファを取り出す (大きさが変わったときはすべて確保し直す)
+        timeout: 空きを待つ時間 (秒、Noneなら空くまで待つ)
+        """
+        with self._cond:
+            if shape != self._shape:
+                self._shape = shape
+                self._free = [np.empty(shape, np.uint8) for _ in range(self.count)]
+            if not self._cond.wait_for(lambda: self._free, timeout):
+                return None
+            return self._free.pop()
+
+    def release(self, buffer):
+        """使い終わったバッファを返す"""
+        with self._cond:
+            if buffer.shape == self._shape:
+                self._free.append(buffer)
+                self._cond.notify()
+
+
+class OutputSink(ABC):
+    """
+    描画済みフレームの出力先の基底クラス
+    描画スレッドは submit() でフレームを渡すだけで、出力は出力先ごとのスレッドで行う
+    出力が追いつかない場合は古いフレームから捨てるため、描画スレッドを待たせることはない (policy="block" の場合は待つ)
+    RGB で出力する場合は、確保済みのバッファへのコピーと同時に色変換する (BGRのままの場合はコピーせずに参照を渡す)
+    派生クラスは _write を実装する (必要に応じて _open / _close も実装する)
+    """
+
+    rgb = False  # Trueなら RGB に変換したフレームを _write に渡す
+    POLICIES = ("drop", "block")
+
+    def __init__(self, queue_size=1, buffers=3, policy="drop", copy=False):
+        """
+        queue_size: 出力待ちにしておくフレーム数
+        buffers: フレームをコピーするバッファの数 (RGB に変換する場合と copy=True の場合に使う)
+        policy: 出力待ちがあふれたときの方針 ("drop": 古いフレームを捨てる / "block": 空くまで submit を待たせる)
+        copy: Trueなら submit で確保済みのバッファにコピーする (渡したフレームを呼び出し側で書き換える場合)
+        """
+        if policy not in self.POLICIES:
+            raise ValueError(f"未対応の方針です: {policy} (利用可能: {self.POLICIES})")
+        self.block = policy == "block"
+        self._queue = DropOldestQueue(queue_size)
+        self._pool = FrameBufferPool(max(buffers, queue_size + 2)) if self.rgb or copy else None
+        self._opened_shape = None
+        self.failed = False
+        self.frames = 0
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._worker, daemon=True)
+        self._thread.start()
+
+    def submit(self, frame):
+        """
+        フレームの出力を依頼する (出力を待たずに戻る)
+        渡したフレームは出力が終わるまで書き換えないこと (FrameExchange に公開したフレームと同じ扱い)
+        """
+        if self.failed:
+            return False
+        if self._pool is not None:
+            buffer = self._pool.acquire(frame.shape, timeout=None if self.block else 0)
+            if buffer is None:
+                self.dropped += 1
+                return False
+            if self.rgb:
+                cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=buffer)
+            else:
+                np.copyto(buffer, frame)
+            frame = buffer
+        dropped = self._queue.put(frame, block=self.block)
+        if dropped is not None:
+            # 閉じられた後に block で追加した場合は、追加したフレームがそのまま返る
+            self.dropped += 1
+            self._recycle(dropped)
+            return dropped is not frame
+        return True
+
+    def close(self):
+        """出力待ちのフレームを出力してからスレッドを終了し、出力先を閉じる"""
+        self._queue.close()
+        self._thread.join()
+
+    def _recycle(self, frame):
+        if self._pool is not None:
+            self._pool.release(frame)
+
+    def _worker(self):
+        try:
+            while True:
+                frame = self._queue.get()
+                if frame is None:
+                    break
+                try:
+                    if frame.shape != self._opened_shape:
+                        # 最初のフレーム (または解像度が変わったとき) に出力先を開く
+                        if self._opened_shape is not None:
+                            self._close()
+                        self._open(frame.shape)
+                        self._opened_shape = frame.shape
+                    self._write(frame)
+                    self.frames += 1
+                except Exception as e:
+                    print(f"エラー: {type(self).__name__} への出力に失敗しました: {e}")
+                    self.failed = True
+                    break
+                finally:
+                    self._recycle(frame)
+        finally:
+            if self._opened_shape is not None:
+                self._close()
+
+    def _open(self, shape):
+        """出力先を開く (shape: フレームの形 (H, W, 3))"""
+
+    @abstractmethod
+    def _write(self, frame):
+        """フレームを出力する"""
+
+    def _close(self):
+        """出力先を閉じる"""
+
+
+class NullSink(OutputSink):
+    """フレームを受け取って数えるだけの出力先 (計測用)"""
+
+    def _write(self, frame):
+        pass
+
+
+class MemorySink(OutputSink):
+    """受け取ったフレームをメモリに保持する出力先 (テスト用)"""
+
+    def __init__(self, max_frames=None, rgb=False, queue_size=1):
+        """
+        max_frames: 保持するフレーム数の上限 (古いものから捨てる。Noneなら上限なし)
+        rgb: Trueなら RGB に変換したフレームを保持する
+        """
+        self.rgb = rgb
+        self.received = deque(maxlen=max_frames)
+        self.received_count = 0
+        self._cond = threading.Condition()
+        super().__init__(queue_size)
+
+    def _write(self, frame):
+        # RGB の場合はバッファを使い回すため、保持する分はコピーする
+        with self._cond:
+            self.received.append(frame.copy() if self.rgb else frame)
+            self.received_count += 1
+            self._cond.notify_all()
+
+    def wait_for(self, count, timeout=None):
+        """合計 count 枚のフレームを受け取るまで待つ (受け取れたかを返す)"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.received_count >= count, timeout)
+
+
+class WindowSink(OutputSink):
+    """OpenCV のウィンドウに表示する出力先 (Qt を使わない確認用)"""
+
+    def __init__(self, window_name="Virtual Try-On", queue_size=1):
+        self.window_name = window_name
+        super().__init__(queue_size)
+
+    def _open(self, shape):
+        cv2.namedWindow(self.window_name, cv2.WINDOW_NORMAL)
+
+    def _write(self, frame):
+        cv2.imshow(self.window_name, frame)
+        cv2.waitKey(1)
+
+    def _close(self):
+        try:
+            cv2.destroyWindow(self.window_name)
+        except cv2.error:
+            pass
+
+
+class FileSink(OutputSink):
+    """動画ファイルに書き込む出力先"""
+
+    def __init__(self, path, fourcc="mp4v", fps=30.0, queue_size=1, policy="drop", copy=False):
+        self.path = path
+        self.fourcc = fourcc
+        self.fps = fps
+        self._writer = None
+        super().__init__(queue_size, policy=policy, copy=copy)
+
+    def _open(self, shape):
+        height, width = shape[:2]
+        self._writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*self.fourcc), self.fps, (width, height), isColor=True)
+        if not self._writer.isOpened():
+            raise IOError(f"動画ファイルを開けませんでした: {self.path} ({self.fourcc})")
+
+    def _write(self, frame):
+        self._writer.write(frame)
+
+    def _close(self):
+        if self._writer is not None:
+            self._writer.release()
+            self._writer = None
+
+
+class VirtualCameraSink(OutputSink):
+    """
+    仮想カメラ (pyvirtualcam) に出力する出力先 (Zoom・OBS などからカメラとして選べる)
+    pyvirtualcam は使うときにだけ読み込む
+    """
+
+    rgb = True
+
+    def __init__(self, fps=30.0, device=None, queue_size=1, buffers=3):
+        """
+        fps: 仮想カメラのフレームレート
+        device: 仮想カメラのデバイス (省略時は既定のデバイス)
+        """
+        try:
+            import pyvirtualcam
+        except ImportError as e:
+            raise ImportError("仮想カメラへの出力には pyvirtualcam が必要です (pip install pyvirtualcam)") from e
+        self._pyvirtualcam = pyvirtualcam
+        self.fps = fps
+        self.device = device
+        self._camera = None
+        super().__init__(queue_size, buffers)
+
+    def _open(self, shape):
+        height, width = shape[:2]
+        self._camera = self._pyvirtualcam.Camera(width, height, self.fps, fmt=self._pyvirtualcam.PixelFormat.RGB, device=self.device)
+        print(f"仮想カメラを開きました: {self._camera.device} ({width}x{height} @ {self.fps}fps)")
+
+    def _write(self, frame):
+        self._camera.send(frame)
+
+    def _close(self):
+        if self._camera is not None:
+            self._camera.close()
+            self._camera = None
+
+
+class RecordingSink(FileSink):
+    """
+    試着映像を記録する出力先
+    リサイズ・エンコードは出力先のスレッドで行い、描画スレッドは出力待ちのキューにフレームを積むだけにする
+    ファイルは大きさ・記録時間の上限を超えるごとに新しいファイルへ切り替える
+    """
+
+    def __init__(self, path="recordings/tryon_{time}_{index:03d}.mp4", fourcc="mp4v", fps=30.0, size=None,
+                 policy="drop", queue_size=8, max_bytes=None, max_seconds=None, hw_acceleration=True, copy=False):
+        """
+        path: 出力先のパス ({time} は記録開始時刻、{index} はファイルの通し番号に置き換える)
+        fourcc: コーデック ("mp4v", "avc1", "MJPG" など)
+        fps: 記録するフレームレート
+        size: 記録する解像度 (幅, 高さ)。省略時は受け取ったフレームのまま
+        policy: エンコードが追いつかない場合の方針 ("drop": 古いフレームを捨てる / "block": 描画スレッドを待たせる)
+        queue_size: エンコード待ちにしておくフレーム数
+        max_bytes, max_seconds: ファイルを切り替える大きさ [byte] と記録時間 [秒] (Noneなら切り替えない)
+        hw_acceleration: Trueならハードウェアエンコーダーを使えるか試す (使えなければソフトウェアでエンコードする)
+        copy: Trueなら submit 時にフレームをコピーする (渡したフレームを呼び出し側で書き換える場合)
+        """
+        self.path_pattern = path
+        self.size = tuple(size) if size is not None else None
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.hw_acceleration = hw_acceleration
+        self.started = time.strftime("%Y%m%d-%H%M%S")
+        self.index = 0
+        self.paths = []  # 書き込んだファイルのパス
+        self._file_frames = 0
+        self._file_opened = None  # 書き込み中のファイルを開いた時刻 (time.monotonic() 基準)
+        self._resized = None
+        # path は書き込み中のファイルのパス (最初のフレームを受け取ったときに決める)
+        super().__init__(None, fourcc, fps, queue_size, policy=policy, copy=copy)
+
+    def _next_path(self):
+        path = self.path_pattern.format(time=self.started, index=self.index)
+        self.index += 1
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        return path
+
+    def _open(self, shape):
+        height, width = shape[:2]
+        if self.size is not None:
+            width, height = self.size
+        self.path = self._next_path()
+        fourcc = cv2.VideoWriter_fourcc(*self.fourcc)
+        self._writer = None
+        if self.hw_acceleration:
+            params = [cv2.VIDEOWRITER_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY]
+            writer = cv2.VideoWriter(self.path, cv2.CAP_ANY, fourcc, self.fps, (width, height), params)
+            if writer.isOpened():
+                self._writer = writer
+        if self._writer is None:
+            self._writer = cv2.VideoWriter(self.path, fourcc, self.fps, (width, height), isColor=True)
+        if not self._writer.isOpened():
+            raise IOError(f"動画ファイルを開けませんでした: {self.path} ({self.fourcc})")
+        self.paths.append(self.path)
+        self._file_frames = 0
+        self._file_opened = time.monotonic()
+
+    def _write(self, frame):
+        if self.size is not None and (frame.shape[1], frame.shape[0]) != self.size:
+            if self._resized is None or self._resized.shape[:2] != (self.size[1], self.size[0]):
+                self._resized = np.empty((self.size[1], self.size[0], 3), np.uint8)
+            cv2.resize(frame, self.size, dst=self._resized, interpolation=cv2.INTER_AREA)
+            frame = self._resized
+        self._writer.write(frame)
+        self._file_frames += 1
+        if self._should_rotate():
+            self._close()
+            self._open(frame.shape)
+
+    def _should_rotate(self):
+        """
+        ファイルの大きさ・記録時間が上限を超えたか (大きさは1秒分ごとに確認する)
+        記録時間はファイルを開いてからの実時間で測る (フレームを捨てた場合や fps が実際と違う場合もずれないように)
+        """
+        if self.max_seconds is not None and time.monotonic() - self._file_opened >= self.max_seconds:
+            return True
+        if self.max_bytes is not None and self._file_frames % max(1, int(self.fps)) == 0:
+            try:
+                return os.path.getsize(self.path) >= self.max_bytes
+            except OSError:
+                return False
+        return False
+
+
+def createSink(name, **params):
+    '''
+    名前から出力先を生成する ("virtual_camera" / "window" / "file" / "recording" / "memory" / "null")
+    '''
+    if name == "virtual_camera":
+        return VirtualCameraSink(**params)
+    if name == "window":
+        return WindowSink(**params)
+    if name == "file":
+        return FileSink(**params)
+    if name == "recording":
+        return RecordingSink(**params)
+    if name == "memory":
+        return MemorySink(**params)
+    if name == "null":
+        return NullSink(**params)
+    raise ValueError(f"未対応の出力先です: {name}")
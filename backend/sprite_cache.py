@@ -0,0 +1,126 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def _nbytes(value):
+    """キャッシュ値(配列、または配列を含むタプル)が占めるバイト数を返す"""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(v) for v in value)
+    return 0
+
+
+class SpriteCache:
+    """
+    回転・拡大縮小・反転済みの衣装パーツ画像を保持するLRUキャッシュ
+    キーは (衣装名, パーツ名, 量子化した角度, 量子化した拡大率, 反転有無) を想定する
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, min_entries=64):
+        """
+        max_bytes: キャッシュが保持する画像の合計バイト数の上限
+        min_entries: 少なくともこの数の値を保持できるよう、max_bytes / min_entries を超える値はキャッシュしない
+                     (大きな画像が他の値を追い出し続けると、キャッシュしない場合より遅くなるため)
+        """
+        self.max_bytes = max_bytes
+        self.min_entries = max(1, min_entries)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bypassed = 0
+
+    @classmethod
+    def shared(cls, max_bytes=None, min_entries=None):
+        """プロセス内で共有されるキャッシュを返す (初回呼び出し時に生成)"""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            if max_bytes is not None or min_entries is not None:
+                cls._shared.set_budget(max_bytes, min_entries)
+            return cls._shared
+
+    def get(self, key):
+        """キーに対応する値を返す。なければNoneを返す"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """値を登録し、上限を超えた分を古いものから破棄する"""
+        size = _nbytes(value)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= _nbytes(old)
+            # 大きすぎる値は保持しない
+            if size > self.max_entry_bytes:
+                self.bypassed += 1
+                return
+            self._entries[key] = value
+            self._bytes += size
+            self._evict()
+
+    def get_or_create(self, key, factory):
+        """キーに対応する値を返す。なければfactory()で生成して登録する"""
+        value = self.get(key)
+        if value is None:
+            value = factory()
+            if value is not None:
+                self.put(key, value)
+        return value
+
+    @property
+    def max_entry_bytes(self):
+        """キャッシュする値1つあたりのバイト数の上限"""
+        return self.max_bytes // self.min_entries
+
+    def set_budget(self, max_bytes=None, min_entries=None):
+        """メモリ上限 (と、保持できるようにする値の数) を変更する"""
+        with self._lock:
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            if min_entries is not None:
+                self.min_entries = max(1, min_entries)
+            self._evict()
+
+    def clear(self):
+        """すべての値を破棄する"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """ヒット数・ミス数などの統計値を返す"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "bypassed": self.bypassed,
+                "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+            }
+
+    def _evict(self):
+        """上限を下回るまで最も古い値を破棄する (ロック取得済みで呼ぶこと)"""
+        while self._bytes > self.max_bytes and self._entries:
+            _, value = self._entries.popitem(last=False)
+            self._bytes -= _nbytes(value)
+            self.evictions += 1
@@ -0,0 +1,106 @@
+import threading
+from contextlib import nullcontext
+
+from PyQt6.QtCore import Qt, QRectF, pyqtSignal
+from PyQt6.QtGui import QImage, QPainter
+from PyQt6.QtWidgets import QWidget
+
+
+class VideoView(QWidget):
+    """
+    描画済みフレームを表示するウィジェット
+    フレームの NumPy 配列をコピーせずに QImage として参照し、アスペクト比を保って描画する
+    バックエンドの FrameExchange を監視するスレッドが新しいフレームごとに frameReady を送り、それを受けて再描画する
+    (タイマーで問い合わせないため、表示の遅れは最大1フレームに収まる)
+    """
+
+    frameReady = pyqtSignal(int, object)
+
+    def __init__(self, title="Virtual Try-On", parent=None):
+        super().__init__(parent)
+        self.setWindowTitle(title)
+        self.setAttribute(Qt.WidgetAttribute.WA_OpaquePaintEvent)
+        self.setStyleSheet("background-color: black;")
+        self.resize(1280, 720)
+        self._frame = None
+        self._seq = 0
+        self._metrics = None
+        self._watcher = None
+        self._stop = None
+        # 受け取ったフレームが処理されるまで、監視スレッドは次のフレームを送らない
+        self._consumed = threading.Event()
+        self._lock = threading.Lock()
+        self.frameReady.connect(self._on_frame)
+
+    def attach(self, frames, metrics=None):
+        """
+        表示するフレームの受け渡し (FrameExchange) を切り替える (どのスレッドから呼んでもよい)
+        metrics: 表示の所要時間と表示されずに上書きされたフレーム数を記録する Metrics
+        """
+        with self._lock:
+            self._stop_watcher()
+            self._metrics = metrics
+            self._seq = 0
+            stop = self._stop = threading.Event()
+            self._consumed.set()
+            self._watcher = threading.Thread(target=self._watch, args=(frames, stop), daemon=True)
+            self._watcher.start()
+
+    def detach(self):
+        """フレームの監視を止め、表示を消す"""
+        with self._lock:
+            self._stop_watcher()
+            self._metrics = None
+        self.frameReady.emit(0, None)
+
+    def _stop_watcher(self):
+        if self._watcher is not None:
+            self._stop.set()
+            self._consumed.set()
+            if self._watcher is not threading.current_thread():
+                self._watcher.join()
+            self._watcher = None
+
+    def _watch(self, frames, stop):
+        """新しいフレームが公開されるたびに frameReady を送る"""
+        seq = 0
+        while not stop.is_set():
+            new_seq, frame = frames.wait_for_next(seq, timeout=0.1)
+            if frame is None:
+                continue
+            seq = new_seq
+            self._consumed.clear()
+            self.frameReady.emit(seq, frame)
+            # GUIスレッドが受け取るまで待つ (その間に公開されたフレームは次の wait_for_next でまとめて飛ばす)
+            self._consumed.wait(0.1)
+
+    def _on_frame(self, seq, frame):
+        metrics = self._metrics
+        if metrics is not None and self._seq and seq - self._seq > 1:
+            # 表示が追いつかずに上書きされたフレーム数を数える
+            metrics.count("display_dropped", seq - self._seq - 1)
+        self._seq = seq
+        self._frame = frame
+        self._consumed.set()
+        self.update()
+
+    def paintEvent(self, event):
+        metrics = self._metrics
+        with metrics.span("display") if metrics is not None else nullcontext():
+            painter = QPainter(self)
+            painter.fillRect(self.rect(), Qt.GlobalColor.black)
+            frame = self._frame
+            if frame is not None:
+                h, w = frame.shape[:2]
+                # BGR の配列をコピーせずに参照する (描画が終わるまで frame を保持しておく)
+                image = QImage(frame.data, w, h, frame.strides[0], QImage.Format.Format_BGR888)
+                scale = min(self.width() / w, self.height() / h)
+                target = QRectF((self.width() - w * scale) / 2, (self.height() - h * scale) / 2, w * scale, h * scale)
+                painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+                painter.drawImage(target, image)
+            painter.end()
+
+    def closeEvent(self, event):
+        with self._lock:
+            self._stop_watcher()
+        super().closeEvent(event)